@@ -1,52 +1,347 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import sqlite3
 import hashlib
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+import os
+import queue
+import threading
+import time
+from key_pool import RSAKeyPool
+from metrics import MetricsRegistry
 
 app = Flask(__name__)  # Crea un'istanza dell'applicazione Flask
 
 DATABASE = 'user_data.db'  # Nome del file di database SQLite
 
+DEFAULT_PAGE_SIZE = 50  # Numero predefinito di messaggi per pagina della cronologia
+MAX_PAGE_SIZE = 500  # Numero massimo di messaggi per pagina della cronologia
+MAX_MESSAGE_ID = 2 ** 63 - 1  # Valore di before_id usato per partire dai messaggi più recenti
+
+DB_POOL_SIZE = 16  # Numero massimo di connessioni SQLite inattive tenute aperte per le richieste successive
+
+_idle_connections = queue.LifoQueue(maxsize=DB_POOL_SIZE)  # Connessioni SQLite libere, riutilizzate dalle richieste
+_inherited_pools = []  # Connessioni ereditate dal processo padre dopo fork(): non vanno né usate né chiuse
+
+key_pool = RSAKeyPool(key_size=2048)  # Chiavi RSA generate in anticipo per le nuove registrazioni
+
+# Metriche del server, esposte dall'endpoint /metrics
+metrics = MetricsRegistry()
+request_latency = metrics.histogram("http_request_seconds", "Durata delle richieste HTTP, per endpoint e metodo")
+responses = metrics.counter("http_responses_total", "Risposte HTTP, per endpoint e codice di stato")
+query_latency = metrics.histogram("sqlite_query_seconds", "Durata dell'esecuzione delle istruzioni SQLite, per tipo")
+metrics.gauge("rsa_key_pool_available", "Coppie di chiavi RSA pronte per le registrazioni", function=key_pool.available)
+metrics.gauge("http_threads", "Thread attivi nel processo del server", function=threading.active_count)
+connections_opened = metrics.counter("sqlite_connections_opened_total", "Connessioni SQLite aperte dal server")
+metrics.gauge("sqlite_idle_connections", "Connessioni SQLite libere nella riserva",
+              function=lambda: _idle_connections.qsize())
+
+# Migrazioni dello schema, applicate in ordine; PRAGMA user_version registra l'ultima applicata
+MIGRATIONS = [
+    # 1: tabelle iniziali degli utenti e dei messaggi privati
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        private_key TEXT NOT NULL,
+        public_key TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS private_chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        message TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 2: indice composto per la cronologia di una conversazione: ogni verso (sender, receiver)
+    # diventa una scansione per intervallo già ordinata per id
+    '''
+    CREATE INDEX IF NOT EXISTS idx_private_chats_pair ON private_chats (sender, receiver, id);
+    ''',
+    # 3: conversazioni con id interi. I nomi utente sono salvati una sola volta nella tabella names;
+    # ogni conversazione (privata o di gruppo) è identificata dagli id dei partecipanti in ordine
+    # crescente, e i messaggi sono ordinati per (conversation_id, id): la cronologia di una
+    # conversazione è una sola scansione per intervallo. Gli id dei messaggi esistenti non cambiano,
+    # così le cache locali dei client restano valide; i messaggi senza mittente o destinatario, che
+    # nessuna richiesta poteva restituire, non vengono copiati
+    '''
+    CREATE TABLE names (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE conversations (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        member_key TEXT NOT NULL,
+        UNIQUE (kind, member_key)
+    );
+    CREATE TABLE conversation_members (
+        user_id INTEGER NOT NULL,
+        conversation_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, conversation_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE messages (
+        conversation_id INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        sender_id INTEGER NOT NULL,
+        message TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (conversation_id, id)
+    ) WITHOUT ROWID;
+    CREATE UNIQUE INDEX idx_messages_id ON messages (id);
+
+    INSERT OR IGNORE INTO names (name)
+        SELECT sender FROM private_chats WHERE sender IS NOT NULL
+        UNION SELECT receiver FROM private_chats WHERE receiver IS NOT NULL;
+    CREATE TEMP TABLE legacy_messages AS
+        SELECT p.id, s.id AS sender_id, r.id AS receiver_id, p.message, p.timestamp,
+               CASE WHEN s.id = r.id THEN CAST(s.id AS TEXT) ELSE MIN(s.id, r.id) || ',' || MAX(s.id, r.id) END AS member_key
+        FROM private_chats AS p
+        JOIN names AS s ON s.name = p.sender
+        JOIN names AS r ON r.name = p.receiver;
+    INSERT INTO conversations (kind, member_key) SELECT DISTINCT 'private', member_key FROM legacy_messages;
+    INSERT OR IGNORE INTO conversation_members (user_id, conversation_id)
+        SELECT l.sender_id, c.id FROM legacy_messages AS l
+        JOIN conversations AS c ON c.kind = 'private' AND c.member_key = l.member_key
+        UNION SELECT l.receiver_id, c.id FROM legacy_messages AS l
+        JOIN conversations AS c ON c.kind = 'private' AND c.member_key = l.member_key;
+    INSERT INTO messages (conversation_id, id, sender_id, message, timestamp)
+        SELECT c.id, l.id, l.sender_id, l.message, l.timestamp FROM legacy_messages AS l
+        JOIN conversations AS c ON c.kind = 'private' AND c.member_key = l.member_key;
+    DROP TABLE legacy_messages;
+    DROP TABLE private_chats;
+    ''',
+    # 4: indice full-text dei messaggi (FTS5), aggiornato dai trigger a ogni inserimento, modifica o
+    # cancellazione. L'indice non duplica il testo: lo legge dalla vista message_search_source, che
+    # aggiunge a ogni messaggio la parola "c<conversation_id>". Cercando anche questa parola la
+    # ricerca resta dentro le conversazioni dell'utente già nell'indice, senza leggere tutti i messaggi
+    # trovati; il rank (BM25) considera solo il testo. remove_diacritics fa trovare "perché" cercando
+    # "perche", prefix velocizza le ricerche per prefisso durante la digitazione. L'indice su
+    # conversation_members serve a elencare i partecipanti delle conversazioni trovate
+    '''
+    CREATE VIEW message_search_source AS
+        SELECT id, message, 'c' || conversation_id AS conversation FROM messages;
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        message, conversation, content='message_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, message, conversation)
+        VALUES (new.id, new.message, 'c' || new.conversation_id);
+    END;
+    CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message, conversation)
+        VALUES ('delete', old.id, old.message, 'c' || old.conversation_id);
+    END;
+    CREATE TRIGGER messages_fts_update AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message, conversation)
+        VALUES ('delete', old.id, old.message, 'c' || old.conversation_id);
+        INSERT INTO messages_fts (rowid, message, conversation)
+        VALUES (new.id, new.message, 'c' || new.conversation_id);
+    END;
+    INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+    INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)');
+    CREATE INDEX idx_conversation_members_conversation ON conversation_members (conversation_id, user_id);
+    ''',
+    # 5: identificativo del messaggio generato dal client (client_id), unico per mittente: un blocco di
+    # messaggi inviato di nuovo dopo un errore di rete (già salvato, ma senza risposta) non li duplica.
+    # I messaggi esistenti e quelli dei client che non lo indicano restano senza identificativo
+    '''
+    ALTER TABLE messages ADD COLUMN client_id TEXT;
+    CREATE UNIQUE INDEX idx_messages_client_id ON messages (sender_id, client_id) WHERE client_id IS NOT NULL;
+    ''',
+]
+
+CONVERSATION_PRIVATE = 'private'  # Conversazione tra due utenti (o di un utente con sé stesso)
+CONVERSATION_GROUP = 'group'  # Conversazione di gruppo
+
+DEFAULT_SEARCH_RESULTS = 20  # Numero predefinito di risultati per pagina della ricerca
+MAX_SEARCH_RESULTS = 100  # Numero massimo di risultati per pagina della ricerca
+
+
+# Tipo di un'istruzione SQL (SELECT, INSERT, ...), usato come etichetta delle metriche
+def statement_kind(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursore che registra in sqlite_query_seconds la durata di ogni esecuzione.
+
+    Per le SELECT la durata comprende la ricerca della prima riga, non la lettura delle successive.
+    """
+
+    def execute(self, sql, parameters=()):
+        with query_latency.time(statement=statement_kind(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with query_latency.time(statement=statement_kind(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with query_latency.time(statement="SCRIPT"):
+            return super().executescript(sql_script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connessione SQLite i cui cursori (anche quelli creati da execute) misurano la durata delle istruzioni."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # I metodi di scorciatoia della connessione non passano da cursor(): vanno reindirizzati esplicitamente
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def open_db():
+    """Apre e configura una nuova connessione SQLite."""
+    # Attende fino a 30 secondi se il database è bloccato; TimedConnection misura la durata delle query.
+    # La connessione passa da un thread all'altro tramite la riserva, ma è usata da una sola richiesta alla volta
+    conn = sqlite3.connect(DATABASE, timeout=30, factory=TimedConnection, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")  # I lettori non bloccano lo scrittore e viceversa
+    conn.execute("PRAGMA synchronous=NORMAL")  # In modalità WAL evita un fsync a ogni commit mantenendo l'integrità
+    conn.execute("PRAGMA cache_size=-20000")  # Circa 20 MB di cache delle pagine per connessione
+    conn.execute("PRAGMA temp_store=MEMORY")  # Ordinamenti e tabelle temporanee in memoria
+    connections_opened.inc()
+    return conn
+
 
 def get_db():
-    """Connette al database SQLite e restituisce l'oggetto di connessione."""
-    conn = sqlite3.connect(DATABASE)  # Connette al database
-    return conn  # Restituisce la connessione per operazioni successive
+    """Restituisce la connessione SQLite della richiesta corrente, presa dalla riserva se disponibile.
 
+    La connessione viene restituita alla riserva alla fine della richiesta (release_db) e
+    riutilizzata dalle richieste successive, qualunque sia il thread che le serve: il server di
+    sviluppo di Werkzeug crea un thread per ogni richiesta, quindi una connessione per thread
+    verrebbe riaperta (con il file e lo schema) a ogni richiesta.
+    """
+    conn = g.get('db')
+    if conn is None:
+        try:
+            conn = _idle_connections.get_nowait()
+        except queue.Empty:
+            conn = open_db()
+        g.db = conn
+    return conn
+
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Restituisce la connessione della richiesta alla riserva, annullando una transazione rimasta aperta per un errore."""
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _idle_connections.put_nowait(conn)
+    except queue.Full:  # Più richieste contemporanee che connessioni nella riserva: quelle in eccesso vengono chiuse
+        conn.close()
 
-def generate_rsa_keys(key_size=2048):
-    """Genera una coppia di chiavi RSA e le restituisce in formato PEM.
 
-    Parametri:
-        - key_size: Lunghezza della chiave RSA in bit (predefinito 2048).
+def reset_connections_after_fork():
+    """Nel processo figlio creato da fork() dimentica le connessioni SQLite del padre.
 
-    Restituisce:
-        - private_key_pem: Chiave privata in formato PEM.
-        - public_key_pem: Chiave pubblica in formato PEM.
+    Una connessione SQLite non può essere usata da due processi: il figlio apre le proprie al
+    primo utilizzo. Le connessioni ereditate restano in memoria senza essere chiuse, perché la
+    chiusura nel figlio interferirebbe con i lock del file di database tenuti dal padre.
     """
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,  # Esponente standard per RSA
-        key_size=key_size,  # Lunghezza della chiave
-        backend=default_backend()  # Backend per la generazione della chiave
-    )
-    public_key = private_key.public_key()  # Estrae la chiave pubblica dalla chiave privata
+    global _idle_connections
+    _inherited_pools.append(_idle_connections)
+    _idle_connections = queue.LifoQueue(maxsize=DB_POOL_SIZE)
 
-    # Serializza la chiave privata in formato PEM
-    private_key_pem = private_key.private_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,  # Usato per compatibilità
-        encryption_algorithm=serialization.NoEncryption()  # Chiave non criptata
-    ).decode('utf-8')
 
-    # Serializza la chiave pubblica in formato PEM
-    public_key_pem = public_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo  # Formato per chiave pubblica
-    ).decode('utf-8')
+os.register_at_fork(after_in_child=reset_connections_after_fork)
 
-    return private_key_pem, public_key_pem  # Restituisce entrambe le chiavi
+
+def init_db():
+    """Crea le tabelle se non esistono e applica le migrazioni dello schema non ancora eseguite."""
+    conn = open_db()  # Connessione usata solo qui, fuori da una richiesta: viene chiusa alla fine
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # Migrazione e numero di versione nella stessa transazione: un'interruzione non lascia lo schema a metà.
+        # PRAGMA non accetta parametri
+        conn.executescript(f"BEGIN; {migration}; PRAGMA user_version = {number}; COMMIT;")
+    conn.execute("PRAGMA optimize")  # Aggiorna le statistiche usate dal pianificatore delle query
+    conn.close()
+
+
+def name_ids(cursor, names, create=False):
+    """Restituisce un dizionario nome utente -> id intero della tabella names.
+
+    Con create=True i nomi non ancora presenti vengono aggiunti; altrimenti vengono omessi dal risultato.
+    """
+    names = set(names)
+    if create:
+        cursor.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)", [(name,) for name in names])
+    placeholders = ",".join("?" * len(names))
+    cursor.execute(f"SELECT name, id FROM names WHERE name IN ({placeholders})", tuple(names))
+    return dict(cursor.fetchall())
+
+
+# Chiave canonica di una conversazione: id dei partecipanti senza ripetizioni, in ordine crescente
+def member_key(member_ids):
+    return ",".join(str(member_id) for member_id in sorted(set(member_ids)))
+
+
+def find_conversation(cursor, kind, member_ids, create=False):
+    """Restituisce l'id della conversazione con i partecipanti indicati, o None se non esiste.
+
+    Parametri:
+        - kind: CONVERSATION_PRIVATE o CONVERSATION_GROUP.
+        - member_ids: Id (tabella names) dei partecipanti, in qualsiasi ordine.
+        - create: Se True, crea la conversazione se non esiste ancora.
+    """
+    key = member_key(member_ids)
+    if create:
+        # OR IGNORE: un altro processo potrebbe aver creato la stessa conversazione nel frattempo
+        cursor.execute("INSERT OR IGNORE INTO conversations (kind, member_key) VALUES (?, ?)", (kind, key))
+        if cursor.rowcount:
+            cursor.executemany("INSERT INTO conversation_members (user_id, conversation_id) VALUES (?, ?)",
+                               [(member_id, cursor.lastrowid) for member_id in set(member_ids)])
+    cursor.execute("SELECT id FROM conversations WHERE kind = ? AND member_key = ?", (kind, key))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# Tipo e partecipanti della conversazione di un messaggio: gruppo se è indicata la lista members
+def conversation_members(sender, receiver=None, members=None):
+    if members:
+        return CONVERSATION_GROUP, {sender, *members}
+    return CONVERSATION_PRIVATE, {sender, receiver}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exception=None):
+    """Registra durata e codice di stato di ogni richiesta, per endpoint (non per URL, che contiene i parametri).
+
+    Eseguita anche quando la vista solleva un'eccezione non gestita, per cui Flask non chiama le
+    funzioni after_request: queste richieste sono registrate con il codice 500.
+    """
+    started = g.pop('request_started', None)
+    status = 500 if exception is not None else g.pop('response_status', 500)
+    endpoint = request.endpoint or "unknown"
+    if started is not None:
+        request_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    responses.inc(endpoint=endpoint, status=status)
 
 
 @app.route('/register', methods=['POST'])
@@ -67,8 +362,8 @@ def register_user():
     # Crea l'hash della password usando SHA-256
     password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-    # Genera chiavi RSA per l'utente
-    private_key_pem, public_key_pem = generate_rsa_keys(key_size=2048)  # Specifica la lunghezza qui
+    # Prende una coppia di chiavi RSA già pronta; la registrazione si riduce all'inserimento nel database
+    private_key_pem, public_key_pem = key_pool.take()
 
     conn = get_db()
     cursor = conn.cursor()
@@ -79,10 +374,9 @@ def register_user():
         conn.commit()  # Conferma l'operazione
         return jsonify({"success": True, "message": f"User {username} registered successfully!"}), 201
     except sqlite3.IntegrityError:
+        conn.rollback()  # Annulla la transazione, la connessione viene riutilizzata
         # Ritorna un errore se il nome utente è già in uso
         return jsonify({"success": False, "message": "Username already exists!"}), 409
-    finally:
-        conn.close()  # Chiude la connessione al database
 
 
 @app.route('/login', methods=['POST'])
@@ -118,85 +412,293 @@ def login_user():
 
 @app.route('/initialize_database', methods=['POST'])
 def initialize_database():
-    """Crea la tabella `private_chats` per i messaggi privati se non esiste già.
+    """Crea le tabelle dei messaggi se non esistono già e applica le migrazioni dello schema.
 
     Restituisce:
         - JSON con successo e messaggio.
     """
-    conn = get_db()
-    cursor = conn.cursor()
-    # Crea la tabella per i messaggi privati se non esiste
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS private_chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            message TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()  # Conferma la creazione della tabella
-    conn.close()  # Chiude la connessione
-    return jsonify({"success": True, "message": "Table private_chats initialized successfully!"}), 201
+    init_db()
+    return jsonify({"success": True, "message": "Database initialized successfully!"}), 201
 
 
 @app.route('/save_message', methods=['POST'])
 def save_message():
-    """Salva un messaggio privato nella tabella `private_chats`.
+    """Salva un messaggio di una conversazione privata o di gruppo.
 
     Corpo della richiesta:
         - sender: Mittente del messaggio.
-        - receiver: Destinatario del messaggio.
+        - receiver: Destinatario del messaggio (conversazione privata).
+        - members: Partecipanti della conversazione di gruppo, al posto di receiver.
         - message: Contenuto del messaggio.
+        - client_id: Identificativo generato dal client (facoltativo); un messaggio con un client_id già
+          salvato per lo stesso mittente viene ignorato.
 
     Restituisce:
-        - JSON con successo e messaggio.
+        - JSON con successo e messaggio (codice 400 se il messaggio non è valido).
     """
-    data = request.get_json()  # Ottiene i dati JSON dalla richiesta
-    sender = data.get('sender')
-    receiver = data.get('receiver')
-    message = data.get('message')
+    data = request.get_json(silent=True)  # Ottiene i dati JSON dalla richiesta
+    error = invalid_message(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    store_messages([data])
+    return jsonify({"success": True, "message": "Message saved successfully!"}), 201
 
-    conn = get_db()
-    cursor = conn.cursor()
 
-    # Inserisce il messaggio nel database
-    cursor.execute('''
-        INSERT INTO private_chats (sender, receiver, message)
-        VALUES (?, ?, ?)
-    ''', (sender, receiver, message))
-    conn.commit()  # Conferma l'inserimento
-    conn.close()
+@app.route('/save_messages', methods=['POST'])
+def save_messages():
+    """Salva più messaggi con un'unica transazione.
 
-    return jsonify({"success": True, "message": "Message saved successfully!"}), 201
+    Corpo della richiesta:
+        - messages: Lista di messaggi, ognuno con sender, receiver (oppure members per i gruppi), message e,
+          facoltativamente, timestamp (UTC, formato `YYYY-MM-DD HH:MM:SS`) dell'invio e client_id,
+          identificativo generato dal client: rende innocuo l'invio ripetuto dello stesso blocco.
+
+    Restituisce:
+        - JSON con successo, messaggio, numero di messaggi salvati e rejected, lista di coppie
+          [posizione nella lista, motivo] dei messaggi non validi, che vengono scartati senza
+          impedire il salvataggio degli altri (codice 400 se il corpo della richiesta non è valido).
+    """
+    data = request.get_json(silent=True)  # Ottiene i dati JSON dalla richiesta
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        return jsonify({"success": False, "message": "Missing messages list!"}), 400
+    # Un messaggio non valido verrebbe rifiutato anche a ogni nuovo tentativo: viene scartato, non blocca il blocco
+    errors = [invalid_message(message) for message in messages]
+    rejected = [[index, error] for index, error in enumerate(errors) if error]
+    valid = [message for message, error in zip(messages, errors) if not error]
+    store_messages(valid)
+    return jsonify({"success": True, "message": "Messages saved successfully!", "saved": len(valid),
+                    "rejected": rejected}), 201
+
+
+def invalid_message(message):
+    """Restituisce il motivo per cui un messaggio da salvare non è valido, oppure None se è valido."""
+    if not isinstance(message, dict):
+        return "Message must be an object"
+    if not isinstance(message.get('sender'), str) or not message['sender']:
+        return "Missing sender"
+    members = message.get('members')
+    if members is not None:
+        if not isinstance(members, list) or not members:
+            return "Members must be a non-empty list"
+        if not all(isinstance(name, str) and name for name in members):
+            return "Invalid member name"
+    elif not isinstance(message.get('receiver'), str) or not message['receiver']:
+        return "Missing receiver or members"
+    if not isinstance(message.get('message'), str):
+        return "Missing message"
+    if message.get('timestamp') is not None and not isinstance(message['timestamp'], str):
+        return "Invalid timestamp"
+    if message.get('client_id') is not None and not isinstance(message['client_id'], str):
+        return "Invalid client_id"
+    return None
+
+
+def store_messages(messages):
+    """Inserisce i messaggi nelle rispettive conversazioni, creandole se necessario, con un solo commit.
+
+    I messaggi con un client_id già salvato per lo stesso mittente vengono ignorati.
+    """
+    if not messages:
+        return
+    conn = get_db()
+    cursor = conn.cursor()
+    conversations = [conversation_members(m.get('sender'), m.get('receiver'), m.get('members')) for m in messages]
+    ids = name_ids(cursor, set().union(*(members for _, members in conversations)), create=True)
+
+    conversation_ids = {}  # Dizionario (tipo, partecipanti) -> id, per non cercare più volte la stessa conversazione
+    rows = []
+    for message, (kind, members) in zip(messages, conversations):
+        key = (kind, frozenset(members))
+        if key not in conversation_ids:
+            conversation_ids[key] = find_conversation(cursor, kind, [ids[name] for name in members], create=True)
+        rows.append((conversation_ids[key], ids[message.get('sender')], message.get('message'),
+                     message.get('timestamp'), message.get('client_id')))
+
+    # Gli id dei messaggi crescono in tutto il database (non solo nella conversazione), come richiesto
+    # dalle cache locali dei client; il massimo si legge dall'indice idx_messages_id. Se il client non
+    # indica l'orario di invio si usa quello corrente. Un messaggio già salvato da un invio precedente
+    # dello stesso blocco (stesso mittente e client_id) non viene inserito di nuovo
+    cursor.executemany('''
+        INSERT INTO messages (conversation_id, id, sender_id, message, timestamp, client_id)
+        VALUES (?, (SELECT COALESCE(MAX(id), 0) + 1 FROM messages), ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+        ON CONFLICT (sender_id, client_id) WHERE client_id IS NOT NULL DO NOTHING
+    ''', rows)
+    conn.commit()  # Conferma l'inserimento: una sola scrittura su disco per tutto il blocco
 
 
 @app.route('/load_messages', methods=['GET'])
 def load_messages():
-    """Carica i messaggi tra due utenti in ordine di timestamp.
+    """Carica una pagina dei messaggi di una conversazione, dal più recente al più vecchio (paginazione per chiave).
 
     Parametri della richiesta:
-        - user1: Uno degli utenti.
-        - user2: L'altro utente.
+        - user1: Uno degli utenti (conversazione privata).
+        - user2: L'altro utente (conversazione privata).
+        - members: Partecipanti della conversazione di gruppo separati da virgole, al posto di user1 e user2.
+        - before_id: Restituisce solo i messaggi con id minore di questo valore (facoltativo;
+          se assente parte dai messaggi più recenti).
+        - since_id: Restituisce solo i messaggi con id maggiore di questo valore, a partire dal più vecchio
+          (facoltativo; usato dai client per scaricare solo i messaggi nuovi rispetto alla propria cache).
+        - limit: Numero massimo di messaggi della pagina (predefinito 50, massimo 500).
 
     Restituisce:
-        - JSON con successo e lista di messaggi.
+        - JSON con successo, lista di messaggi [id, sender, message, timestamp] in ordine cronologico,
+          has_more (True se esistono altri messaggi oltre la pagina: più vecchi, oppure più recenti se è
+          indicato since_id), next_before_id da usare per la pagina precedente e conversation_id
+          (None se la conversazione non ha ancora messaggi).
     """
-    user1 = request.args.get('user1')  # Ottiene user1 dai parametri della richiesta
-    user2 = request.args.get('user2')  # Ottiene user2 dai parametri della richiesta
+    members = request.args.get('members')
+    if members:
+        kind, usernames = CONVERSATION_GROUP, set(members.split(','))
+    else:
+        kind, usernames = CONVERSATION_PRIVATE, {request.args.get('user1'), request.args.get('user2')}
+    before_id = request.args.get('before_id', default=MAX_MESSAGE_ID, type=int)
+    since_id = request.args.get('since_id', type=int)
+    limit = max(1, min(request.args.get('limit', default=DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+    cursor = get_db().cursor()
+    ids = name_ids(cursor, usernames)
+    conversation_id = find_conversation(cursor, kind, ids.values()) if len(ids) == len(usernames) else None
+    if conversation_id is None:  # Uno dei partecipanti non ha mai scritto: la conversazione non esiste
+        return jsonify({"success": True, "messages": [], "has_more": False, "next_before_id": None,
+                        "conversation_id": None}), 200
+
+    if since_id is not None:
+        return load_messages_since(cursor, conversation_id, since_id, limit)
+
+    # Scansione all'indietro della chiave primaria (conversation_id, id) che si ferma dopo limit + 1 righe,
+    # quindi il costo non dipende dalla lunghezza della conversazione. La riga in più indica se esistono
+    # altre pagine; id cresce con l'ordine di inserimento come il timestamp
+    cursor.execute('''
+        SELECT m.id, n.name, m.message, m.timestamp FROM messages AS m
+        JOIN names AS n ON n.id = m.sender_id
+        WHERE m.conversation_id = ? AND m.id < ?
+        ORDER BY m.id DESC LIMIT ?
+    ''', (conversation_id, before_id, limit + 1))
+    rows = cursor.fetchall()  # Ottiene i messaggi della pagina
 
-    conn = get_db()
-    cursor = conn.cursor()
-    # Seleziona i messaggi scambiati tra user1 e user2
+    has_more = len(rows) > limit
+    messages = rows[:limit][::-1]  # Ordine cronologico, dal più vecchio al più recente
+    next_before_id = messages[0][0] if messages else None
+    return jsonify({"success": True, "messages": messages, "has_more": has_more,
+                    "next_before_id": next_before_id, "conversation_id": conversation_id}), 200
+
+
+def load_messages_since(cursor, conversation_id, since_id, limit):
+    """Restituisce i messaggi di una conversazione successivi a since_id, in ordine cronologico (sincronizzazione delta).
+
+    Come per la paginazione all'indietro, è una scansione in avanti della chiave primaria che si ferma dopo limit + 1 righe.
+    """
     cursor.execute('''
-        SELECT sender, message, timestamp FROM private_chats
-        WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
-        ORDER BY timestamp
-    ''', (user1, user2, user2, user1))
-    messages = cursor.fetchall()  # Ottiene tutti i messaggi trovati
-    conn.close()
+        SELECT m.id, n.name, m.message, m.timestamp FROM messages AS m
+        JOIN names AS n ON n.id = m.sender_id
+        WHERE m.conversation_id = ? AND m.id > ?
+        ORDER BY m.id LIMIT ?
+    ''', (conversation_id, since_id, limit + 1))
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > limit  # Ci sono altri messaggi nuovi: il client richiede la pagina successiva
+    messages = rows[:limit]
+    return jsonify({"success": True, "messages": messages, "has_more": has_more,
+                    "next_before_id": messages[0][0] if messages else None,
+                    "conversation_id": conversation_id}), 200
+
+
+# Trasforma il testo cercato dall'utente in una query FTS5: ogni parola deve comparire nel messaggio
+# (l'ultima anche come prefisso, per la ricerca durante la digitazione). Le parole sono tra virgolette,
+# così caratteri come " - * : non vengono interpretati come operatori
+def fts_query(text):
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+@app.route('/search_messages', methods=['GET'])
+def search_messages():
+    """Cerca nei messaggi delle conversazioni di un utente, dal risultato più pertinente (BM25).
 
-    return jsonify({"success": True, "messages": messages}), 200
+    Parametri della richiesta:
+        - username: Utente che esegue la ricerca; sono considerate solo le conversazioni di cui fa parte.
+        - q: Testo da cercare.
+        - peer: Limita la ricerca alla conversazione privata con questo utente (facoltativo).
+        - members: Limita la ricerca alla conversazione di gruppo con questi partecipanti, separati
+          da virgole (facoltativo).
+        - limit: Numero massimo di risultati della pagina (predefinito 20, massimo 100).
+        - offset: Numero di risultati da saltare, per le pagine successive (predefinito 0).
+
+    Restituisce:
+        - JSON con successo, lista dei risultati (id, conversation_id, kind, members, sender, message,
+          snippet con le parole trovate tra [ e ], timestamp), has_more e next_offset.
+    """
+    username = request.args.get('username')
+    query = fts_query(request.args.get('q', ''))
+    if not username or not query:
+        return jsonify({"success": False, "message": "Missing username or search query!"}), 400
+    limit = max(1, min(request.args.get('limit', default=DEFAULT_SEARCH_RESULTS, type=int), MAX_SEARCH_RESULTS))
+    offset = max(0, request.args.get('offset', default=0, type=int))
+    no_results = {"success": True, "results": [], "has_more": False, "next_offset": None}
+
+    cursor = get_db().cursor()
+    caller_id = name_ids(cursor, [username]).get(username)
+    if caller_id is None:  # L'utente non ha mai scritto: non fa parte di nessuna conversazione
+        return jsonify(no_results), 200
+
+    if request.args.get('members') or request.args.get('peer'):
+        # Una sola conversazione: quella con i partecipanti indicati, che comprende sempre chi cerca
+        if request.args.get('members'):
+            kind, usernames = CONVERSATION_GROUP, {username, *request.args['members'].split(',')}
+        else:
+            kind, usernames = CONVERSATION_PRIVATE, {username, request.args['peer']}
+        ids = name_ids(cursor, usernames)
+        conversation_id = find_conversation(cursor, kind, ids.values()) if len(ids) == len(usernames) else None
+        conversation_ids = [conversation_id] if conversation_id is not None else []
+    else:
+        cursor.execute("SELECT conversation_id FROM conversation_members WHERE user_id = ?", (caller_id,))
+        conversation_ids = [row[0] for row in cursor.fetchall()]
+    if not conversation_ids:
+        return jsonify(no_results), 200
+    scope = " OR ".join(f'"c{conversation_id}"' for conversation_id in conversation_ids)
+
+    # L'indice FTS5 interseca le parole cercate con le conversazioni consentite e ordina i messaggi
+    # trovati per pertinenza (rank = BM25); solo i messaggi della pagina vengono poi letti dalla tabella
+    try:
+        cursor.execute('''
+            SELECT m.id, m.conversation_id, n.name, m.message,
+                   snippet(messages_fts, 0, '[', ']', '…', 12), m.timestamp
+            FROM messages_fts
+            JOIN messages AS m ON m.id = messages_fts.rowid
+            JOIN names AS n ON n.id = m.sender_id
+            WHERE messages_fts MATCH ?
+            ORDER BY rank LIMIT ? OFFSET ?
+        ''', (f"message : ({query}) AND conversation : ({scope})", limit + 1, offset))
+    except sqlite3.OperationalError as e:  # Query non valida per FTS5
+        return jsonify({"success": False, "message": f"Invalid search query: {e}"}), 400
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Tipo e partecipanti delle conversazioni dei risultati, con una sola query
+    conversation_ids = sorted({row[1] for row in rows})
+    conversations = {}
+    if conversation_ids:
+        placeholders = ",".join("?" * len(conversation_ids))
+        cursor.execute(f'''
+            SELECT c.id, c.kind, n.name FROM conversations AS c
+            JOIN conversation_members AS cm ON cm.conversation_id = c.id
+            JOIN names AS n ON n.id = cm.user_id
+            WHERE c.id IN ({placeholders})
+        ''', conversation_ids)
+        for conversation_id, kind, name in cursor.fetchall():
+            conversations.setdefault(conversation_id, {"kind": kind, "members": []})["members"].append(name)
+
+    results = [{"id": message_id, "conversation_id": conversation_id,
+                "kind": conversations[conversation_id]["kind"],
+                "members": sorted(conversations[conversation_id]["members"]),
+                "sender": sender, "message": message, "snippet": snippet, "timestamp": timestamp}
+               for message_id, conversation_id, sender, message, snippet, timestamp in rows]
+    return jsonify({"success": True, "results": results, "has_more": has_more,
+                    "next_offset": offset + limit if has_more else None}), 200
 
 
 @app.route('/get_public_key/<username>', methods=['GET'])
@@ -214,7 +716,6 @@ def get_public_key(username):
     # Cerca la chiave pubblica dell'utente
     cursor.execute("SELECT public_key FROM users WHERE username=?", (username,))
     result = cursor.fetchone()
-    conn.close()
 
     if result:
         return jsonify({"public_key": result[0]}), 200
@@ -222,6 +723,21 @@ def get_public_key(username):
         return jsonify({"error": "User not found"}), 404
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Restituisce le metriche del server: durata delle richieste per endpoint, durata delle query SQLite e stato del pool delle chiavi.
+
+    Parametri della query:
+        - format: "json" per un documento JSON; se assente, il formato testuale di Prometheus.
+
+    Restituisce:
+        - Le metriche nel formato richiesto.
+    """
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot()), 200
+    return Response(metrics.render_text(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/get_private_key/<username>', methods=['GET'])
 def get_private_key(username):
     """Ottiene solo la chiave privata di un utente.
@@ -237,7 +753,6 @@ def get_private_key(username):
     # Cerca la chiave privata dell'utente
     cursor.execute("SELECT private_key FROM users WHERE username=?", (username,))
     result = cursor.fetchone()
-    conn.close()
 
     if result:
         return jsonify({"private_key": result[0]}), 200
@@ -246,30 +761,9 @@ def get_private_key(username):
 
 
 if __name__ == '__main__':
-    # Crea il database e le tabelle `users` e `private_chats` se non esistono
-    conn = get_db()
-    cursor = conn.cursor()
-    # Crea la tabella `users` per gli utenti se non esiste
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            private_key TEXT NOT NULL,
-            public_key TEXT NOT NULL
-        )
-    ''')
-    # Crea la tabella `private_chats` per i messaggi privati se non esiste
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS private_chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            message TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()  # Conferma la creazione delle tabelle
-    conn.close()
+    # Crea il database e le tabelle degli utenti e dei messaggi se non esistono e applica le migrazioni
+    init_db()
+    # Avvia la generazione delle chiavi in background prima che il server inizi a creare thread
+    key_pool.start()
 
     app.run(host='0.0.0.0', port=5003)  # Esegue l'applicazione su tutte le interfacce di rete alla porta 5003
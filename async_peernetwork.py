@@ -0,0 +1,246 @@
+import asyncio
+import socket
+import threading
+import time
+from peer_core import PeerCore
+from protocol import FrameDecoder, ProtocolError
+from discovery import open_discovery_socket
+
+
+# Protocollo UDP per la scoperta dei peer: passa gli annunci ricevuti ad AsyncPeerCore
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, network):
+        self.network = network  # Istanza di AsyncPeerCore che riceve gli annunci
+
+    def datagram_received(self, data, addr):
+        self.network.discovery_datagram_received(data, addr)
+
+    def error_received(self, exc):
+        print(f"Errore durante la ricezione: {exc}")
+
+
+# La classe AsyncPeerCore è un motore alternativo a PeerCore basato su asyncio.
+# Server TCP, scoperta UDP, scadenza dei peer e invii in uscita girano tutti su un unico
+# event loop in un thread in background: le connessioni in ingresso non richiedono
+# un thread ciascuna. Il contratto (subscribe, event_queue, send_message, send_frame,
+# get_ip_by_username, get_connected_ips) resta lo stesso; come PeerCore non dipende da PyQt5
+# e per l'interfaccia grafica viene usato tramite l'adattatore AsyncPeerNetwork di peernetwork.py.
+class AsyncPeerCore(PeerCore):
+    def __init__(self, broadcast_ip="172.20.10.15", port=5000, buffer_size=1024, peer_timeout=10,
+                 connect_timeout=3.0, idle_timeout=60.0, **kwargs):
+        super().__init__(broadcast_ip, port, buffer_size, peer_timeout, **kwargs)
+        self.connection_pool = None  # Le connessioni in uscita sono gestite direttamente sull'event loop
+        self.connect_timeout = connect_timeout  # Tempo massimo per stabilire una connessione in uscita
+        self.idle_timeout = idle_timeout  # Tempo di inattività dopo il quale una connessione in uscita viene chiusa
+        self.loop = None  # Event loop asyncio, creato al primo utilizzo
+        self._loop_thread = None  # Thread in background che esegue l'event loop
+        self._loop_lock = threading.Lock()  # Evita che due thread creino due event loop
+        self._tasks = []  # Task periodici (annuncio di presenza, chiusura delle connessioni inutilizzate)
+        self._expiry_handle = None  # Timer dell'event loop impostato sulla prossima scadenza di un peer
+        self._servers = []  # Server TCP in ascolto
+        self._discovery_transport = None  # Socket UDP per annunci e ascolto dei peer
+        self._connections = {}  # Dizionario (ip, porta) -> (reader, writer) delle connessioni in uscita
+        self._send_locks = {}  # Dizionario (ip, porta) -> asyncio.Lock, mantiene l'ordine degli invii verso un peer
+        self._last_used = {}  # Dizionario (ip, porta) -> istante dell'ultimo invio
+
+    # Avvia l'event loop in un thread in background, se non è già attivo
+    def _ensure_loop(self):
+        with self._loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+                self._loop_thread.start()
+        return self.loop
+
+    # Esegue una coroutine sull'event loop a partire da un thread qualsiasi
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    # Funzione per avviare la rete peer-to-peer
+    def start(self, username):
+        self.running = True
+        self.start_stats_reporter(username)
+        self.open_outbox(username)
+        self._submit(self._start_discovery(username)).result()
+        self.start_public_channel()  # Il canale pubblico ha un proprio thread, indipendente dall'event loop
+
+    async def _start_discovery(self, username):
+        loop = asyncio.get_running_loop()
+        self.discovery = self.create_discovery(username)
+        # Un solo socket UDP sia per inviare gli annunci sia per riceverli
+        sock = open_discovery_socket(self.PORT, self.MULTICAST_GROUP, self.BIND_IP)
+        sock.setblocking(False)
+        self._discovery_transport, _ = await loop.create_datagram_endpoint(lambda: DiscoveryProtocol(self), sock=sock)
+        print(f"Ascoltando sulla porta {self.PORT}...")
+        self._tasks.append(asyncio.create_task(self._broadcast_presence()))
+        self._tasks.append(asyncio.create_task(self._close_idle_connections()))
+
+    # Annuncia la propria presenza sulla rete: un HELLO all'avvio, poi annunci sempre più radi
+    async def _broadcast_presence(self):
+        datagram, addresses = self.discovery.hello()
+        while self.running and self.send_discovery(datagram, *addresses):
+            await asyncio.sleep(self.discovery.next_beacon_delay())
+            datagram, addresses = self.discovery.beacon()
+
+    # Invia un datagramma di scoperta sull'event loop a uno o più indirizzi; restituisce False in caso di errore
+    def send_discovery(self, datagram, *addresses):
+        try:
+            for address in addresses:
+                self._discovery_transport.sendto(datagram, address)
+        except Exception as e:
+            print(f"Errore durante il broadcast: {e}")
+            return False
+        return True
+
+    # Aggiorna il registro dei peer quando arriva un annuncio e invia le eventuali risposte (eseguita sull'event loop)
+    def discovery_datagram_received(self, data, addr):
+        for reply, address in self.discovery.datagram_received(data, addr):
+            self.send_discovery(reply, address)
+        self._schedule_expiry()
+
+    # Imposta un timer sulla prossima scadenza del registro, se anticipa quello già impostato
+    def _schedule_expiry(self):
+        delay = self.peers.next_expiry_delay()
+        if delay is None:
+            return
+        if self._expiry_handle is not None:
+            if self._expiry_handle.when() <= self.loop.time() + delay:
+                return
+            self._expiry_handle.cancel()
+        self._expiry_handle = self.loop.call_later(delay, self._expire_peers)
+
+    # Rimuove i peer scaduti; l'uscita di ciascuno viene notificata dal registro
+    def _expire_peers(self):
+        self._expiry_handle = None
+        self.peers.expire()
+        self._schedule_expiry()
+
+    # Chiamata dal registro sull'event loop: chiude le connessioni in uscita verso il peer disconnesso
+    def on_peer_left(self, peer_ip, username):
+        for address in [address for address in self._connections if address[0] == peer_ip]:
+            self._close_connection(address)
+        print(f"Peer {peer_ip} disconnesso. Peers connessi: {len(self.peers)}")
+        self._notify(self._on_peer_left, peer_ip, username)
+
+    # Chiude periodicamente le connessioni in uscita inutilizzate
+    async def _close_idle_connections(self):
+        while self.running:
+            await asyncio.sleep(self.idle_timeout / 4)
+            now = time.monotonic()
+            for address in [address for address, last_used in self._last_used.items()
+                            if now - last_used > self.idle_timeout]:
+                self._close_connection(address)
+
+    # Funzione per fermare la rete peer-to-peer
+    def stop(self):
+        self.running = False
+        print("Arresto della rete P2P...")
+        if self.loop is not None:
+            self._submit(self._shutdown()).result()
+        self.stop_public_channel()
+        self.stop_stats_reporter()
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        if self._expiry_handle is not None:
+            self._expiry_handle.cancel()
+            self._expiry_handle = None
+        for server in self._servers:
+            server.close()
+        self._servers.clear()
+        if self._discovery_transport is not None:
+            datagram, addresses = self.discovery.leave()
+            self.send_discovery(datagram, *addresses)  # Gli altri peer ci rimuovono subito, senza attendere la scadenza
+            self._discovery_transport.close()
+            self._discovery_transport = None
+        for address in list(self._connections):
+            self._close_connection(address)
+
+    # Avvia il server TCP sull'event loop; a differenza di PeerCore non blocca il thread chiamante.
+    # Il server accetta le connessioni appena aperto: aprirlo equivale ad avviarlo
+    def start_peer_server(self, port):
+        self._submit(self._start_server(port)).result()
+
+    open_peer_server = start_peer_server
+
+    async def _start_server(self, port):
+        if any(server.sockets[0].getsockname()[1] == port for server in self._servers if server.sockets):
+            return  # Server già aperto da open_peer_server
+        server = await asyncio.start_server(self._handle_connection, self.BIND_IP or "0.0.0.0", port)
+        self._servers.append(server)
+        print(f"Ascoltando sulla porta {port}...")
+
+    # I nuovi tentativi di svuotare le caselle in uscita sono timer dell'event loop invece che del thread di controllo
+    def schedule_outbox_retry(self, username, delay):
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.retry_outbox, username)
+
+    # Gestisce una connessione in ingresso: una coroutine per connessione invece di un thread
+    async def _handle_connection(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        print(f"Connessione stabilita con {addr}")
+        decoder = FrameDecoder()
+        self._inbound_connections.inc()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:  # Il peer ha chiuso la connessione
+                    break
+                for frame in decoder.feed(data):
+                    self.handle_frame(frame)
+        except ProtocolError as e:
+            print(f"Frame non valido, connessione chiusa: {e}")
+        except Exception as e:
+            print(f"Errore durante la ricezione del messaggio: {e}")
+        finally:
+            self._inbound_connections.dec()
+            writer.close()
+
+    # Invia un frame già codificato e attende l'esito, sollevando un'eccezione in caso di errore.
+    # Non va chiamata dal thread dell'event loop
+    def deliver_frame(self, peer_ip, peer_port, data):
+        self._submit(self._send((peer_ip, peer_port), self.encode_for_peer(peer_ip, data))).result()
+
+    # Invia un frame già codificato; può essere chiamata da qualsiasi thread e non attende l'esito
+    def send_frame(self, peer_ip, peer_port, data):
+        self._submit(self._send_logged((peer_ip, peer_port), self.encode_for_peer(peer_ip, data)))
+
+    async def _send_logged(self, address, data):
+        try:
+            await self._send(address, data)
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"Errore durante l'invio del messaggio: {e!r}")
+
+    async def _send(self, address, data):
+        started = time.perf_counter()
+        lock = self._send_locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            for attempt in range(2):
+                try:
+                    connection = self._connections.get(address)
+                    # Il loop legge continuamente il socket: se il peer ha chiuso, il reader è già in EOF
+                    if connection is None or connection[0].at_eof() or connection[1].is_closing():
+                        self._close_connection(address)
+                        connect_started = time.perf_counter()
+                        connection = await asyncio.wait_for(asyncio.open_connection(*address), self.connect_timeout)
+                        self._connect_latency.observe(time.perf_counter() - connect_started)
+                        connection[1].get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        self._connections[address] = connection
+                    connection[1].write(data)
+                    await connection[1].drain()
+                    self._last_used[address] = time.monotonic()
+                    self._record_send(data, started)
+                    return
+                except (OSError, asyncio.TimeoutError):
+                    self._close_connection(address)  # Verrà ricreata al prossimo tentativo
+                    if attempt == 1:
+                        self._record_send(data, started, failed=True)
+                        raise
+
+    # Chiude e dimentica la connessione in uscita verso un indirizzo
+    def _close_connection(self, address):
+        connection = self._connections.pop(address, None)
+        self._last_used.pop(address, None)
+        if connection is not None:
+            connection[1].close()
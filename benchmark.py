@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import ipaddress
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from peer_core import PeerCore
+from async_peernetwork import AsyncPeerCore
+from protocol import encode_frame, MSG_PRIVATE_MESSAGE, MSG_GROUP_MESSAGE, MSG_PUBLIC
+
+# Banco di prova della rete peer-to-peer su una sola macchina Linux.
+#
+# Avvia N istanze di PeerCore (o AsyncPeerCore), senza PyQt5, ognuna su un
+# proprio indirizzo di loopback (127.0.0.2, 127.0.0.3, ...) con le porte standard: il registro
+# dei peer identifica i peer per indirizzo IP, quindi istanze distinte devono avere indirizzi
+# distinti. La scoperta usa gli annunci in unicast verso gli altri indirizzi (discovery_targets),
+# perché il multicast non attraversa l'interfaccia di loopback; per lo stesso motivo i messaggi
+# pubblici usano il fan-out TCP invece del canale multicast.
+#
+# Ogni istanza invia tutti i messaggi tramite il fan-out, che mantiene l'ordine verso ogni
+# destinatario senza bloccare il mittente. Il risultato è un documento JSON con messaggi al
+# secondo, latenza end-to-end (p50/p99), tempo di convergenza della scoperta, numero di thread
+# e memoria residente del processo.
+#
+# Esempio: python benchmark.py --peers 8 --private 200 --group 50 --public 20 --output risultati.json
+
+PEER_SERVER_PORT = 5001  # Porta TCP dei peer, la stessa usata da MessageApp e dal fan-out
+FILLER_TEXT = "Messaggio di prova della chat peer-to-peer. "  # Testo ripetuto per raggiungere la dimensione richiesta
+
+
+class LatencyRecorder:
+    """Istanti di invio dei messaggi di prova e latenze misurate alla consegna, condivisi tra i thread.
+
+    Ogni messaggio porta un identificativo univoco; alla consegna la latenza è la differenza
+    tra l'istante di ricezione e quello di invio (stesso orologio, stesso processo).
+    """
+
+    def __init__(self):
+        self.sent = {}  # Dizionario identificativo -> (tipo di traffico, istante di invio)
+        self.latencies = {"private": [], "group": [], "public": []}  # Latenze in secondi per tipo di traffico
+        self.expected = 0  # Consegne attese in totale
+        self.delivered = 0  # Consegne avvenute in totale
+        self.first_sent = None  # Istante del primo invio
+        self.last_delivered = None  # Istante dell'ultima consegna
+        self.done = threading.Event()  # Impostato quando tutte le consegne attese sono avvenute
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def new_token(self, kind, recipients):
+        """Registra un nuovo messaggio con il numero di destinatari previsti e ne restituisce l'identificativo."""
+        token = f"{kind[0]}{next(self._counter)}"
+        with self._lock:
+            now = time.perf_counter()
+            self.sent[token] = (kind, now)
+            self.expected += recipients
+            if self.first_sent is None:
+                self.first_sent = now
+        return token
+
+    def delivered_token(self, token):
+        """Registra la consegna di un messaggio a un destinatario."""
+        now = time.perf_counter()
+        with self._lock:
+            entry = self.sent.get(token)
+            if entry is None:
+                return  # Frame estraneo al banco di prova (ad esempio una notifica di chiusura)
+            kind, sent_at = entry
+            self.latencies[kind].append(now - sent_at)
+            self.delivered += 1
+            self.last_delivered = now
+            if self.delivered >= self.expected:
+                self.done.set()
+
+    def mark_all_sent(self):
+        """Da chiamare quando tutti i messaggi sono stati inviati: da quel momento il totale atteso è definitivo."""
+        with self._lock:
+            if self.delivered >= self.expected:
+                self.done.set()
+
+
+# Restituisce il percentile q (0-100) di una lista di valori, con il metodo del rango più vicino
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(-(-q * len(ordered) // 100)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# Riassume una lista di latenze in millisecondi
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        "max_ms": round(max(values) * 1000, 3) if values else None,
+    }
+
+
+# Legge dal file /proc/self/status la memoria residente attuale e massima del processo, in kB (solo Linux)
+def read_memory():
+    memory = {"rss_kb": None, "peak_rss_kb": None}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    memory["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_kb"] = int(line.split()[1])
+    except OSError:
+        pass
+    return memory
+
+
+# Stato del processo in un dato momento: thread attivi e memoria
+def process_sample():
+    return {"threads": threading.active_count(), **read_memory()}
+
+
+# Restituisce il testo di un messaggio di prova: identificativo seguito dal testo di riempimento
+def message_text(token, size):
+    padding = (FILLER_TEXT * (size // len(FILLER_TEXT) + 1))[:max(size - len(token) - 1, 0)]
+    return f"{token} {padding}"
+
+
+class BenchmarkPeer:
+    """Un'istanza della rete peer-to-peer del banco di prova, con il proprio utente e indirizzo di loopback."""
+
+    def __init__(self, index, ip, all_ips, args, recorder):
+        self.index = index
+        self.ip = ip
+        self.username = f"peer{index}"
+        self.recorder = recorder
+        network_class = AsyncPeerCore if args.engine == "asyncio" else PeerCore
+        self.network = network_class(port=args.port, peer_timeout=args.peer_timeout, multicast_group=None,
+                                     bind_ip=ip, discovery_targets=[other for other in all_ips if other != ip],
+                                     stats_interval=None, store_and_forward=False)
+        self.network.subscribe(on_message=self.on_frame)  # Chiamata nel thread di rete che riceve il frame
+
+    def start(self):
+        if isinstance(self.network, AsyncPeerCore):
+            self.network.start_peer_server(PEER_SERVER_PORT)  # Non blocca: il server gira sull'event loop
+        else:
+            self.network.open_peer_server(PEER_SERVER_PORT)  # La porta è aperta prima dell'annuncio della presenza
+            threading.Thread(target=self.network.start_peer_server, args=(PEER_SERVER_PORT,), daemon=True).start()
+        self.network.start(self.username)
+
+    def stop(self):
+        self.network.stop()
+
+    # Funzione chiamata per ogni frame ricevuto: estrae l'identificativo e registra la latenza
+    def on_frame(self, frame):
+        try:
+            if frame.msg_type == MSG_PRIVATE_MESSAGE:
+                token = frame.text(1)  # L'identificativo viaggia al posto di quello della chiave di sessione
+            elif frame.msg_type in (MSG_GROUP_MESSAGE, MSG_PUBLIC):
+                token = frame.text(1).split(" ", 1)[0]
+            else:
+                return
+        except (IndexError, UnicodeDecodeError):
+            return
+        self.recorder.delivered_token(token)
+
+    def send_private(self, target, size):
+        token = self.recorder.new_token("private", 1)
+        # Il corpo casuale simula il testo cifrato, che non si comprime
+        data = encode_frame(MSG_PRIVATE_MESSAGE, self.username, token, os.urandom(size))
+        self.network.fanout.send([target.username], data)
+
+    def send_group(self, members, size):
+        others = [member.username for member in members if member is not self]
+        token = self.recorder.new_token("group", len(others))
+        self.network.fanout.send(others, encode_frame(MSG_GROUP_MESSAGE, self.username, message_text(token, size)))
+
+    def send_public(self, peer_count, size):
+        token = self.recorder.new_token("public", peer_count - 1)
+        self.network.send_public(encode_frame(MSG_PUBLIC, self.username, message_text(token, size)))
+
+
+# Attende che ogni istanza conosca tutte le altre; restituisce i secondi impiegati o None allo scadere del timeout
+def wait_for_convergence(peers, started_at, timeout):
+    expected = len(peers) - 1
+    while time.perf_counter() - started_at < timeout:
+        if all(len(peer.network.peers) >= expected for peer in peers):
+            return time.perf_counter() - started_at
+        time.sleep(0.005)
+    return None
+
+
+# Genera il traffico di un'istanza: messaggi privati, di gruppo e pubblici alternati, al ritmo richiesto
+def drive_traffic(peer, peers, args):
+    count = len(peers)
+    group_size = min(args.group_size, count)
+    # Il gruppo di ogni istanza comprende lei stessa e le istanze successive, in modo circolare
+    members = [peers[(peer.index + offset) % count] for offset in range(group_size)]
+    # I tre tipi di traffico si alternano finché ognuno non ha raggiunto il proprio numero di messaggi
+    schedule = [kind for batch in itertools.zip_longest(["private"] * args.private, ["group"] * args.group,
+                                                          ["public"] * args.public) for kind in batch if kind]
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    next_send = time.perf_counter()
+    for number, kind in enumerate(schedule):
+        if interval:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_send += interval
+        if kind == "private":
+            target = peers[(peer.index + 1 + number % (count - 1)) % count]  # Destinatari a rotazione
+            peer.send_private(target, args.size)
+        elif kind == "group":
+            peer.send_group(members, args.size)
+        else:
+            peer.send_public(count, args.size)
+
+
+def run_benchmark(args):
+    """Esegue il banco di prova e restituisce il dizionario dei risultati."""
+    first_ip = ipaddress.IPv4Address(args.first_ip)
+    ips = [str(first_ip + offset) for offset in range(args.peers)]
+    recorder = LatencyRecorder()
+    baseline = process_sample()
+
+    peers = [BenchmarkPeer(index, ip, ips, args, recorder) for index, ip in enumerate(ips)]
+    started_at = time.perf_counter()
+    for peer in peers:
+        peer.start()
+    convergence = wait_for_convergence(peers, started_at, args.timeout)
+    after_start = process_sample()
+
+    traffic_started = time.perf_counter()
+    senders = [threading.Thread(target=drive_traffic, args=(peer, peers, args), daemon=True) for peer in peers]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    recorder.mark_all_sent()
+    recorder.done.wait(args.timeout)
+    under_load = process_sample()
+
+    for peer in peers:
+        peer.stop()
+
+    elapsed = ((recorder.last_delivered or time.perf_counter()) - (recorder.first_sent or traffic_started))
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    compression = [peer.network.codec.stats.snapshot() for peer in peers]
+    return {
+        "config": {
+            "peers": args.peers,
+            "engine": args.engine,
+            "private_per_peer": args.private,
+            "group_per_peer": args.group,
+            "group_size": min(args.group_size, args.peers),
+            "public_per_peer": args.public,
+            "message_size": args.size,
+            "rate_per_peer": args.rate,
+            "first_ip": args.first_ip,
+        },
+        "platform": {"python": platform.python_version(), "system": platform.platform()},
+        "discovery": {
+            "converged": convergence is not None,
+            "convergence_s": round(convergence, 4) if convergence is not None else None,
+        },
+        "messages": {
+            "sent": len(recorder.sent),
+            "expected_deliveries": recorder.expected,
+            "delivered": recorder.delivered,
+            "lost": recorder.expected - recorder.delivered,
+            "elapsed_s": round(elapsed, 4),
+            "deliveries_per_s": round(recorder.delivered / elapsed, 1) if elapsed > 0 else None,
+        },
+        "latency": {
+            "all": summarize_latencies(all_latencies),
+            **{kind: summarize_latencies(values) for kind, values in recorder.latencies.items()},
+        },
+        "compression": {
+            "bytes_in": sum(stats["bytes_in"] for stats in compression),
+            "bytes_out": sum(stats["bytes_out"] for stats in compression),
+        },
+        "process": {"baseline": baseline, "after_start": after_start, "under_load": under_load},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Banco di prova della rete peer-to-peer su indirizzi di loopback.")
+    parser.add_argument("--peers", type=int, default=4, help="Numero di istanze da avviare (almeno 2)")
+    parser.add_argument("--engine", choices=("thread", "asyncio"), default="thread", help="Motore di rete")
+    parser.add_argument("--private", type=int, default=100, help="Messaggi privati inviati da ogni istanza")
+    parser.add_argument("--group", type=int, default=20, help="Messaggi di gruppo inviati da ogni istanza")
+    parser.add_argument("--group-size", type=int, default=4, help="Membri di ogni gruppo, mittente compreso")
+    parser.add_argument("--public", type=int, default=10, help="Messaggi pubblici inviati da ogni istanza")
+    parser.add_argument("--size", type=int, default=128, help="Dimensione del testo di ogni messaggio in byte")
+    parser.add_argument("--rate", type=float, default=0.0, help="Messaggi al secondo per istanza (0: senza limite)")
+    parser.add_argument("--first-ip", default="127.0.0.2", help="Primo indirizzo di loopback da assegnare")
+    parser.add_argument("--port", type=int, default=5000, help="Porta UDP della scoperta")
+    parser.add_argument("--peer-timeout", type=float, default=10, help="Secondi dopo i quali un peer silenzioso scade")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Attesa massima per la scoperta e per le consegne")
+    parser.add_argument("--output", help="File in cui scrivere il risultato JSON (predefinito: standard output)")
+    parser.add_argument("--verbose", action="store_true", help="Mostra i messaggi della rete su standard error")
+    args = parser.parse_args(argv)
+    if args.peers < 2:
+        parser.error("servono almeno 2 istanze")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # La rete stampa i propri eventi su standard output: vengono deviati per non mescolarli al JSON
+    log = sys.stderr if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(log):
+        result = run_benchmark(args)
+    document = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(document + "\n")
+    else:
+        print(document)
+    return 0 if result["discovery"]["converged"] and result["messages"]["lost"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,43 @@
-from PyQt5.QtWidgets import QWidget, QLineEdit, QPushButton, QVBoxLayout, QTextEdit
-from PyQt5.QtCore import pyqtSignal
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import hashes
+from PyQt5.QtWidgets import QWidget, QLineEdit, QPushButton, QVBoxLayout, QTextEdit, QListWidget, QListWidgetItem
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+import atexit
 import requests
+from protocol import encode_frame, MSG_GROUP_MESSAGE, MSG_PRIVATE_MESSAGE, MSG_SESSION_KEY, MSG_REKEY_REQUEST
+from session_crypto import SessionKeyError
+from key_cache import PublicKeyCache
+from local_store import data_path
+from message_buffer import MessageWriteBuffer
 BASE_URL = 'http://172.20.10.5:5003'  # Indirizzo API
+HISTORY_PAGE_SIZE = 50  # Numero di messaggi caricati per ogni pagina della cronologia
+SYNC_MAX_PAGES = 4  # Pagine di messaggi nuovi scaricate all'apertura di una chat; oltre, la chat riparte dai più recenti
+SEARCH_RESULTS = 20  # Numero massimo di risultati mostrati da una ricerca nella cronologia
 
-# Funzione per recuperare la chiave pubblica di un utente specifico dal database
+# Funzione per recuperare dal database la chiave pubblica di un utente, in formato PEM
+def fetch_public_key_pem(username):
+    """Richiede la chiave pubblica di un utente tramite l'API e la restituisce in formato PEM.
+
+    Restituisce None solo se l'utente non esiste (404); per gli altri errori solleva un'eccezione,
+    così la cache usa l'ultima chiave nota invece di considerarla mancante.
+    """
+    response = requests.get(f"{BASE_URL}/get_public_key/{username}", timeout=5) # Effettua una richiesta GET all'API per ottenere la chiave pubblica dell'utente specificato
+    if response.status_code == 404:  # L'utente non ha una chiave pubblica
+        return None
+    response.raise_for_status()  # Errore dell'API (ad esempio 5xx durante un disservizio)
+    return response.json().get("public_key")  # Estrae la chiave pubblica in formato PEM dal JSON della risposta
+
+# Cache delle chiavi pubbliche già deserializzate, condivisa da tutte le finestre di chat e salvata su disco
+public_key_cache = PublicKeyCache(fetch_public_key_pem, disk_path=data_path("public_keys.json"))
+
+# Funzione per ottenere la chiave pubblica di un utente specifico, dalla cache o dal database
 def get_public_key(username):
-    """Richiede la chiave pubblica di un utente tramite l'API."""
-    response = requests.get(f"{BASE_URL}/get_public_key/{username}") # Effettua una richiesta GET all'API per ottenere la chiave pubblica dell'utente specificato
-    if response.status_code == 200:  # Verifica se la risposta ha avuto successo (status code 200)
-        public_key_pem = response.json().get("public_key")  # Estrae la chiave pubblica in formato PEM dal JSON della risposta
-         # Se la chiave pubblica è presente, la converte in un oggetto di tipo 'public key'
-        if public_key_pem:
-            return serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
-         # Se non è riuscito a ottenere la chiave pubblica, ritorna None
-    return None
-# Funzione per recuperare la chiave privata di un utente specifico dal database
-def get_private_key(username):
-    """Richiede la chiave privata di un utente tramite l'API."""
-    response = requests.get(f"{BASE_URL}/get_private_key/{username}")  # Effettua una richiesta GET all'API per ottenere la chiave privata dell'utente specificato
-    if response.status_code == 200: # Verifica se la risposta ha avuto successo (status code 200)
-        private_key_pem = response.json().get("private_key")   # Estrae la chiave privata in formato PEM dal JSON della risposta
-        if private_key_pem:  # Se la chiave privata è presente, la converte in un oggetto di tipo 'private key'
-            print(f"Private key fetched successfully for {username}.")
-            return serialization.load_pem_private_key(private_key_pem.encode('utf-8'), password=None)
-         # Se non è riuscito a ottenere la chiave privata, stampa un messaggio di errore e ritorna None
-    print(f"Failed to fetch private key for {username}: {response.json().get('message', 'Unknown error')}")
-    return None
+    """Restituisce la chiave pubblica di un utente, richiedendola all'API solo se non è in cache."""
+    return public_key_cache.get(username)
 
+# Funzione per forzare il recupero della chiave pubblica di un utente al prossimo utilizzo
+def invalidate_public_key(username=None):
+    """Rimuove dalla cache la chiave pubblica di un utente (o di tutti gli utenti se username è None)."""
+    public_key_cache.invalidate(username)
 # Funzione per inizializzare il database, in particolare per creare la tabella "private_chats"
 def initialize_database():
     """Effettua una richiesta all'API per inizializzare la tabella private_chats."""
@@ -40,31 +48,207 @@ def initialize_database():
     else:  # In caso di errore, stampa un messaggio specifico o un messaggio di errore generico
         print("Failed to initialize database:", response.json().get("message", "Unknown error"))
 
-# Funzione per salvare un messaggio nel database inviandolo all'API
+# Funzione per salvare un blocco di messaggi nel database inviandolo all'API con una sola richiesta
+def save_messages_to_db(messages):
+    """Invia all'API una lista di messaggi in chiaro per salvarli nel database in un'unica transazione."""
+    response = requests.post(f"{BASE_URL}/save_messages", json={"messages": messages}, timeout=10)  # Effettua una richiesta POST all'API per salvare i messaggi nel database
+    response.raise_for_status()  # Solleva un'eccezione in caso di errore, così il buffer ritenta il salvataggio
+    result = response.json()
+    for index, error in result.get("rejected", []):  # Messaggi scartati dall'API: un nuovo tentativo non li salverebbe
+        print(f"Messaggio non salvato ({error}): {messages[index]}")
+    return result     # Restituisce la risposta JSON dell'API
+
+# Buffer di scrittura differita: i messaggi inviati vengono salvati in blocco, per dimensione o per tempo
+message_buffer = MessageWriteBuffer(save_messages_to_db)
+atexit.register(message_buffer.flush)  # Salva i messaggi rimasti nel buffer alla chiusura dell'applicazione
+
+# Funzione per salvare un messaggio nel database tramite il buffer di scrittura differita
 def save_message_to_db(sender, receiver, message):
-    """Invia un messaggio in chiaro all'API per salvarlo nel database."""
-    # Crea un dizionario con i dati del messaggio da inviare
-    data = {
-        "sender": sender,  # Mittente del messaggio
-        "receiver": receiver, # Destinatario del messaggio
-        "message": message  # Contenuto del messaggio
-    }
-    response = requests.post(f"{BASE_URL}/save_message", json=data)  # Effettua una richiesta POST all'API per salvare il messaggio nel database
-    return response.json()     # Restituisce la risposta JSON dell'API
+    """Accoda un messaggio in chiaro per il salvataggio nel database, senza bloccare."""
+    message_buffer.add(sender, receiver, message)
+
+# Funzione per salvare un messaggio di gruppo nel database tramite il buffer di scrittura differita
+def save_group_message_to_db(sender, members, message):
+    """Accoda un messaggio di gruppo per il salvataggio nel database; members sono i partecipanti del gruppo."""
+    message_buffer.add(sender, None, message, members=members)
 
-# Funzione per caricare i messaggi tra due utenti dal database utilizzando l'API
-def load_messages_from_db(user1, user2):
-    """Carica i messaggi tra due utenti dal database tramite l'API."""
-     # Crea un dizionario con i parametri per specificare gli utenti coinvolti nella conversazione
+# Funzione per caricare una pagina di messaggi tra due utenti dal database utilizzando l'API
+def load_messages_from_db(user1, user2, before_id=None, limit=HISTORY_PAGE_SIZE, since_id=None):
+    """Carica dal database tramite l'API i messaggi tra due utenti precedenti a before_id (o i più recenti).
+
+    Se è indicato since_id vengono invece caricati, dal più vecchio, solo i messaggi successivi a since_id.
+    Restituisce la lista dei messaggi [id, sender, message, timestamp] in ordine cronologico e
+    un valore booleano che indica se esistono altri messaggi oltre la pagina.
+    """
+     # Crea un dizionario con i parametri per specificare gli utenti coinvolti nella conversazione e la pagina richiesta
     params = {
         "user1": user1, # Primo utente
-        "user2": user2 # Secondo utente
+        "user2": user2, # Secondo utente
+        "limit": limit # Numero massimo di messaggi della pagina
     }
-    response = requests.get(f"{BASE_URL}/load_messages", params=params) # Effettua una richiesta GET all'API per ottenere i messaggi tra i due utenti
+    if before_id is not None:
+        params["before_id"] = before_id # Carica solo i messaggi più vecchi di quelli già mostrati
+    if since_id is not None:
+        params["since_id"] = since_id # Carica solo i messaggi più recenti di quelli già nella cache locale
+    response = requests.get(f"{BASE_URL}/load_messages", params=params, timeout=10) # Effettua una richiesta GET all'API per ottenere i messaggi tra i due utenti
     if response.status_code == 200:  # Se la risposta ha avuto successo (status code 200), restituisce i messaggi in formato JSON
-        return response.json()["messages"]
+        data = response.json()
+        return data["messages"], data.get("has_more", False)
     else:
-        return []  # In caso di errore, restituisce una lista vuota
+        return [], False  # In caso di errore, restituisce una lista vuota
+
+# Funzione per caricare una pagina di messaggi di una chat di gruppo dal database utilizzando l'API
+def load_group_messages_from_db(members, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """Carica dal database tramite l'API i messaggi del gruppo con i partecipanti indicati, precedenti a before_id.
+
+    Restituisce la lista dei messaggi [id, sender, message, timestamp] in ordine cronologico e
+    un valore booleano che indica se esistono messaggi più vecchi.
+    """
+    params = {"members": ",".join(sorted(set(members))), "limit": limit}
+    if before_id is not None:
+        params["before_id"] = before_id
+    response = requests.get(f"{BASE_URL}/load_messages", params=params, timeout=10)
+    if response.status_code == 200:
+        data = response.json()
+        return data["messages"], data.get("has_more", False)
+    return [], False
+
+# Funzione per cercare nei messaggi salvati di una conversazione utilizzando l'API
+def search_messages_in_db(username, query, peer=None, members=None, limit=SEARCH_RESULTS):
+    """Cerca tramite l'API i messaggi della conversazione con peer (o del gruppo members) che contengono query.
+
+    Restituisce la lista dei risultati, dal più pertinente: dizionari con id, sender, message,
+    snippet (le parole trovate sono tra [ e ]) e timestamp.
+    """
+    params = {"username": username, "q": query, "limit": limit}
+    if peer is not None:
+        params["peer"] = peer
+    if members is not None:
+        params["members"] = ",".join(members)
+    response = requests.get(f"{BASE_URL}/search_messages", params=params, timeout=10)
+    if response.status_code == 200:
+        return response.json()["results"]
+    return []
+
+# Funzione eseguita da un worker: scarica le pagine di cronologia precedenti fino a un messaggio trovato dalla ricerca
+def fetch_history_until(fetch_page, before_id, message_id):
+    """Restituisce i messaggi precedenti a before_id fino a message_id compreso, chiedendo a fetch_page una pagina alla volta.
+
+    fetch_page(before_id) restituisce una pagina in ordine cronologico e un valore booleano che indica se
+    esistono messaggi più vecchi; il risultato ha la stessa forma, con tutte le pagine unite.
+    """
+    messages, has_more = [], True
+    while has_more and (not messages or messages[0][0] > message_id):
+        page, has_more = fetch_page(messages[0][0] if messages else before_id)
+        if not page:
+            break
+        messages = page + messages
+    return messages, has_more
+
+# Funzione per selezionare e portare in vista la riga di un messaggio trovato dalla ricerca
+def highlight_message(text_edit, result):
+    """Seleziona nell'area di testo la riga del messaggio. Restituisce False se la riga non è mostrata."""
+    cursor = text_edit.document().find(f"{result['sender']} ({result['timestamp']}): {result['message']}")
+    if cursor.isNull():
+        return False
+    text_edit.setTextCursor(cursor)
+    text_edit.ensureCursorVisible()
+    return True
+
+# Funzione eseguita da un worker: restituisce una pagina di cronologia leggendo prima la cache locale
+def fetch_history_page(message_cache, username, peer, before_id, limit=HISTORY_PAGE_SIZE):
+    """Restituisce i messaggi con peer precedenti a before_id, completando dall'API quelli mancanti nella cache.
+
+    Le pagine scaricate vengono salvate nella cache, che resta così un intervallo continuo di messaggi.
+    Restituisce la lista dei messaggi in ordine cronologico e un valore booleano che indica se esistono
+    messaggi più vecchi.
+    """
+    cached = message_cache.page(peer, before_id, limit)
+    if len(cached) == limit:
+        return cached, True # Pagina completa dalla cache, nessuna richiesta all'API
+    server_before_id = cached[0][0] if cached else before_id
+    messages, has_more = load_messages_from_db(username, peer, server_before_id, limit - len(cached))
+    message_cache.store(peer, messages)
+    return messages + cached, has_more
+
+# Funzione eseguita da un worker: scarica dall'API solo i messaggi successivi all'ultimo presente nella cache
+def sync_new_messages(message_cache, username, peer, limit=500, max_pages=SYNC_MAX_PAGES):
+    """Sincronizza la cache locale con i messaggi nuovi scambiati con peer, scaricando al massimo max_pages pagine.
+
+    Restituisce i messaggi nuovi in ordine cronologico e un valore booleano che indica se la cache
+    è stata aggiornata fino all'ultimo messaggio.
+    """
+    since_id = message_cache.last_id(peer)
+    new_messages = []
+    if since_id is None:
+        return new_messages, True
+    for _ in range(max_pages):
+        messages, has_more = load_messages_from_db(username, peer, since_id=since_id, limit=limit)
+        message_cache.store(peer, messages)
+        new_messages.extend(messages)
+        if not has_more or not messages:
+            return new_messages, True
+        since_id = messages[-1][0] # Continua dall'ultimo messaggio ricevuto
+    return new_messages, False
+
+# Funzione eseguita da un worker all'apertura di una chat: restituisce la prima pagina da mostrare
+def open_history(message_cache, username, peer, limit=HISTORY_PAGE_SIZE):
+    """Restituisce gli ultimi messaggi con peer e un valore booleano che indica se esistono messaggi più vecchi.
+
+    Legge l'ultima pagina dalla cache locale e scarica dall'API solo i messaggi arrivati dopo. Se
+    dopo una lunga assenza i messaggi nuovi superano SYNC_MAX_PAGES pagine, la cache della
+    conversazione viene svuotata e viene restituita solo l'ultima pagina: i messaggi precedenti si
+    caricano scorrendo la chat.
+    """
+    cached = message_cache.page(peer, limit=limit)
+    if cached:
+        new_messages, caught_up = sync_new_messages(message_cache, username, peer)
+        if caught_up:
+            return cached + new_messages, True
+        message_cache.clear(peer)  # La cache deve restare un intervallo continuo di messaggi
+    return fetch_history_page(message_cache, username, peer, None, limit)
+
+
+# Casella di ricerca nella cronologia, usata dalle finestre di chat privata e di gruppo
+class MessageSearchBar(QWidget):
+    search_requested = pyqtSignal(str)  # Segnale emesso quando l'utente preme Invio: testo da cercare
+    result_selected = pyqtSignal(object)  # Segnale emesso quando l'utente sceglie un risultato (dizionario dell'API)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.input_query = QLineEdit()
+        self.input_query.setPlaceholderText("Search messages...")
+        self.input_query.returnPressed.connect(lambda: self.search_requested.emit(self.input_query.text().strip()))
+        layout.addWidget(self.input_query)
+        self.results = QListWidget()  # Risultati della ricerca, nascosti finché non si cerca qualcosa
+        self.results.setMaximumHeight(120)
+        self.results.hide()
+        self.results.itemClicked.connect(self.on_result_clicked)
+        layout.addWidget(self.results)
+        self.setLayout(layout)
+
+# Funzione per mostrare i risultati di una ricerca, dal più pertinente
+    def show_results(self, results):
+        self.results.clear()
+        for result in results:
+            item = QListWidgetItem(f"{result['sender']} ({result['timestamp']}): {result['snippet']}")
+            item.setData(Qt.UserRole, result)
+            self.results.addItem(item)
+        if not results:
+            self.results.addItem("No messages found")
+        self.results.show()
+
+# Funzione per nascondere i risultati, ad esempio quando la casella di ricerca viene svuotata
+    def clear_results(self):
+        self.results.clear()
+        self.results.hide()
+
+    def on_result_clicked(self, item):
+        result = item.data(Qt.UserRole)
+        if result is not None:
+            self.result_selected.emit(result)
 
 
 # Esempio di utilizzo nella classe PrivateChatWindow
@@ -72,16 +256,28 @@ class PrivateChatWindow(QWidget):
 # Segnale che viene emesso quando la finestra viene chiusa
     closed_signal = pyqtSignal()
 
-    def __init__(self, username, target_users, peer_network): 
+    def __init__(self, username, target_users, peer_network, session_keys, outbound, message_cache): 
         # Inizializza la finestra del widget e chiama il costruttore della classe base
         super().__init__()
         self.username = username  # Assegna l'username dell'utente
          # Assegna la lista degli utenti target (destinatari del messaggio) 
         self.target_users = target_users   # lista degli utenti destinatari
         self.peer_network = peer_network  # Assegna l'oggetto peer_network, utilizzato per gestire la comunicazione tra utenti
+        self.session_keys = session_keys  # Gestore delle chiavi di sessione AES-GCM condiviso tra le finestre
+        self.outbound = outbound  # Pipeline di invio: cifratura, salvataggio e trasmissione avvengono fuori dal thread dell'interfaccia
+        self.message_cache = message_cache  # Cache locale dei messaggi, condivisa tra le finestre
+        # Stato della cronologia per ogni destinatario: id del messaggio più vecchio mostrato e presenza di pagine precedenti
+        self.history = {target_user: {"oldest_id": None, "has_more": True, "loading": False} for target_user in target_users}
         self.init_ui()  # Inizializza l'interfaccia grafica
-        # Carica i messaggi precedenti (chat passate) tra l'utente corrente e i destinatari
-        self.load_previous_messages()       
+        for target_user in target_users:
+            # In background legge la cache locale e scarica dall'API solo i messaggi arrivati dopo l'ultimo presente:
+            # la finestra si apre subito e mostra la cronologia quando è pronta
+            self.history[target_user]["loading"] = True
+            self.outbound.submit(
+                f"history:{self.username}:{target_user}",
+                lambda target=target_user: open_history(self.message_cache, self.username, target),
+                on_done=lambda page, target=target_user: self.show_history_page(target, *page),
+                on_error=lambda error, target=target_user: self.history[target].update(loading=False))
 
 # Funzione per inizializzare l'interfaccia utente (UI) della finestra di chat privata
     def init_ui(self):
@@ -89,11 +285,19 @@ class PrivateChatWindow(QWidget):
         chat_with = ", ".join(self.target_users)  # Unisce i nomi degli utenti target con una virgola per mostrarli nel titolo della finestra
         self.setWindowTitle(f"Private Chat with {chat_with}")
 
+# Crea la casella di ricerca nella cronologia della conversazione
+        self.search_bar = MessageSearchBar()
+        self.search_bar.search_requested.connect(self.search_history)
+        self.search_bar.result_selected.connect(self.jump_to_message)
+        layout.addWidget(self.search_bar)
+
 # Crea un'area di testo per visualizzare i messaggi ricevuti
         self.received_messages = QTextEdit() # Crea un'area di testo per visualizzare i messaggi ricevuti
         self.received_messages.setPlaceholderText("Receive messages here...")  # Imposta un testo di esempio
         self.received_messages.setReadOnly(True) # Imposta l'area di testo in sola lettura
         layout.addWidget(self.received_messages) # Aggiunge l'area di testo al layout
+        # Quando si scorre fino all'inizio vengono caricati i messaggi più vecchi
+        self.received_messages.verticalScrollBar().valueChanged.connect(self.on_history_scrolled)
 
 # Crea un campo di testo per l'inserimento dei messaggi
         self.input_message = QLineEdit()
@@ -108,102 +312,184 @@ class PrivateChatWindow(QWidget):
 
         self.setLayout(layout) # Imposta il layout per la finestra di chat
 
-# Funzione per caricare i messaggi precedenti tra l'utente corrente e i destinatari
+# Funzione per caricare la pagina di messaggi precedente a quelli già mostrati, per ogni destinatario
     def load_previous_messages(self):
         for target_user in self.target_users: # Itera su tutti gli utenti target
-            messages = load_messages_from_db(self.username, target_user) # Carica i messaggi tra l'utente corrente e il destinatario
-            for sender, message, timestamp in messages:  # Usa 'message' invece di 'encrypted_message' # Itera su tutti i messaggi
-                if sender == self.username: # Se il mittente è l'utente corrente
-                    display_message = message  # Mostra il messaggio in chiaro
-                else: # Se il mittente è il destinatario
-                    display_message = message  # Mostra il messaggio cifrato (o in chiaro, se disponibile)
-                self.received_messages.append(f"{sender} ({timestamp}): {display_message}") # Aggiunge il messaggio formattato con il mittente e il timestamp all'area di testo
-
-# Funzione per inviare un messaggio
+            self.load_previous_page(target_user)
+
+# Funzione per caricare la pagina di messaggi precedente per un destinatario, se non è già in caricamento
+    def load_previous_page(self, target_user):
+        state = self.history[target_user]
+        if state["has_more"] and not state["loading"]:
+            state["loading"] = True
+            # La lettura della cache e la richiesta HTTP vengono eseguite dalla pipeline, il risultato torna nel thread dell'interfaccia.
+            # Usa la stessa chiave della sincronizzazione, così le scritture nella cache di una conversazione restano in ordine
+            self.outbound.submit(
+                f"history:{self.username}:{target_user}",
+                lambda target=target_user, before_id=state["oldest_id"]: fetch_history_page(
+                    self.message_cache, self.username, target, before_id),
+                on_done=lambda page, target=target_user: self.show_history_page(target, *page),
+                on_error=lambda error, target=target_user: self.history[target].update(loading=False))
+
+# Funzione per mostrare in cima alla chat una pagina di messaggi precedenti
+    def show_history_page(self, target_user, messages, has_more):
+        state = self.history[target_user]
+        state.update(loading=False, has_more=has_more)
+        if messages:
+            state["oldest_id"] = messages[0][0] # Id del messaggio più vecchio, punto di partenza della pagina successiva
+            first_page = self.received_messages.document().isEmpty()
+            # Aggiunge i messaggi formattati con il mittente e il timestamp in cima all'area di testo
+            self.prepend_messages([f"{sender} ({timestamp}): {message}" for _, sender, message, timestamp in messages])
+            if first_page: # Alla prima apertura la chat mostra i messaggi più recenti
+                scroll_bar = self.received_messages.verticalScrollBar()
+                scroll_bar.setValue(scroll_bar.maximum())
+        # Se i messaggi non riempiono ancora la finestra non si può scorrere: carica subito la pagina precedente
+        if has_more and self.received_messages.verticalScrollBar().maximum() == 0:
+            self.load_previous_messages()
+
+# Funzione per inserire dei messaggi all'inizio dell'area di testo mantenendo la posizione di lettura
+    def prepend_messages(self, lines):
+        scroll_bar = self.received_messages.verticalScrollBar()
+        old_maximum, old_value = scroll_bar.maximum(), scroll_bar.value()
+        document = self.received_messages.document()
+        text = "\n".join(lines)
+        if not document.isEmpty():
+            text += "\n" # Separa la pagina inserita dai messaggi già presenti
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.Start)
+        cursor.insertText(text)
+        scroll_bar.setValue(old_value + scroll_bar.maximum() - old_maximum) # Il contenuto visibile non si sposta
+
+# Funzione chiamata quando si scorre la cronologia: in cima carica la pagina precedente
+    def on_history_scrolled(self, value):
+        if value == self.received_messages.verticalScrollBar().minimum():
+            self.load_previous_messages()
+
+# Funzione per cercare nella cronologia: la richiesta all'API viene eseguita dalla pipeline
+    def search_history(self, query):
+        if not query:
+            self.search_bar.clear_results()
+            return
+        peer = self.target_users[0]  # Le finestre private hanno un solo destinatario (MessageApp.open_private_chat)
+        self.outbound.submit(f"search:{self.username}",
+                             lambda: search_messages_in_db(self.username, query, peer=peer),
+                             on_done=self.search_bar.show_results)
+
+# Funzione per mostrare un messaggio trovato dalla ricerca, caricando prima le pagine precedenti se non è ancora visibile
+    def jump_to_message(self, result):
+        if highlight_message(self.received_messages, result):
+            return
+        target_user = self.target_users[0]
+        state = self.history[target_user]
+        if state["loading"]:
+            return  # Una pagina è già in caricamento: l'utente può scegliere di nuovo il risultato
+        state["loading"] = True
+        self.outbound.submit(
+            f"history:{self.username}:{target_user}",
+            lambda before_id=state["oldest_id"]: fetch_history_until(
+                lambda before: fetch_history_page(self.message_cache, self.username, target_user, before),
+                before_id, result["id"]),
+            on_done=lambda page: self.show_found_message(target_user, result, page),
+            on_error=lambda error: state.update(loading=False))
+
+# Funzione per mostrare le pagine caricate fino al messaggio trovato e selezionarlo
+    def show_found_message(self, target_user, result, page):
+        self.show_history_page(target_user, *page)
+        highlight_message(self.received_messages, result)
+
+# Funzione per inviare un messaggio: il lavoro bloccante viene affidato alla pipeline di invio
     def send_message(self):
         message = self.input_message.text()  # Ottiene il testo del messaggio dall'input
         if message: # Se il messaggio non è vuoto
             for target_username in self.target_users:   # Itera su tutti gli utenti target (destinatari)
-                # Salva il messaggio in chiaro nel database
+                # Accoda il messaggio in chiaro per il salvataggio nel database, che avviene in blocco
                 save_message_to_db(self.username, target_username, message)
-
- # Recupera la chiave pubblica del destinatario
-                public_key = get_public_key(target_username)
-                if public_key: # Se la chiave pubblica è disponibile
-                    # Cifra il messaggio con la chiave pubblica del destinatario
-                    encrypted_message = public_key.encrypt( 
-                        message.encode('utf-8'),  # Codifica il messaggio in bytes
-                        padding.OAEP(  #utilizza il padding OAEP per la crittografia
-                            mgf=padding.MGF1(algorithm=hashes.SHA256()), # Mask generation function basata su SHA256
-                            algorithm=hashes.SHA256(),  # Algoritmo di hashing SHA256
-                            label=None # Nessuna etichetta specificata
-                    
-                        )
-                    )
-
-                    # Converte il messaggio cifrato in formato esadecimale per l'invio tramite JSON
-                    encrypted_message_hex = encrypted_message.hex()
-
-                    # Invia il messaggio cifrato al destinatario tramite il peer network
-                    ip = self.peer_network.get_ip_by_username(target_username) # Ottiene l'IP dell'utente target tramite il nome
-                    if ip:
-                        private_message = f"PRIVATE_MESSAGE|{self.username}|{encrypted_message_hex}"  # Crea il messaggio privato formattato con l'username e il messaggio cifrato in esadecimale
-                        self.peer_network.send_message(ip, 5001, private_message)  # Invia il messaggio all'IP del destinatario sulla porta specificata
+                accepted = self.outbound.submit(
+                    target_username,
+                    lambda target=target_username: self.deliver_message(target, message),
+                    on_done=lambda sent, target=target_username: self.show_delivery(target, sent),
+                    on_error=lambda error, target=target_username: self.received_messages.append(
+                        f"[Messaggio non consegnato a {target}: {error}]"))
+                if not accepted: # La coda di invio è piena: il messaggio non viene accodato
+                    self.received_messages.append(f"[Coda di invio piena, messaggio per {target_username} non inviato]")
 
            # Mostra il messaggio inviato nella finestra di chat
             self.received_messages.append(f"{self.username}: {message}")
             self.input_message.clear()  #Pulisce il campo di input per nuovi messaggi
 
+# Avvisa l'utente se il messaggio è stato conservato perché il destinatario non è connesso
+    def show_delivery(self, target_username, sent):
+        if not sent:
+            self.received_messages.append(
+                f"[{target_username} non è connesso: il messaggio verrà consegnato quando tornerà online]")
+
+# Funzione eseguita da un worker della pipeline: cifra e trasmette un messaggio a un destinatario.
+# Restituisce True se il messaggio è stato inviato, False se è stato conservato nella casella in uscita
+    def deliver_message(self, target_username, message):
+        # Cifra il messaggio con la chiave di sessione AES-GCM; la chiave pubblica RSA del destinatario
+        # serve solo quando viene creata o ruotata la sessione
+        encrypted = self.session_keys.encrypt(target_username, message)
+        if not encrypted:
+            raise RuntimeError("chiave pubblica del destinatario non disponibile")
+        wrapped_key, key_id, payload = encrypted
+
+        frames = []
+        if wrapped_key: # Nuova sessione: la chiave cifrata con RSA precede il primo messaggio sulla stessa connessione
+            frames.append(encode_frame(MSG_SESSION_KEY, self.username, key_id, wrapped_key))
+        # Il testo cifrato viaggia in binario nel frame, senza conversione in esadecimale
+        frames.append(encode_frame(MSG_PRIVATE_MESSAGE, self.username, key_id, payload))
+        # Invia il messaggio cifrato al destinatario tramite il peer network; se non è connesso i frame
+        # (chiave di sessione compresa) restano nella casella in uscita fino alla sua riconnessione
+        try:
+            return self.peer_network.send_or_store(target_username, *frames)
+        except Exception:
+            self.session_keys.reset(target_username)  # Il peer potrebbe non aver ricevuto la chiave di sessione
+            raise
+
     def closeEvent(self, event): # Gestione dell'evento di chiusura della finestra
+        self.outbound.submit("message_buffer", message_buffer.flush) # Salva subito i messaggi ancora nel buffer, senza bloccare la chiusura
         self.closed_signal.emit() # Emette il segnale 'closed_signal' quando la finestra viene chiusa
         event.accept() # Accetta l'evento di chiusura
 
-    def receive_message(self, message): # Funzione per gestire la ricezione di un messaggio dal peer network
-        """Gestisce la ricezione di un messaggio dalla rete peer."""
-        # Divide il messaggio per estrarre il mittente e il contenuto
-        try:
-            
-             # Divide il messaggio su ': ' e considera il resto come il messaggio cifrato in esadecimale
-            sender, encrypted_message_hex = message.split(': ', 1)   # Divide il messaggio su ': ' e considera il resto come il messaggio cifrato in esadecimale
-            
-          # Supponendo di avere logica per determinare il tipo di messaggio
-            message_type = "PRIVATE_MESSAGE"  # Tipo di messaggio privato
-            
-            # Se il messaggio è un messaggio privato e il mittente è uno degli utenti target
-            encrypted_message = bytes.fromhex(encrypted_message_hex.strip())  # Converte il messaggio cifrato da esadecimale a bytes per la decodifica
-
-            # Recupera la chiave privata dell'utente corrente dal database
-            private_key = get_private_key(self.username) 
-
-            try: # Prova a decifrare il messaggio
-                # Decifra il messaggio con la chiave privata dell'utente corrente
-                decrypted_message = private_key.decrypt(
-                    encrypted_message, # Messaggio cifrato
-                    padding.OAEP( # Padding OAEP per la decrittografia
-                        mgf=padding.MGF1(algorithm=hashes.SHA256()), # Mask generation function basata su SHA256
-                        algorithm=hashes.SHA256(), # Algoritmo di hashing SHA256
-                        label=None # Nessuna etichetta specificata
-                    )
-                ).decode('utf-8') # Decodifica il messaggio in formato UTF-8
-                display_message = decrypted_message # Mostra il messaggio decifrato
-            except Exception as e: # Se si verifica un errore durante la decrittografia
-                print(f"Decryption failed: {e}") # Stampa un messaggio di errore
-                display_message = "[Failed to decrypt message]" # Mostra un messaggio di errore
-
-            # Mostra il messaggio ricevuto nella finestra di chat privata
-            self.received_messages.append(f"{sender}: {display_message}")
-            
-        except ValueError: # Se si verifica un errore durante la divisione del messaggio
-            print("Received an invalid message format") # Stampa un messaggio di errore
+    def receive_message(self, sender, key_id, payload): # Funzione per gestire la ricezione di un messaggio dal peer network
+        """Gestisce la ricezione di un messaggio dalla rete peer.
+
+        Parametri:
+            - sender: Nome utente del mittente.
+            - key_id: Identificativo della chiave di sessione usata dal mittente.
+            - payload: Nonce e testo cifrato AES-GCM, in binario.
+        """
+        try: # Prova a decifrare il messaggio con la chiave di sessione (solo operazioni simmetriche)
+            display_message = self.session_keys.decrypt(sender, key_id, payload) # Mostra il messaggio decifrato
+        except SessionKeyError as e: # Se la chiave di sessione non è nota o il messaggio è stato alterato
+            print(f"Decryption failed: {e}") # Stampa un messaggio di errore
+            display_message = "[Failed to decrypt message]" # Mostra un messaggio di errore
+            ip = self.peer_network.get_ip_by_username(sender)
+            if ip: # Chiede al mittente di generare una nuova chiave di sessione per i prossimi messaggi
+                rekey_request = encode_frame(MSG_REKEY_REQUEST, self.username)
+                self.outbound.submit(sender, lambda: self.peer_network.deliver_frame(ip, 5001, rekey_request))
+
+        # Mostra il messaggio ricevuto nella finestra di chat privata
+        self.received_messages.append(f"{sender}: {display_message}")
 
 # Esempio di utilizzo nella classe GroupChatWindow 
 class GroupChatWindow(QWidget):
-    def __init__(self, username, group_users, peer_network): # Costruttore della classe GroupChatWindow
+    def __init__(self, username, group_users, peer_network, outbound): # Costruttore della classe GroupChatWindow
         super().__init__() # Chiama il costruttore della classe base
         self.username = username # Assegna l'username dell'utente
         self.group_users = group_users # Assegna la lista degli utenti del gruppo (destinatari del messaggio)
         self.peer_network = peer_network # Assegna l'oggetto peer_network, utilizzato per gestire la comunicazione tra utenti
+        self.outbound = outbound  # Pipeline di invio, usata per caricare la cronologia senza bloccare l'interfaccia
+        # Partecipanti del gruppo compreso l'utente corrente: identificano la conversazione nel database
+        self.members = sorted(set(group_users) | {username})
+        self.oldest_id = None  # Id del messaggio più vecchio mostrato, punto di partenza della pagina precedente
+        self.has_more = True  # Esistono messaggi più vecchi di quelli mostrati
         self.init_ui() # Inizializza l'interfaccia grafica
+        # Carica in background l'ultima pagina della cronologia del gruppo
+        self.outbound.submit(
+            f"history:{self.username}:{','.join(self.members)}",
+            lambda: load_group_messages_from_db(self.members),
+            on_done=lambda page: self.show_history(*page))
 
 # Funzione per inizializzare l'interfaccia utente (UI) della finestra di chat di gruppo
     def init_ui(self):
@@ -211,6 +497,11 @@ class GroupChatWindow(QWidget):
         group_title = ", ".join(self.group_users) # Unisce i nomi degli utenti del gruppo con una virgola per mostrarli nel titolo della finestra
         self.setWindowTitle(f"Group Chat with {group_title}") # Imposta il titolo della finestra
 
+        self.search_bar = MessageSearchBar() # Crea la casella di ricerca nella cronologia del gruppo
+        self.search_bar.search_requested.connect(self.search_history)
+        self.search_bar.result_selected.connect(self.jump_to_message)
+        layout.addWidget(self.search_bar)
+
 # Crea un'area di testo per visualizzare i messaggi ricevuti
         self.received_messages = QTextEdit()
         self.received_messages.setPlaceholderText("Receive messages here...") # Imposta un testo di esempio
@@ -228,19 +519,69 @@ class GroupChatWindow(QWidget):
 
         self.setLayout(layout) # Imposta il layout per la finestra di chat di gruppo
 
+# Funzione per mostrare in cima alla chat i messaggi salvati del gruppo
+    def show_history(self, messages, has_more=False):
+        self.has_more = has_more
+        if messages:
+            self.oldest_id = messages[0][0]
+            lines = [f"{sender} ({timestamp}): {message}" for _, sender, message, timestamp in messages]
+            cursor = QTextCursor(self.received_messages.document())
+            cursor.movePosition(QTextCursor.Start)
+            cursor.insertText("\n".join(lines) + ("" if self.received_messages.document().isEmpty() else "\n"))
+
+# Funzione per cercare nella cronologia del gruppo: la richiesta all'API viene eseguita dalla pipeline
+    def search_history(self, query):
+        if not query:
+            self.search_bar.clear_results()
+            return
+        self.outbound.submit(f"search:{self.username}",
+                             lambda: search_messages_in_db(self.username, query, members=self.members),
+                             on_done=self.search_bar.show_results)
+
+# Funzione per mostrare un messaggio trovato dalla ricerca, caricando prima le pagine precedenti se non è ancora visibile
+    def jump_to_message(self, result):
+        if highlight_message(self.received_messages, result) or not self.has_more:
+            return
+        self.outbound.submit(
+            f"history:{self.username}:{','.join(self.members)}",
+            lambda before_id=self.oldest_id: fetch_history_until(
+                lambda before: load_group_messages_from_db(self.members, before), before_id, result["id"]),
+            on_done=lambda page: self.show_found_message(result, page))
+
+# Funzione per mostrare le pagine caricate fino al messaggio trovato e selezionarlo
+    def show_found_message(self, result, page):
+        self.show_history(*page)
+        highlight_message(self.received_messages, result)
+
 # Funzione per inviare un messaggio al gruppo
     def send_message(self):
         message = self.input_message.text() # Ottiene il testo del messaggio dall'input
         if message:
             # Mostra il messaggio nella chat
             self.received_messages.append(f"{self.username}: {message}")
-            for target_username in self.group_users: # Itera su tutti gli utenti del gruppo
-                ip = self.peer_network.get_ip_by_username(target_username) # Ottiene l'IP dell'utente target tramite il nome
-                if ip: 
-                    group_message = f"GROUP_MESSAGE|{self.username}|{message}" # Crea il messaggio di gruppo formattato con l'username e il messaggio
-                    self.peer_network.send_message(ip, 5001, group_message)  # Invia un messaggio al dispositivo dell'utente nella rete peer tramite peer_network (indirizzo IP destinatario, numero porta destinatario, contenuto del messaggio)
+            save_group_message_to_db(self.username, self.members, message) # Accoda il messaggio per il salvataggio nel database
+            group_message = encode_frame(MSG_GROUP_MESSAGE, self.username, message) # Crea il frame del messaggio di gruppo, codificato una sola volta per tutti i destinatari
+            targets = [target_username for target_username in self.group_users if target_username != self.username]
+            # Invia il messaggio a tutti gli utenti connessi del gruppo in parallelo; per gli utenti non connessi
+            # il messaggio viene conservato (scrittura su disco) e consegnato alla loro riconnessione. Il lavoro
+            # è affidato alla pipeline di invio, con la stessa chiave della richiesta di chat di gruppo di MessageApp
+            accepted = self.outbound.submit(
+                ",".join(sorted(self.group_users)),
+                lambda: self.peer_network.send_to_users(
+                    targets, group_message,
+                    on_error=lambda target, error: self.received_messages.append(
+                        f"[Messaggio non consegnato a {target}: {error}]")),
+                on_done=self.show_stored)
+            if not accepted: # La coda di invio è piena: il messaggio non viene accodato
+                self.received_messages.append("[Coda di invio piena, messaggio di gruppo non inviato]")
             self.input_message.clear() # Pulisce il campo di input dopo l'invio del messaggio
 
+# Avvisa l'utente dei destinatari per cui il messaggio è stato conservato perché non connessi
+    def show_stored(self, stored):
+        if stored:
+            self.received_messages.append(
+                f"[{', '.join(stored)} non connessi: il messaggio verrà consegnato quando torneranno online]")
+
 # Funzione per ricevere un messaggio di gruppo e visualizzarlo
     def receive_message(self, message):
         self.received_messages.append(message) # Aggiunge il messaggio ricevuto direttamente alla finestra di chat
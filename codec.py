@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from protocol import HEADER, compress_frame, MSG_PRIVATE_MESSAGE, MSG_SESSION_KEY
+
+# Funzionalità annunciate dai peer durante la scoperta (discovery.py), come bit di un intero
+CAP_ZLIB = 0x1  # Il peer decodifica i frame con il corpo compresso con zlib
+LOCAL_CAPABILITIES = CAP_ZLIB  # Funzionalità supportate da questo client
+
+# Il testo cifrato non si comprime: comprimerlo costerebbe CPU senza ridurre i byte inviati
+INCOMPRESSIBLE_TYPES = frozenset((MSG_PRIVATE_MESSAGE, MSG_SESSION_KEY))
+
+
+class CompressionStats:
+    """Statistiche di compressione dei frame inviati, condivise tra i thread di invio."""
+
+    def __init__(self):
+        self.frames = 0  # Frame inviati
+        self.compressed_frames = 0  # Frame inviati compressi
+        self.bytes_in = 0  # Byte dei frame prima della compressione
+        self.bytes_out = 0  # Byte effettivamente inviati
+        self.last_ratio = 1.0  # Rapporto tra byte inviati e originali dell'ultimo frame
+        self._lock = threading.Lock()
+
+    def record(self, original_size, sent_size):
+        """Registra l'invio di un frame di original_size byte trasmesso in sent_size byte."""
+        with self._lock:
+            self.frames += 1
+            self.compressed_frames += sent_size < original_size
+            self.bytes_in += original_size
+            self.bytes_out += sent_size
+            self.last_ratio = sent_size / original_size if original_size else 1.0
+
+    def snapshot(self):
+        """Restituisce un dizionario con i contatori e il rapporto di compressione complessivo."""
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "compressed_frames": self.compressed_frames,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+                "last_ratio": self.last_ratio,
+            }
+
+
+class PayloadCodec:
+    """Sceglie come trasmettere un frame a un peer: compresso con zlib o così com'è.
+
+    Un frame viene compresso solo se il corpo supera threshold byte, il destinatario ha
+    annunciato CAP_ZLIB e la compressione riduce davvero la dimensione. Lo stesso frame inviato
+    a molti peer (gruppi, messaggi pubblici) viene compresso una sola volta grazie a una piccola
+    cache degli ultimi frame compressi.
+
+    Parametri:
+        - threshold: Dimensione minima del corpo, in byte, per tentare la compressione.
+        - level: Livello di compressione zlib (1 veloce - 9 massimo).
+        - cache_size: Numero di frame compressi ricordati.
+    """
+
+    def __init__(self, threshold=256, level=6, cache_size=32):
+        self.threshold = threshold
+        self.level = level
+        self.cache_size = cache_size
+        self.stats = CompressionStats()
+        self._cache = OrderedDict()  # Frame originale -> frame compresso (o None se non comprimibile)
+        self._lock = threading.Lock()  # Protegge la cache, usata da più thread di invio
+
+    def encode_for(self, data, capabilities):
+        """Restituisce i byte da inviare a un peer con le funzionalità indicate e aggiorna le statistiche."""
+        encoded = data
+        if capabilities & CAP_ZLIB and self._worth_compressing(data):
+            compressed = self._compress(data)
+            if compressed is not None:
+                encoded = compressed
+        self.stats.record(len(data), len(encoded))
+        return encoded
+
+    def _worth_compressing(self, data):
+        length, msg_type = HEADER.unpack_from(data)
+        return length >= self.threshold and msg_type not in INCOMPRESSIBLE_TYPES
+
+    def _compress(self, data):
+        with self._lock:
+            if data in self._cache:
+                self._cache.move_to_end(data)
+                return self._cache[data]
+        compressed = compress_frame(data, self.level)
+        with self._lock:
+            self._cache[data] = compressed
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return compressed
@@ -0,0 +1,104 @@
+import select
+import socket
+import threading
+import time
+
+
+# Connessione TCP verso un singolo peer, riutilizzata tra un invio e l'altro
+class PooledConnection:
+    def __init__(self, address):
+        self.address = address  # Coppia (ip, porta) del peer
+        self.sock = None  # Socket TCP, creato in modo pigro al primo invio
+        self.last_used = time.monotonic()  # Istante dell'ultimo utilizzo, per chiudere le connessioni inattive
+        self.lock = threading.Lock()  # Serializza gli invii sulla stessa connessione
+
+    # Verifica che il peer non abbia chiuso la connessione mentre era inutilizzata
+    def is_alive(self):
+        if self.sock is None:
+            return False
+        try:
+            # Il peer non invia mai dati su questa connessione: se il socket è leggibile
+            # significa che è arrivato un EOF o un errore e la connessione va ricreata
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable and not self.sock.recv(1, socket.MSG_PEEK):
+                return False
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+# La classe ConnectionPool mantiene una connessione persistente per ogni peer (ip, porta)
+class ConnectionPool:
+    def __init__(self, connect_timeout=3.0, idle_timeout=60.0, connect_latency=None):
+        self.connect_timeout = connect_timeout  # Tempo massimo per stabilire una connessione
+        self.idle_timeout = idle_timeout  # Tempo di inattività dopo il quale una connessione viene chiusa
+        self.connect_latency = connect_latency  # Istogramma (metrics.Histogram) delle durate di connessione, facoltativo
+        self._connections = {}  # Dizionario (ip, porta) -> PooledConnection
+        self._lock = threading.Lock()  # Protegge il dizionario delle connessioni
+
+    # Restituisce la connessione associata al peer, creandola se non esiste
+    def _get(self, address):
+        with self._lock:
+            connection = self._connections.get(address)
+            if connection is None:
+                connection = PooledConnection(address)
+                self._connections[address] = connection
+            return connection
+
+    # Invia i dati al peer riutilizzando la connessione esistente, riconnettendosi una volta in caso di errore
+    def send(self, peer_ip, peer_port, data):
+        connection = self._get((peer_ip, peer_port))
+        with connection.lock:
+            for attempt in range(2):
+                try:
+                    if not connection.is_alive():
+                        connection.close()
+                        started = time.perf_counter()
+                        connection.sock = socket.create_connection(connection.address, timeout=self.connect_timeout)
+                        if self.connect_latency is not None:
+                            self.connect_latency.observe(time.perf_counter() - started)
+                        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Invia subito i messaggi brevi
+                    connection.sock.sendall(data)
+                    connection.last_used = time.monotonic()
+                    return
+                except OSError:
+                    connection.close()  # La connessione non è più valida: verrà ricreata al prossimo tentativo
+                    if attempt == 1:
+                        raise
+
+    # Chiude le connessioni inutilizzate da più di idle_timeout secondi
+    def close_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [address for address, connection in self._connections.items()
+                    if now - connection.last_used > self.idle_timeout]
+            connections = [self._connections.pop(address) for address in idle]
+        for connection in connections:
+            with connection.lock:
+                connection.close()
+
+    # Chiude e rimuove tutte le connessioni verso un peer (ad esempio quando scade dalla lista dei peer)
+    def evict(self, peer_ip):
+        with self._lock:
+            addresses = [address for address in self._connections if address[0] == peer_ip]
+            connections = [self._connections.pop(address) for address in addresses]
+        for connection in connections:
+            with connection.lock:
+                connection.close()
+
+    # Chiude tutte le connessioni aperte
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            with connection.lock:
+                connection.close()
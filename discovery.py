@@ -0,0 +1,156 @@
+import math
+import random
+import socket
+import struct
+from codec import LOCAL_CAPABILITIES
+
+# Protocollo di scoperta dei peer sul canale UDP.
+#
+# Ogni datagramma è composto da un'intestazione di 7 byte (identificativo del protocollo,
+# tipo e validità dell'annuncio in secondi) seguita dal nome utente in UTF-8. I 4 bit alti del
+# tipo contengono le funzionalità supportate dal peer (codec.CAP_*), ad esempio la compressione
+# dei frame, così la negoziazione avviene senza messaggi aggiuntivi. I datagrammi
+# senza intestazione (il solo nome utente, inviato dalle versioni precedenti) sono trattati
+# come annunci periodici con la validità predefinita.
+#
+# Un peer che si avvia invia HELLO al gruppo multicast e chi lo riceve risponde subito in
+# unicast con REPLY: il nuovo peer conosce l'intera rete senza attendere gli annunci
+# periodici. Gli annunci periodici (BEACON) si diradano finché la rete resta stabile e il loro
+# intervallo cresce con il numero di peer, così il traffico complessivo resta costante.
+# Alla chiusura il peer invia LEAVE e gli altri lo rimuovono senza attendere la scadenza.
+
+DISCOVERY_HEADER = struct.Struct("!4sBH")  # Identificativo del protocollo, tipo, validità in secondi
+DISCOVERY_MAGIC = b"CP2P"
+DEFAULT_MULTICAST_GROUP = "239.255.42.99"  # Gruppo multicast con ambito locale all'organizzazione
+
+# Tipi di datagramma di scoperta
+DISCOVERY_HELLO = 1  # Nuovo peer: chi lo riceve risponde subito con REPLY
+DISCOVERY_BEACON = 2  # Annuncio periodico di presenza
+DISCOVERY_REPLY = 3  # Risposta in unicast a un HELLO
+DISCOVERY_LEAVE = 4  # Il peer si sta disconnettendo
+
+
+def encode_datagram(kind, ttl, username, capabilities=0):
+    """Codifica un datagramma di scoperta con tipo, validità in secondi, nome utente e funzionalità supportate."""
+    return (DISCOVERY_HEADER.pack(DISCOVERY_MAGIC, kind | (capabilities & 0x0F) << 4, min(int(math.ceil(ttl)), 0xFFFF))
+            + username.encode('utf-8'))
+
+
+def decode_datagram(data):
+    """Decodifica un datagramma di scoperta.
+
+    Restituisce:
+        - La tupla (tipo, validità in secondi o None, nome utente, funzionalità), oppure None se il datagramma non è valido.
+    """
+    if data[:len(DISCOVERY_MAGIC)] != DISCOVERY_MAGIC:
+        # Formato delle versioni precedenti: il solo nome utente, senza validità né funzionalità
+        username = data.decode('utf-8', errors='replace').strip()
+        return (DISCOVERY_BEACON, None, username, 0) if username else None
+    if len(data) <= DISCOVERY_HEADER.size:
+        return None
+    _, kind, ttl = DISCOVERY_HEADER.unpack_from(data)
+    kind, capabilities = kind & 0x0F, kind >> 4
+    if kind not in (DISCOVERY_HELLO, DISCOVERY_BEACON, DISCOVERY_REPLY, DISCOVERY_LEAVE):
+        return None
+    return kind, ttl or None, data[DISCOVERY_HEADER.size:].decode('utf-8', errors='replace'), capabilities
+
+
+def open_discovery_socket(port, multicast_group=None, bind_ip=""):
+    """Crea il socket UDP usato sia per inviare sia per ricevere i datagrammi di scoperta.
+
+    Parametri:
+        - port: Porta UDP della scoperta, uguale per tutti i peer.
+        - multicast_group: Gruppo multicast a cui iscriversi; se None il socket usa il broadcast.
+        - bind_ip: Indirizzo locale su cui ascoltare (predefinito tutte le interfacce).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Più client sulla stessa macchina possono ascoltare la porta
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.bind((bind_ip, port))  # Senza bind_ip ascolta su tutte le interfacce di rete
+    if multicast_group:
+        membership = struct.pack("4s4s", socket.inet_aton(multicast_group), socket.inet_aton("0.0.0.0"))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)  # I datagrammi restano nella rete locale
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+
+class DiscoveryCore:
+    """Logica del protocollo di scoperta, indipendente dal modo in cui i datagrammi vengono inviati e ricevuti.
+
+    È usata sia da PeerNetwork (thread) sia da AsyncPeerNetwork (asyncio): il motore di rete
+    invia i datagrammi restituiti dai metodi e attende next_beacon_delay() secondi tra un
+    annuncio periodico e l'altro. Gli annunci ricevuti aggiornano il registro dei peer.
+
+    Parametri:
+        - username: Nome utente annunciato.
+        - peers: Registro dei peer (peer_registry.PeerRegistry).
+        - group_addresses: Lista delle coppie (indirizzo, porta) a cui inviare gli annunci: di solito
+          il solo gruppo multicast o indirizzo di broadcast, oppure un elenco di peer in unicast.
+        - min_interval: Intervallo tra gli annunci subito dopo l'avvio o un cambiamento della rete.
+        - max_interval: Intervallo massimo raggiunto quando la rete resta stabile.
+        - network_rate: Numero di annunci al secondo che l'intera rete non dovrebbe superare.
+        - jitter: Variazione casuale dell'intervallo (frazione), evita che i peer annuncino tutti insieme.
+        - missed_beacons: Numero di annunci persi dopo i quali gli altri peer ci considerano disconnessi.
+    """
+
+    def __init__(self, username, peers, group_addresses, min_interval=1.0, max_interval=30.0,
+                 network_rate=2.0, jitter=0.25, missed_beacons=3):
+        self.username = username
+        self.peers = peers
+        self.group_addresses = list(group_addresses)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.network_rate = network_rate
+        self.jitter = jitter
+        self.missed_beacons = missed_beacons
+        self._interval = min_interval  # Intervallo corrente, raddoppiato a ogni annuncio finché la rete è stabile
+        self.peers.subscribe(on_left=lambda ip, username: self.reset_interval())
+
+    def hello(self):
+        """Restituisce il datagramma di ingresso nella rete e la lista dei destinatari."""
+        return encode_datagram(DISCOVERY_HELLO, self._ttl(), self.username, LOCAL_CAPABILITIES), self.group_addresses
+
+    def leave(self):
+        """Restituisce il datagramma di uscita dalla rete e la lista dei destinatari."""
+        return encode_datagram(DISCOVERY_LEAVE, 0, self.username), self.group_addresses
+
+    def beacon(self):
+        """Restituisce l'annuncio periodico e la lista dei destinatari, poi allunga l'intervallo del successivo."""
+        datagram = encode_datagram(DISCOVERY_BEACON, self._ttl(), self.username, LOCAL_CAPABILITIES)
+        self._interval = min(self._interval * 2, self.max_interval)
+        return datagram, self.group_addresses
+
+    def next_beacon_delay(self):
+        """Restituisce i secondi da attendere prima del prossimo annuncio periodico, con una variazione casuale."""
+        return self._current_interval() * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset_interval(self):
+        """Torna all'intervallo minimo, ad esempio quando un peer entra o esce dalla rete."""
+        self._interval = self.min_interval
+
+    def datagram_received(self, data, addr):
+        """Gestisce un datagramma ricevuto e restituisce la lista delle coppie (datagramma, indirizzo) da inviare."""
+        decoded = decode_datagram(data)
+        if decoded is None:
+            return []
+        kind, ttl, username, capabilities = decoded
+        peer_ip = addr[0]
+        if kind == DISCOVERY_LEAVE:
+            self.peers.remove(peer_ip)
+            return []
+        if self.peers.seen(peer_ip, username, ttl, capabilities) and username != self.username:
+            self.reset_interval()  # Un nuovo peer: gli annunci tornano frequenti finché la rete non si stabilizza
+        if kind == DISCOVERY_HELLO and username != self.username:
+            # Risposta immediata in unicast: il nuovo peer ci conosce senza attendere il prossimo annuncio
+            return [(encode_datagram(DISCOVERY_REPLY, self._ttl(), self.username, LOCAL_CAPABILITIES), addr)]
+        return []
+
+    # Intervallo senza variazione casuale: cresce con il numero di peer per limitare il traffico complessivo
+    def _current_interval(self):
+        return max(self._interval, len(self.peers) / self.network_rate)
+
+    # Validità dell'annuncio: copre alcuni intervalli successivi, così un datagramma perso non ci fa scadere
+    def _ttl(self):
+        next_interval = max(min(self._interval * 2, self.max_interval), len(self.peers) / self.network_rate)
+        return next_interval * (1 + self.jitter) * self.missed_beacons
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from protocol import encode_frame, MSG_GROUP_CHAT_REQUEST, MSG_GROUP_MESSAGE, MSG_PUBLIC, MSG_RELAY
+
+# Tipi di frame che un nodo intermedio accetta di inoltrare: quelli inviati a più destinatari dal fan-out.
+# Un MSG_RELAY o un MSG_BATCH annidato non viene mai inoltrato
+RELAYABLE_TYPES = frozenset({MSG_GROUP_MESSAGE, MSG_GROUP_CHAT_REQUEST, MSG_PUBLIC})
+
+
+class FanoutSender:
+    """Invio dello stesso frame a molti peer (chat di gruppo e messaggi pubblici).
+
+    Ogni peer ha una propria coda, svuotata da un thread del pool: i messaggi verso lo stesso
+    peer restano in ordine mentre peer diversi vengono serviti in parallelo, quindi il tempo di
+    consegna a un gruppo è vicino a quello di un singolo messaggio e un peer irraggiungibile
+    rallenta solo la propria coda. Ogni invio è limitato dal timeout di connessione della rete;
+    dopo un errore il peer resta escluso per failure_cooldown secondi e i messaggi successivi
+    verso di lui falliscono subito invece di occupare un thread.
+
+    Con più di relay_threshold destinatari il frame viene inviato lungo un albero: il mittente
+    lo consegna a relay_fanout peer, ognuno dei quali lo inoltra (MSG_RELAY) a una parte dei
+    destinatari rimanenti. Il costo in upload del mittente resta così costante. Se un nodo
+    intermedio non è raggiungibile, la sua parte dell'albero viene servita direttamente.
+
+    Parametri:
+        - peer_network: Rete peer-to-peer usata per risolvere i nomi utente e inviare i frame.
+        - port: Porta TCP dei peer.
+        - workers: Numero massimo di invii contemporanei.
+        - relay_threshold: Numero di destinatari oltre il quale si usa l'albero di inoltro (None per disattivarlo).
+        - relay_fanout: Numero di rami dell'albero a ogni livello.
+        - failure_cooldown: Secondi per cui un peer irraggiungibile viene escluso dagli invii.
+        - queue_size: Numero massimo di frame in attesa per ogni peer.
+        - dispatch: Funzione chiamata con (funzione, argomenti...) per eseguire la notifica di un errore nel
+          thread giusto, ad esempio quello dell'interfaccia; se None la notifica avviene nel thread di invio.
+    """
+
+    def __init__(self, peer_network, port=5001, workers=32, relay_threshold=16, relay_fanout=4,
+                 failure_cooldown=10.0, queue_size=256, dispatch=None):
+        self.peer_network = peer_network
+        self.port = port
+        self.relay_threshold = relay_threshold
+        self.relay_fanout = relay_fanout
+        self.failure_cooldown = failure_cooldown
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+        self._queues = {}  # Dizionario (ip, porta) -> deque dei frame in attesa
+        self._draining = set()  # Indirizzi la cui coda è in corso di svuotamento da un thread del pool
+        self._failed_until = {}  # Dizionario (ip, porta) -> istante fino a cui il peer è escluso
+        self._lock = threading.Lock()  # Protegge code e peer esclusi
+        self._dispatch = dispatch
+
+    def send(self, usernames, data, on_error=None):
+        """Invia un frame già codificato a tutti gli utenti connessi tra quelli indicati, senza bloccare.
+
+        Parametri:
+            - usernames: Nomi utente dei destinatari; quelli non connessi vengono ignorati.
+            - data: Frame già codificato.
+            - on_error: Funzione chiamata con (username, errore) per ogni invio fallito, tramite dispatch se indicata.
+
+        Restituisce:
+            - Il numero di destinatari connessi a cui il frame è stato affidato.
+        """
+        targets = []
+        for username in dict.fromkeys(usernames):  # Elimina i duplicati mantenendo l'ordine
+            ip = self.peer_network.get_ip_by_username(username)
+            if ip:
+                targets.append((username, ip))
+        self._send_to(targets, data, on_error)
+        return len(targets)
+
+    def relay(self, frame, inner_frame, own_username=None):
+        """Inoltra ai destinatari successivi il frame contenuto in un MSG_RELAY ricevuto.
+
+        Chiunque raggiunga la porta TCP può inviare un MSG_RELAY: vengono inoltrati solo i tipi di
+        RELAYABLE_TYPES, senza il nome dell'utente corrente, e solo se i destinatari non superano
+        quelli di un ramo dell'albero, così il nodo non amplifica frame arbitrari.
+
+        Parametri:
+            - frame: Frame MSG_RELAY ricevuto.
+            - inner_frame: Frame contenuto, già decodificato.
+            - own_username: Nome dell'utente corrente, escluso dai destinatari.
+
+        Restituisce:
+            - True se il frame è stato inoltrato (o non c'era nessuno a cui inoltrarlo), False se è stato rifiutato.
+        """
+        if inner_frame.msg_type not in RELAYABLE_TYPES:
+            return False
+        usernames = [username for username in frame.texts(1) if username != own_username]
+        if len(usernames) > self.max_relay_targets():
+            return False
+        self.send(usernames, frame.fields[0])
+        return True
+
+    def max_relay_targets(self):
+        """Restituisce il numero massimo di destinatari che un MSG_RELAY legittimo può indicare.
+
+        Il mittente divide i propri destinatari, al più i peer della rete, in relay_fanout rami.
+        """
+        return -(-len(self.peer_network.get_connected_ips()) // self.relay_fanout)
+
+    def stop(self):
+        """Ferma il pool dopo che gli invii già accodati sono terminati."""
+        self._executor.shutdown(wait=False)
+
+    def _send_to(self, targets, data, on_error):
+        if self.relay_threshold is None or len(targets) <= self.relay_threshold:
+            for username, ip in targets:
+                self._enqueue(username, ip, data, on_error)
+            return
+        # Divide i destinatari in relay_fanout rami: il primo di ogni ramo inoltra il frame agli altri
+        branch_size = -(-len(targets) // self.relay_fanout)
+        for start in range(0, len(targets), branch_size):
+            (head, head_ip), rest = targets[start], targets[start + 1:start + branch_size]
+            if not rest:
+                self._enqueue(head, head_ip, data, on_error)
+                continue
+            relay_frame = encode_frame(MSG_RELAY, data, *[username for username, _ in rest])
+            # Se il nodo intermedio non risponde, il resto del ramo viene servito senza di lui
+            self._enqueue(head, head_ip, relay_frame, on_error,
+                          fallback=lambda rest=rest: self._send_to(rest, data, on_error))
+
+    def _enqueue(self, username, ip, data, on_error, fallback=None):
+        address = (ip, self.port)
+        item = (username, data, on_error, fallback)
+        with self._lock:
+            if self._failed_until.get(address, 0) > time.monotonic():
+                error = "peer non raggiungibile"
+            else:
+                queue = self._queues.setdefault(address, deque())
+                if len(queue) >= self.queue_size:
+                    error = "coda di invio piena"
+                else:
+                    queue.append(item)
+                    if address not in self._draining:
+                        self._draining.add(address)
+                        self._executor.submit(self._drain, address)
+                    return
+        self._fail(item, error)
+
+    # Eseguita da un thread del pool: invia in ordine i frame in attesa per un peer
+    def _drain(self, address):
+        while True:
+            with self._lock:
+                queue = self._queues.get(address)
+                if not queue:
+                    self._queues.pop(address, None)
+                    self._draining.discard(address)
+                    return
+                item = queue.popleft()
+                excluded = self._failed_until.get(address, 0) > time.monotonic()
+            if excluded:  # Un invio precedente verso il peer è appena fallito
+                self._fail(item, "peer non raggiungibile")
+                continue
+            try:
+                self.peer_network.deliver_frame(address[0], address[1], item[1])
+            except Exception as e:
+                with self._lock:
+                    self._failed_until[address] = time.monotonic() + self.failure_cooldown
+                self._fail(item, str(e) or repr(e))
+            else:
+                if address in self._failed_until:
+                    with self._lock:
+                        self._failed_until.pop(address, None)
+
+    def _fail(self, item, error):
+        username, _, on_error, fallback = item
+        if fallback is not None:
+            fallback()
+        if self._dispatch is not None:
+            self._dispatch(self._report_failure, on_error, username, error)
+        else:
+            self._report_failure(on_error, username, error)
+
+    def _report_failure(self, on_error, username, error):
+        print(f"Invio non riuscito verso {username}: {error}")
+        if on_error is not None:
+            on_error(username, error)
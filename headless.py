@@ -0,0 +1,125 @@
+import argparse
+import re
+import sys
+import threading
+from peer_core import PeerCore, EVENT_PEER_JOINED, EVENT_PEER_LEFT
+from async_peernetwork import AsyncPeerCore
+from discovery import DEFAULT_MULTICAST_GROUP
+from protocol import (encode_frame, MSG_PUBLIC, MSG_GROUP_CHAT_REQUEST, MSG_GROUP_MESSAGE, MSG_PRIVATE_CHAT_REQUEST,
+                      MSG_PRIVATE_MESSAGE)
+
+# Client della rete peer-to-peer senza interfaccia grafica, per demoni, bot e prove.
+#
+# Non importa PyQt5: la rete viene usata tramite la coda degli eventi di PeerCore. I comandi
+# sono letti dallo standard input, con la stessa sintassi della chat globale di MessageApp:
+#   testo                     messaggio pubblico
+#   !! utente1,utente2 testo  messaggio di gruppo (invia anche la richiesta di chat di gruppo)
+#   /peers                    elenco dei peer connessi
+#   /stats                    metriche della rete (formato di Prometheus)
+#   /quit                     chiude il client
+# Le chat private non sono disponibili: richiedono le chiavi dell'utente, gestite dall'interfaccia.
+#
+# Esempio: python3 headless.py --username bot --asyncio
+
+PEER_SERVER_PORT = 5001  # Porta TCP dei peer, la stessa usata da MessageApp
+
+
+# Restituisce la riga da mostrare per un evento della rete, o None se l'evento non va mostrato
+def describe_event(event):
+    if event[0] == EVENT_PEER_JOINED:
+        return f"* {event[2]} si è connesso da {event[1]}"
+    if event[0] == EVENT_PEER_LEFT:
+        return f"* {event[2]} si è disconnesso"
+    frame = event[1]
+    if frame.msg_type == MSG_PUBLIC:
+        return f"{frame.text(0)}: {frame.text(1)}"
+    if frame.msg_type == MSG_GROUP_MESSAGE:
+        return f"[gruppo] {frame.text(0)}: {frame.text(1)}"
+    if frame.msg_type == MSG_GROUP_CHAT_REQUEST:
+        return f"* {frame.text(0)} ha aperto una chat di gruppo con {', '.join(frame.texts(1))}"
+    if frame.msg_type in (MSG_PRIVATE_CHAT_REQUEST, MSG_PRIVATE_MESSAGE):
+        return f"* {frame.text(0)} ha inviato un messaggio privato, non leggibile senza interfaccia"
+    return None
+
+
+# Eseguita in un thread: mostra gli eventi della rete man mano che arrivano
+def print_events(events):
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        try:
+            line = describe_event(event)
+        except (IndexError, UnicodeDecodeError) as e:
+            line = f"* Messaggio non valido: {e!r}"
+        if line is not None:
+            print(line, flush=True)
+
+
+# Esegue un comando letto dallo standard input; restituisce False per chiudere il client
+def handle_command(network, username, line):
+    if line == "/quit":
+        return False
+    if line == "/peers":
+        peers = network.get_connected_ips()
+        print("\n".join(f"{ip}: {name}" for ip, name in sorted(peers.items())) or "Nessun peer connesso", flush=True)
+        return True
+    if line == "/stats":
+        print(network.metrics.render_text(), end="", flush=True)
+        return True
+    group_message_match = re.match(r'^!!\s+([\w,]+)\s*(.*)$', line)
+    if group_message_match:
+        target_users = group_message_match.group(1).split(",")
+        # Per gli utenti non connessi i frame vengono conservati e consegnati alla loro riconnessione
+        network.send_to_users(target_users, encode_frame(MSG_GROUP_CHAT_REQUEST, username, *target_users))
+        if group_message_match.group(2):
+            network.send_to_users(target_users, encode_frame(MSG_GROUP_MESSAGE, username, group_message_match.group(2)))
+    elif re.match(r'^!(\w+)', line):
+        print("Le chat private non sono disponibili nel client senza interfaccia", flush=True)
+    else:
+        network.send_public(encode_frame(MSG_PUBLIC, username, line))
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Client della chat peer-to-peer senza interfaccia grafica.")
+    parser.add_argument("--username", required=True, help="Nome utente annunciato agli altri peer")
+    parser.add_argument("--asyncio", action="store_true", help="Usa il motore asyncio invece di un thread per connessione")
+    parser.add_argument("--port", type=int, default=5000, help="Porta UDP della scoperta")
+    parser.add_argument("--multicast-group", default=DEFAULT_MULTICAST_GROUP,
+                        help="Gruppo multicast della scoperta ('' per usare il broadcast)")
+    parser.add_argument("--broadcast-ip", default="172.20.10.15", help="Indirizzo di broadcast, usato senza multicast")
+    parser.add_argument("--bind-ip", default="", help="Indirizzo locale su cui ascoltare (predefinito tutte le interfacce)")
+    parser.add_argument("--peer", action="append", dest="peers", metavar="IP",
+                        help="Indirizzo di un peer a cui inviare gli annunci in unicast, al posto del gruppo (ripetibile)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    network_class = AsyncPeerCore if args.asyncio else PeerCore
+    network = network_class(args.broadcast_ip, args.port, multicast_group=args.multicast_group or None,
+                            bind_ip=args.bind_ip, discovery_targets=args.peers)
+    events = network.event_queue()
+    threading.Thread(target=print_events, args=(events,), daemon=True).start()
+    if args.asyncio:
+        network.start_peer_server(PEER_SERVER_PORT)  # Non blocca: il server gira sull'event loop
+    else:
+        network.open_peer_server(PEER_SERVER_PORT)  # La porta è aperta prima dell'annuncio della presenza
+        threading.Thread(target=network.start_peer_server, args=(PEER_SERVER_PORT,), daemon=True).start()
+    network.start(args.username)
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if line and not handle_command(network, args.username, line):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        network.stop()
+        events.put(None)  # Termina il thread che mostra gli eventi
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
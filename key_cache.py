@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from cryptography.hazmat.primitives import serialization
+
+
+class PublicKeyCache:
+    """Cache delle chiavi pubbliche degli utenti, con scadenza (TTL), limite LRU e copia su disco.
+
+    Le chiavi sono conservate già deserializzate, così l'invio di un messaggio non richiede
+    né una richiesta HTTP né il parsing del PEM. Le chiavi scadute vengono richieste di nuovo
+    all'API; se l'API non risponde si usa comunque l'ultima chiave nota (in memoria o su disco).
+
+    Parametri:
+        - fetch_pem: Funzione che, dato un nome utente, restituisce la chiave pubblica in PEM, o None se
+          l'utente non ha una chiave; deve sollevare un'eccezione se l'API non è disponibile.
+        - ttl: Durata in secondi di validità di una chiave in cache.
+        - max_entries: Numero massimo di chiavi tenute in memoria.
+        - disk_path: File JSON in cui salvare le chiavi tra un avvio e l'altro (None per disabilitarlo).
+    """
+
+    def __init__(self, fetch_pem, ttl=3600, max_entries=256, disk_path=None):
+        self.fetch_pem = fetch_pem
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # Dizionario username -> (chiave, istante di recupero), in ordine LRU
+        self._disk = {}  # Dizionario username -> {"pem": ..., "fetched": ...} salvato su disco
+        self._lock = threading.Lock()
+        self._load_disk()
+
+    def get(self, username):
+        """Restituisce la chiave pubblica dell'utente, o None se non è disponibile."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(username)  # Aggiorna l'ordine LRU
+                return entry[0]
+            stored = self._disk.get(username)
+            if stored is not None and now - stored["fetched"] < self.ttl:
+                # Chiave ancora valida sul disco: evita la richiesta all'API
+                key = serialization.load_pem_public_key(stored["pem"].encode('utf-8'))
+                self._store(username, key, stored["fetched"])
+                return key
+
+        try:
+            pem = self.fetch_pem(username)
+        except Exception as e:
+            print(f"Impossibile recuperare la chiave pubblica di {username}: {e!r}")
+            return self._stale(username)  # API non raggiungibile: si usa l'ultima chiave nota
+        if pem is None:
+            return None
+
+        key = serialization.load_pem_public_key(pem.encode('utf-8'))
+        with self._lock:
+            self._store(username, key, now)
+            self._disk[username] = {"pem": pem, "fetched": now}
+            self._save_disk()
+        return key
+
+    def invalidate(self, username=None):
+        """Rimuove dalla cache la chiave di un utente, o tutte le chiavi se username è None."""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                self._disk.clear()
+            else:
+                self._entries.pop(username, None)
+                self._disk.pop(username, None)
+            self._save_disk()
+
+    # Inserisce una chiave in memoria, eliminando la meno usata se si supera il limite
+    def _store(self, username, key, fetched):
+        self._entries[username] = (key, fetched)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Restituisce l'ultima chiave nota anche se scaduta
+    def _stale(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                return entry[0]
+            stored = self._disk.get(username)
+            if stored is not None:
+                key = serialization.load_pem_public_key(stored["pem"].encode('utf-8'))
+                self._store(username, key, stored["fetched"])
+                return key
+        return None
+
+    def _load_disk(self):
+        if self.disk_path is None or not os.path.exists(self.disk_path):
+            return
+        try:
+            with open(self.disk_path, encoding='utf-8') as f:
+                self._disk = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cache delle chiavi pubbliche non leggibile, verrà ricreata: {e}")
+            self._disk = {}
+
+    # Salva le chiavi su disco scrivendo prima un file temporaneo, così un'interruzione non lo corrompe
+    def _save_disk(self):
+        if self.disk_path is None:
+            return
+        tmp_path = self.disk_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding='utf-8') as f:
+                json.dump(self._disk, f)
+            os.replace(tmp_path, self.disk_path)
+        except OSError as e:
+            print(f"Impossibile salvare la cache delle chiavi pubbliche: {e}")
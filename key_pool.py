@@ -0,0 +1,153 @@
+import os
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+
+def generate_rsa_keys(key_size=2048):
+    """Genera una coppia di chiavi RSA e le restituisce in formato PEM.
+
+    Parametri:
+        - key_size: Lunghezza della chiave RSA in bit (predefinito 2048).
+
+    Restituisce:
+        - private_key_pem: Chiave privata in formato PEM.
+        - public_key_pem: Chiave pubblica in formato PEM.
+    """
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,  # Esponente standard per RSA
+        key_size=key_size,  # Lunghezza della chiave
+        backend=default_backend()  # Backend per la generazione della chiave
+    )
+    public_key = private_key.public_key()  # Estrae la chiave pubblica dalla chiave privata
+
+    # Serializza la chiave privata in formato PEM
+    private_key_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,  # Usato per compatibilità
+        encryption_algorithm=serialization.NoEncryption()  # Chiave non criptata
+    ).decode('utf-8')
+
+    # Serializza la chiave pubblica in formato PEM
+    public_key_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo  # Formato per chiave pubblica
+    ).decode('utf-8')
+
+    return private_key_pem, public_key_pem  # Restituisce entrambe le chiavi
+
+
+_pools = weakref.WeakSet()  # Riserve di chiavi del processo, da svuotare nei processi figli
+
+
+def _reset_pools_after_fork():
+    for pool in list(_pools):
+        pool._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+class RSAKeyPool:
+    """Riserva di coppie di chiavi RSA già generate, usata per rendere immediata la registrazione.
+
+    Le chiavi vengono generate in background da un pool di processi (una generazione RSA occupa
+    la CPU per decine o centinaia di millisecondi e in un processo separato non blocca il server)
+    e conservate in memoria fino a pool_size coppie. take() restituisce una coppia pronta e chiede
+    subito di sostituirla; se la riserva è vuota la chiave viene generata nel thread chiamante.
+
+    Il pool è sicuro rispetto a fork() (ad esempio i processi di lavoro di serve.py): nel processo
+    figlio la riserva viene svuotata, perché due processi non devono mai consegnare la stessa
+    chiave, e il pool di processi del padre viene dimenticato; il figlio chiama di nuovo start().
+
+    Parametri:
+        - key_size: Lunghezza delle chiavi RSA in bit.
+        - pool_size: Numero massimo di coppie di chiavi tenute pronte.
+        - workers: Numero di processi di generazione (predefinito: uno per core).
+    """
+
+    def __init__(self, key_size=2048, pool_size=32, workers=None):
+        self.key_size = key_size
+        self.pool_size = pool_size
+        self.workers = workers
+        self._ready = deque()  # Coppie (private_key_pem, public_key_pem) pronte all'uso
+        self._in_flight = 0  # Generazioni in corso nel pool di processi
+        self._executor = None  # Pool di processi, creato da start()
+        self._lock = threading.Lock()  # Protegge la riserva, il contatore e il pool di processi
+        _pools.add(self)
+
+    def start(self):
+        """Avvia il pool di processi e inizia a riempire la riserva.
+
+        Va chiamata prima di avviare il server, così i processi vengono creati quando non ci sono
+        ancora thread che servono richieste.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._refill()
+
+    def stop(self):
+        """Ferma il pool di processi; le chiavi successive vengono generate nel thread chiamante."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def take(self):
+        """Restituisce una coppia (private_key_pem, public_key_pem), dalla riserva se disponibile."""
+        with self._lock:
+            keys = self._ready.popleft() if self._ready else None
+        self._refill()
+        if keys is None:
+            # Riserva vuota (avvio recente o molte registrazioni di seguito): generazione immediata
+            keys = generate_rsa_keys(self.key_size)
+        return keys
+
+    def available(self):
+        """Restituisce il numero di coppie di chiavi pronte."""
+        with self._lock:
+            return len(self._ready)
+
+    # Eseguita nel processo figlio dopo fork(): il figlio riparte senza chiavi e senza pool di processi
+    def _after_fork(self):
+        self._lock = threading.Lock()  # Il lock potrebbe essere stato acquisito da un altro thread del padre
+        self._ready = deque()
+        self._in_flight = 0
+        self._executor = None
+
+    # Chiede al pool di processi le chiavi mancanti per riempire la riserva
+    def _refill(self):
+        futures = []
+        with self._lock:
+            if self._executor is not None:
+                missing = self.pool_size - len(self._ready) - self._in_flight
+                for _ in range(max(missing, 0)):
+                    try:
+                        future = self._executor.submit(generate_rsa_keys, self.key_size)
+                    except RuntimeError as e:  # Pool di processi fermato o non più utilizzabile
+                        print(f"Generazione delle chiavi in background non disponibile: {e}")
+                        self._executor = None
+                        break
+                    self._in_flight += 1
+                    futures.append(future)
+        # Le callback vengono registrate fuori dal lock: se la generazione è già terminata (ad esempio
+        # perché il pool di processi si è interrotto) _on_generated viene eseguita subito in questo thread
+        for future in futures:
+            future.add_done_callback(self._on_generated)
+
+    # Chiamata da un thread del pool di processi quando una generazione termina
+    def _on_generated(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self._ready.append(future.result())
+        if error is not None:
+            print(f"Generazione di una chiave RSA non riuscita: {error!r}")
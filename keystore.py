@@ -0,0 +1,76 @@
+import os
+import threading
+from cryptography.hazmat.primitives import serialization
+from local_store import data_path
+
+
+class PrivateKeyHolder:
+    """Chiave privata dell'utente corrente, caricata una sola volta per sessione e condivisa da tutte le finestre.
+
+    La chiave viene letta dal keystore locale, cifrato con la password dell'utente; solo se il
+    keystore non esiste (primo accesso da questo dispositivo) viene richiesta all'API e poi
+    salvata cifrata su disco, così agli accessi successivi l'API non viene più contattata.
+
+    Parametri:
+        - username: Nome dell'utente corrente.
+        - password: Password dell'utente, usata per cifrare e decifrare il keystore locale.
+        - fetch_pem: Funzione che, dato un nome utente, restituisce la chiave privata in PEM dall'API (o None).
+        - keystore_path: File del keystore locale (predefinito ~/.chat_p2p/keys/<username>.pem).
+    """
+
+    def __init__(self, username, password, fetch_pem, keystore_path=None):
+        self.username = username
+        self._password = password.encode('utf-8')
+        self.fetch_pem = fetch_pem
+        self.keystore_path = keystore_path or data_path("keys", f"{username}.pem")
+        self._key = None  # Chiave privata deserializzata
+        self._lock = threading.Lock()  # Evita caricamenti concorrenti della stessa chiave
+
+    def get(self, username=None):
+        """Restituisce la chiave privata dell'utente corrente, caricandola al primo utilizzo (o None)."""
+        if username is not None and username != self.username:
+            return None  # Il processo conosce solo la chiave privata dell'utente che ha effettuato l'accesso
+        with self._lock:
+            if self._key is None:
+                self._key = self._load_from_keystore() or self._load_from_api()
+            return self._key
+
+    def _load_from_keystore(self):
+        if not os.path.exists(self.keystore_path):
+            return None
+        try:
+            with open(self.keystore_path, "rb") as f:
+                return serialization.load_pem_private_key(f.read(), password=self._password)
+        except (OSError, ValueError, TypeError) as e:
+            # Keystore illeggibile o cifrato con una password diversa: si recupera di nuovo la chiave dall'API
+            print(f"Keystore locale non valido per {self.username}: {e}")
+            return None
+
+    def _load_from_api(self):
+        try:
+            pem = self.fetch_pem(self.username)
+        except Exception as e:
+            print(f"Failed to fetch private key for {self.username}: {e!r}")
+            return None
+        if not pem:
+            return None
+        key = serialization.load_pem_private_key(pem.encode('utf-8'), password=None)
+        print(f"Private key fetched successfully for {self.username}.")
+        self._save_to_keystore(key)
+        return key
+
+    # Salva la chiave cifrata con la password dell'utente, leggibile solo dal proprietario del file
+    def _save_to_keystore(self, key):
+        if not self._password:
+            return  # Senza password il keystore non può essere cifrato e non viene salvato
+        encrypted_pem = key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.BestAvailableEncryption(self._password)
+        )
+        try:
+            fd = os.open(self.keystore_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(encrypted_pem)
+        except OSError as e:
+            print(f"Impossibile salvare il keystore locale: {e}")
@@ -0,0 +1,12 @@
+import os
+
+# Cartella locale in cui il client conserva i dati che devono sopravvivere ai riavvii
+# (cache delle chiavi pubbliche e altri file dell'utente)
+DATA_DIR = os.environ.get("CHAT_P2P_DATA_DIR", os.path.join(os.path.expanduser("~"), ".chat_p2p"))
+
+
+def data_path(*parts):
+    """Restituisce il percorso di un file nella cartella dei dati locali, creando le cartelle necessarie."""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
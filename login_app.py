@@ -1,5 +1,6 @@
 from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, QMessageBox, QSpacerItem, QSizePolicy
 from message_app import MessageApp, MessageReceiver
+from keystore import PrivateKeyHolder
 
 # Classe della finestra di login
 class LoginApp(QWidget):
@@ -65,13 +66,19 @@ class LoginApp(QWidget):
         password = self.password_field.text()  # Ottiene il testo inserito nel campo password
         success, msg = self.user_manager.login_user(username, password) # Effettua il login tramite user_manager
         if success:
+            # Carica una sola volta la chiave privata (dal keystore locale o dall'API) per tutta la sessione
+            private_key = PrivateKeyHolder(username, password, self.user_manager.fetch_private_key_pem)
+            private_key.get()
+            # Il server TCP dei peer deve accettare connessioni prima dell'annuncio della presenza: i peer che
+            # rispondono inviano subito i messaggi conservati per questo utente. Le accetta MessageReceiver
+            self.peer_network.open_peer_server(5001)
             self.peer_network.start(username)  # Avvia il network peer-to-peer con il nome utente
-            self.open_message_app(username) # Avvia il network peer-to-peer con il nome utente
+            self.open_message_app(username, private_key) # Avvia il network peer-to-peer con il nome utente
         else:
             QMessageBox.warning(self, "Errore", msg)  # Mostra un messaggio di errore se il login fallisce
 
     # Metodo per aprire l'applicazione dei messaggi
-    def open_message_app(self, username):
-        self.message_app = MessageApp(username, self.user_manager, self.peer_network)  # Crea l'istanza dell'app di messaggi
+    def open_message_app(self, username, private_key):
+        self.message_app = MessageApp(username, self.user_manager, self.peer_network, private_key)  # Crea l'istanza dell'app di messaggi
         self.message_app.show()  # Mostra la finestra dell'app di messaggi
         self.close()  # Chiude la finestra di login
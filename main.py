@@ -1,13 +1,14 @@
 import sys
 from PyQt5.QtWidgets import QApplication
-from peernetwork import PeerNetwork
+from peernetwork import PeerNetwork, AsyncPeerNetwork
 from user_manager import UserManager
 from login_app import LoginApp
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     user_manager = UserManager()
-    peer_network = PeerNetwork()
+    # Con --asyncio la rete peer-to-peer gira su un unico event loop invece che su un thread per connessione
+    peer_network = AsyncPeerNetwork() if "--asyncio" in sys.argv else PeerNetwork()
     login_window = LoginApp(user_manager, peer_network)
     login_window.show()
     sys.exit(app.exec_())
@@ -1,7 +1,14 @@
 import re
-from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, QTextEdit
-from PyQt5.QtCore import QTimer, QThread, pyqtSignal
-from chat_windows import PrivateChatWindow, GroupChatWindow
+from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, QTextEdit, QListView
+from PyQt5.QtCore import QThread, pyqtSignal
+from chat_windows import PrivateChatWindow, GroupChatWindow, get_public_key, invalidate_public_key
+from protocol import (encode_frame, MSG_PUBLIC, MSG_PRIVATE_CHAT_REQUEST, MSG_GROUP_CHAT_REQUEST,
+                      MSG_GROUP_MESSAGE, MSG_PRIVATE_MESSAGE, MSG_CHAT_CLOSED, MSG_DISCONNECT,
+                      MSG_SESSION_KEY, MSG_REKEY_REQUEST)
+from session_crypto import SessionKeyManager
+from outbound import OutboundPipeline
+from message_cache import LocalMessageCache
+from peer_list_model import ConnectedUsersModel
 
 
 class MessageApp(QWidget):
@@ -12,31 +19,41 @@ class MessageApp(QWidget):
         - username: Nome dell'utente corrente.
         - user_manager: Gestore per la gestione degli utenti.
         - peer_network: Rete peer-to-peer usata per inviare e ricevere messaggi tra utenti.
+        - private_key: Chiave privata dell'utente (keystore.PrivateKeyHolder), caricata una sola volta al login.
 
     Metodi:
-        - __init__(self, username, user_manager, peer_network): Costruttore della classe che inizializza i parametri di istanza e configura l'interfaccia utente.
+        - __init__(self, username, user_manager, peer_network, private_key): Costruttore della classe che inizializza i parametri di istanza e configura l'interfaccia utente.
         - init_ui(self): Metodo che configura l'interfaccia utente principale dell'applicazione.
         - send_message(self): Invia un messaggio al destinatario specificato, supportando messaggi pubblici, privati e di gruppo.
-        - receive_message(self, message): Gestisce la ricezione dei messaggi, includendo richieste di chat private e di gruppo.
+        - send_frame_async(self, target_username, data): Affida l'invio di un frame alla pipeline di invio.
+        - receive_message(self, frame): Gestisce la ricezione dei messaggi, includendo richieste di chat private e di gruppo.
         - open_private_chat(self, target_username): Apre una finestra di chat privata con un altro utente.
         - open_group_chat(self, target_usernames): Apre una finestra di chat di gruppo con una lista di utenti.
-        - update_connected_users(self): Aggiorna la lista degli utenti collegati e li visualizza nell'interfaccia.
+        - connected_users_model: Modello della lista degli utenti collegati, aggiornato dalle notifiche di ingresso e uscita dei peer.
     '''
 
-    def __init__(self, username, user_manager, peer_network):
+    def __init__(self, username, user_manager, peer_network, private_key):
         """Inizializza un'istanza di MessageApp, configurando i parametri di utente, rete, interfaccia e ricevitori di messaggi.
 
         Parametri:
             - username: Il nome dell'utente corrente.
             - user_manager: Oggetto per la gestione degli utenti.
             - peer_network: Oggetto che rappresenta la rete peer-to-peer per la comunicazione tra utenti.
+            - private_key: Chiave privata dell'utente (keystore.PrivateKeyHolder), condivisa da tutte le finestre di chat.
         """
         super().__init__()
         self.username = username  # Nome utente dell'utente corrente
         self.user_manager = user_manager  # Gestore degli utenti collegati
         self.peer_network = peer_network  # Rete peer-to-peer per la comunicazione
+        self.private_key = private_key  # Chiave privata caricata al login, senza richieste all'API per ogni messaggio
         self.private_chats = {}  # Dizionario per memorizzare le finestre di chat private
         self.group_chats = {}  # Dizionario per memorizzare le finestre di chat di gruppo
+        # Chiavi di sessione AES-GCM per le chat private, condivise da tutte le finestre
+        self.session_keys = SessionKeyManager(username, get_public_key, private_key.get)
+        # Pipeline di invio condivisa: connessioni, richieste HTTP e cifratura non bloccano l'interfaccia
+        self.outbound = OutboundPipeline()
+        # Cache locale della cronologia: all'apertura di una chat vengono scaricati solo i messaggi nuovi
+        self.message_cache = LocalMessageCache(username)
         self.init_ui()  # Inizializza l'interfaccia utente
 
         # Configura il ricevitore di messaggi
@@ -72,8 +89,14 @@ class MessageApp(QWidget):
         self.connected_users_label = QLabel("Connected Devices:")  # Etichetta per la lista degli utenti connessi
         layout.addWidget(self.connected_users_label)
 
-        self.connected_users_display = QTextEdit()  # Campo di testo per visualizzare gli utenti connessi
-        self.connected_users_display.setReadOnly(True)
+        # Lista degli utenti connessi: il modello parte dai peer già noti e viene aggiornato solo quando
+        # un peer entra o esce, senza ridisegnare periodicamente l'intera lista
+        self.connected_users_model = ConnectedUsersModel(self.peer_network.get_connected_ips(), self)
+        self.peer_network.peer_joined.connect(self.connected_users_model.peer_joined)
+        self.peer_network.peer_left.connect(self.connected_users_model.peer_left)
+        self.connected_users_display = QListView()
+        self.connected_users_display.setModel(self.connected_users_model)
+        self.connected_users_display.setUniformItemSizes(True)  # Righe di altezza uguale: la vista non misura ogni riga
         layout.addWidget(self.connected_users_display)
 
         # Istruzioni per l'avvio delle chat privata e di gruppo
@@ -90,13 +113,6 @@ class MessageApp(QWidget):
         self.setLayout(layout)  # Imposta il layout dell'interfaccia
         self.setWindowTitle("Messages")  # Titolo della finestra
 
-        self.update_connected_users()  # Aggiorna la lista degli utenti connessi
-
-        # Timer per aggiornare la lista degli utenti collegati ogni secondo
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_connected_users)
-        self.timer.start(1000)
-
     def send_message(self):
         """Invia un messaggio specificato, supportando chat pubbliche, private e di gruppo."""
         message = self.input_message.text()  # Ottiene il testo del messaggio
@@ -110,46 +126,60 @@ class MessageApp(QWidget):
                 # Chat privata con un utente specifico
                 target_username = direct_message_match.group(1)
                 self.open_private_chat(target_username)  # Apre la chat privata
-                ip = self.peer_network.get_ip_by_username(target_username)  # Ottiene l'IP del destinatario
-                if ip:
-                    private_message = f"PRIVATE_CHAT_REQUEST|{self.username}"  # Crea il messaggio di richiesta
-                    self.peer_network.send_message(ip, 5001, private_message)  # Invia il messaggio
+                # Invia la richiesta di chat privata con il proprio nome utente; se il destinatario non è
+                # connesso la richiesta viene conservata e consegnata alla sua riconnessione
+                self.send_frame_async(target_username, encode_frame(MSG_PRIVATE_CHAT_REQUEST, self.username))
 
             elif group_message_match:
                 # Chat di gruppo con più utenti
                 target_users = group_message_match.group(1).split(",")
                 self.open_group_chat(target_users)  # Apre la chat di gruppo
-                for target_username in target_users:
-                    ip = self.peer_network.get_ip_by_username(target_username)
-                    if ip:
-                        group_request = f"GROUP_CHAT_REQUEST|{self.username}|{','.join(target_users)}"
-                        self.peer_network.send_message(ip, 5001, group_request)
+                group_request = encode_frame(MSG_GROUP_CHAT_REQUEST, self.username, *target_users)
+                # Invio in parallelo ai membri connessi; per gli altri la richiesta viene conservata (scrittura
+                # su disco), quindi il lavoro è affidato alla pipeline di invio, con la chiave della chat di gruppo
+                if not self.outbound.submit(",".join(sorted(target_users)),
+                                            lambda: self.peer_network.send_to_users(target_users, group_request)):
+                    self.received_messages.append("[Coda di invio piena, richiesta di chat di gruppo non inviata]")
 
             else:
                 # Messaggio pubblico inviato a tutti gli utenti connessi
-                for ip, _ in self.peer_network.get_connected_ips().items():
-                    self.peer_network.send_message(ip, 5001, f"{self.username}: {message}")
+                public_message = encode_frame(MSG_PUBLIC, self.username, message)  # Codificato una sola volta
+                # Un solo datagramma multicast per tutti gli utenti connessi, qualunque sia il loro numero
+                self.peer_network.send_public(public_message)
 
             self.input_message.clear()  # Svuota il campo di input
 
-    def receive_message(self, message):
+    def send_frame_async(self, target_username, data):
+        """Affida l'invio di un frame alla pipeline di invio, senza bloccare l'interfaccia.
+
+        Se il destinatario non è connesso, il frame viene conservato nella casella in uscita e
+        consegnato quando il peer torna visibile sulla rete.
+
+        Parametri:
+            - target_username: Nome dell'utente destinatario, usato anche per mantenere l'ordine dei messaggi.
+            - data: Frame già codificato.
+        """
+        if not self.outbound.submit(target_username, lambda: self.peer_network.send_or_store(target_username, data)):
+            self.received_messages.append(f"[Coda di invio piena, messaggio per {target_username} non inviato]")
+
+    def receive_message(self, frame):
         """Riceve e gestisce un messaggio in arrivo, creando o aggiornando le chat necessarie.
 
         Parametri:
-            - message: Messaggio ricevuto che può includere richieste di chat privata, di gruppo o messaggi di testo.
+            - frame: Frame ricevuto (protocol.Frame) che può contenere richieste di chat privata, di gruppo o messaggi di testo.
         """
-        if message.startswith("PRIVATE_CHAT_REQUEST|"):
-            requester_username = message.split("|")[1]  # Nome utente del richiedente
+        if frame.msg_type == MSG_PRIVATE_CHAT_REQUEST:
+            requester_username = frame.text(0)  # Nome utente del richiedente
             self.open_private_chat(requester_username)  # Apre la chat privata con il richiedente
-        elif message.startswith("GROUP_CHAT_REQUEST|"):
-            _, requester_username, group_usernames = message.split("|", 2)  # Estrae dettagli della chat
-            group_users = group_usernames.split(",")
+        elif frame.msg_type == MSG_GROUP_CHAT_REQUEST:
+            requester_username = frame.text(0)  # Estrae dettagli della chat
+            group_users = frame.texts(1)
             if requester_username not in group_users:
                 group_users.append(requester_username)
             self.open_group_chat(group_users)  # Apre la chat di gruppo
-        elif message.startswith("GROUP_MESSAGE|"):
+        elif frame.msg_type == MSG_GROUP_MESSAGE:
             # Estrae dettagli di un messaggio di gruppo
-            _, sender_username, msg_content = message.split("|", 2)
+            sender_username, msg_content = frame.text(0), frame.text(1)
             if sender_username != self.username:  # Ignora messaggi inviati dall'utente corrente
                 group_key = ",".join(sorted(self.group_chats.keys()))  # Genera chiave per la chat di gruppo
                 if group_key in self.group_chats:
@@ -158,15 +188,27 @@ class MessageApp(QWidget):
                     self.open_group_chat([sender_username])
                     if group_key in self.group_chats:
                         self.group_chats[group_key].receive_message(f"{sender_username}: {msg_content}")
-        elif message.startswith("PRIVATE_MESSAGE|"):
-            _, sender_username, msg_content = message.split("|", 2)
-            if sender_username in self.private_chats:
-                self.private_chats[sender_username].receive_message(f"{sender_username}: {msg_content}")
-            else:
+        elif frame.msg_type == MSG_SESSION_KEY:
+            # Nuova chiave di sessione di un mittente: unica decifratura RSA per l'intera sessione
+            try:
+                self.session_keys.accept_session_key(frame.text(0), frame.fields[1], frame.fields[2])
+            except Exception as e:
+                print(f"Chiave di sessione non valida da {frame.text(0)}: {e!r}")
+        elif frame.msg_type == MSG_REKEY_REQUEST:
+            # Il prossimo messaggio verso il peer userà una nuova chiave di sessione, cifrata con la sua chiave
+            # pubblica richiesta di nuovo all'API nel caso in cui quella in cache non sia più valida
+            invalidate_public_key(frame.text(0))
+            self.session_keys.reset(frame.text(0))
+        elif frame.msg_type == MSG_PRIVATE_MESSAGE:
+            sender_username, key_id, payload = frame.text(0), frame.fields[1], frame.fields[2]  # Il testo cifrato resta in binario
+            if sender_username not in self.private_chats:
                 self.open_private_chat(sender_username)
-                self.private_chats[sender_username].receive_message(f"{sender_username}: {msg_content}")
-        else:
-            self.received_messages.append(message)  # Visualizza messaggi pubblici nella finestra principale
+            self.private_chats[sender_username].receive_message(sender_username, key_id, payload)
+        elif frame.msg_type == MSG_PUBLIC:
+            # Visualizza messaggi pubblici nella finestra principale
+            self.received_messages.append(f"{frame.text(0)}: {frame.text(1)}")
+        elif frame.msg_type in (MSG_CHAT_CLOSED, MSG_DISCONNECT):
+            pass  # Notifiche già gestite da PeerNetwork, non vanno mostrate nella chat pubblica
 
     def open_private_chat(self, target_username):
         """Apre una finestra di chat privata con un utente specifico, se non già aperta.
@@ -175,7 +217,8 @@ class MessageApp(QWidget):
             - target_username: Nome dell'utente con cui avviare la chat privata.
         """
         if target_username not in self.private_chats or not self.private_chats[target_username].isVisible():
-            private_chat = PrivateChatWindow(self.username, [target_username], self.peer_network)
+            private_chat = PrivateChatWindow(self.username, [target_username], self.peer_network, self.session_keys,
+                                             self.outbound, self.message_cache)
             private_chat.show()  # Mostra la finestra della chat privata
             self.private_chats[target_username] = private_chat  # Memorizza la finestra nel dizionario
         else:
@@ -189,32 +232,26 @@ class MessageApp(QWidget):
         """
         group_key = ",".join(sorted(target_usernames))  # Chiave unica per identificare la chat di gruppo
         if group_key not in self.group_chats or not self.group_chats[group_key].isVisible():
-            group_chat = GroupChatWindow(self.username, target_usernames, self.peer_network)
+            group_chat = GroupChatWindow(self.username, target_usernames, self.peer_network, self.outbound)
             group_chat.show()  # Mostra la finestra della chat di gruppo
             self.group_chats[group_key] = group_chat  # Memorizza la finestra nel dizionario
         else:
             self.group_chats[group_key].activateWindow()  # Porta la finestra esistente in primo piano
 
-    def update_connected_users(self):
-        """Aggiorna e visualizza la lista degli utenti connessi."""
-        connected_users_info = self.peer_network.get_connected_ips()
-        user_list = "\n".join([f"{ip}: {username}" for ip, username in connected_users_info.items()])
-        self.connected_users_display.setPlainText(user_list)  # Visualizza la lista degli utenti connessi
-
 
 class MessageReceiver(QThread):
     """
     La classe MessageReceiver rappresenta un thread che si occupa di ricevere messaggi dalla rete peer-to-peer.
 
     Attributi:
-        - message_received: Segnale emesso quando viene ricevuto un messaggio, contenente il messaggio come stringa.
+        - message_received: Segnale emesso quando viene ricevuto un messaggio, contenente il frame decodificato.
 
     Metodi:
         - __init__(self, peer_network, parent=None): Costruttore che inizializza il thread con la rete peer-to-peer.
         - run(self): Metodo che avvia il server per ascoltare i messaggi in arrivo sulla rete peer-to-peer.
     """
 
-    message_received = pyqtSignal(str)  # Segnale emesso quando viene ricevuto un messaggio
+    message_received = pyqtSignal(object)  # Segnale emesso quando viene ricevuto un messaggio (protocol.Frame)
 
     def __init__(self, peer_network, parent=None):
         """Inizializza il thread MessageReceiver, configurandolo per ricevere messaggi dalla rete peer-to-peer.
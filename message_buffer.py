@@ -0,0 +1,69 @@
+import threading
+import time
+import uuid
+
+
+class MessageWriteBuffer:
+    """Buffer di scrittura differita per il salvataggio dei messaggi nel database tramite l'API.
+
+    I messaggi vengono accumulati in memoria e inviati in blocco all'endpoint `/save_messages`
+    quando il buffer raggiunge max_batch messaggi, quando sono trascorsi flush_interval secondi
+    oppure quando viene chiamato flush() (ad esempio alla chiusura di una finestra). In caso di
+    errore i messaggi restano nel buffer e vengono ritentati al salvataggio successivo. Ogni
+    messaggio ha un identificativo generato qui (client_id): se il blocco era già stato salvato ma la
+    risposta non è arrivata, l'API riconosce i messaggi ritentati e non li salva una seconda volta.
+
+    Parametri:
+        - save_batch: Funzione che riceve una lista di dizionari (sender, receiver oppure members, message,
+          timestamp, client_id) e li salva; deve sollevare un'eccezione in caso di errore.
+        - max_batch: Numero di messaggi che provoca un salvataggio immediato.
+        - flush_interval: Tempo massimo in secondi di permanenza di un messaggio nel buffer.
+        - max_pending: Numero massimo di messaggi conservati se l'API non è raggiungibile.
+    """
+
+    def __init__(self, save_batch, max_batch=50, flush_interval=2.0, max_pending=10000):
+        self.save_batch = save_batch
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []  # Messaggi in attesa di essere salvati
+        self._condition = threading.Condition()  # Protegge il buffer e sveglia il thread di salvataggio
+        self._flush_lock = threading.Lock()  # Un solo salvataggio alla volta, per mantenere l'ordine dei messaggi
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, sender, receiver, message, members=None):
+        """Aggiunge un messaggio al buffer senza bloccare; per i messaggi di gruppo receiver è None e members la lista dei partecipanti."""
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())  # Stesso formato di CURRENT_TIMESTAMP di SQLite
+        entry = {"sender": sender, "receiver": receiver, "message": message, "timestamp": timestamp,
+                 "client_id": uuid.uuid4().hex}  # Resta lo stesso a ogni nuovo tentativo di salvataggio
+        if members is not None:
+            entry["members"] = list(members)
+        with self._condition:
+            self._pending.append(entry)
+            if len(self._pending) >= self.max_batch:
+                self._condition.notify()  # Buffer pieno: il thread di salvataggio parte subito
+
+    def flush(self):
+        """Salva subito tutti i messaggi in attesa. Restituisce False se il salvataggio non è riuscito."""
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return True
+            try:
+                self.save_batch(batch)
+            except Exception as e:
+                print(f"Salvataggio dei messaggi non riuscito, verrà ritentato: {e!r}")
+                with self._condition:
+                    # Rimette i messaggi in testa al buffer, scartando i più vecchi oltre il limite
+                    self._pending = (batch + self._pending)[-self.max_pending:]
+                return False
+            return True
+
+    # Ciclo del thread di salvataggio: attende che il buffer si riempia o che scada l'intervallo
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.flush_interval)
+            self.flush()
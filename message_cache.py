@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+from local_store import data_path
+
+
+class LocalMessageCache:
+    """Cache locale (SQLite) dei messaggi delle conversazioni dell'utente.
+
+    Contiene, per ogni interlocutore, un intervallo continuo di messaggi con gli stessi id del
+    server: all'apertura di una chat la cronologia viene mostrata subito dalla cache e all'API
+    vengono chiesti solo i messaggi successivi all'ultimo id salvato (o le pagine più vecchie
+    di quelle già presenti).
+
+    Parametri:
+        - username: Nome dell'utente corrente; ogni utente ha il proprio file di cache.
+        - path: Percorso del file SQLite (predefinito ~/.chat_p2p/cache/<username>.db).
+    """
+
+    def __init__(self, username, path=None):
+        self.path = path or data_path("cache", f"{username}.db")
+        # La cache è usata sia dal thread dell'interfaccia sia dai worker della pipeline
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    peer TEXT NOT NULL,
+                    sender TEXT,
+                    message TEXT,
+                    timestamp TEXT
+                )
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_peer ON messages (peer, id)")
+            self._conn.commit()
+
+    def store(self, peer, messages):
+        """Salva nella cache i messaggi [id, sender, message, timestamp] scambiati con peer."""
+        if not messages:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, peer, sender, message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(message_id, peer, sender, message, timestamp) for message_id, sender, message, timestamp in messages])
+            self._conn.commit()
+
+    def page(self, peer, before_id=None, limit=50):
+        """Restituisce fino a limit messaggi con peer precedenti a before_id (o i più recenti), in ordine cronologico."""
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT id, sender, message, timestamp FROM messages
+                WHERE peer = ? AND id < ?
+                ORDER BY id DESC LIMIT ?
+            ''', (peer, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [list(row) for row in reversed(rows)]
+
+    def last_id(self, peer):
+        """Restituisce l'id del messaggio più recente con peer presente nella cache, o None."""
+        with self._lock:
+            return self._conn.execute("SELECT MAX(id) FROM messages WHERE peer = ?", (peer,)).fetchone()[0]
+
+    def clear(self, peer=None):
+        """Svuota la cache di una conversazione, o di tutte se peer è None."""
+        with self._lock:
+            if peer is None:
+                self._conn.execute("DELETE FROM messages")
+            else:
+                self._conn.execute("DELETE FROM messages WHERE peer = ?", (peer,))
+            self._conn.commit()
@@ -0,0 +1,265 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Metriche del client e del server API: contatori, valori istantanei e istogrammi delle durate.
+#
+# Ogni metrica può avere delle etichette (ad esempio il tipo di messaggio o l'endpoint):
+# ogni combinazione di etichette è una serie separata. Le metriche sono esposte nel formato
+# testuale di Prometheus (render_text) o come dizionario serializzabile in JSON (snapshot).
+# Non ci sono dipendenze esterne: il modulo è usato sia dal client senza PyQt5 sia da API.py.
+
+# Limiti superiori dei bucket degli istogrammi, in secondi: da mezzo millisecondo a 10 secondi
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Chiave di una serie: le etichette ordinate per nome, così l'ordine degli argomenti non conta
+def _series_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+# Etichette nel formato di Prometheus: {nome="valore",...}
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """Valore che può solo crescere, ad esempio il numero di messaggi inviati."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}  # Dizionario chiave della serie -> valore
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Incrementa la serie con le etichette indicate."""
+        key = _series_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Restituisce il valore della serie con le etichette indicate."""
+        return self._values.get(_series_key(labels), 0)
+
+    def series(self):
+        with self._lock:
+            return [(key, {"value": value}) for key, value in self._values.items()]
+
+    def render(self):
+        with self._lock:  # Copia sotto il lock: un inc() concorrente può aggiungere una nuova serie
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Valore istantaneo che può crescere e diminuire, ad esempio il numero di peer connessi.
+
+    Se viene indicata una funzione, il valore è calcolato solo al momento della lettura.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, function=None):
+        super().__init__(name, help_text)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_series_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def series(self):
+        if self.function is not None:
+            return [((), {"value": self.function()})]
+        return super().series()
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {entry['value']}" for key, entry in sorted(self.series())]
+
+
+# Conteggi di una serie di un istogramma
+class HistogramSeries:
+    __slots__ = ("buckets", "count", "total", "maximum")
+
+    def __init__(self, size):
+        self.buckets = [0] * size  # Osservazioni per bucket (non cumulative); l'ultimo è +Inf
+        self.count = 0  # Numero di osservazioni
+        self.total = 0.0  # Somma delle osservazioni
+        self.maximum = 0.0  # Osservazione più grande
+
+
+class Histogram:
+    """Distribuzione di durate (o altre grandezze) divisa in bucket, con stima dei percentili.
+
+    Parametri:
+        - name: Nome della metrica.
+        - help_text: Descrizione della metrica.
+        - buckets: Limiti superiori dei bucket, in ordine crescente.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.bounds = tuple(buckets)
+        self._series = {}  # Dizionario chiave della serie -> HistogramSeries
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Registra un'osservazione nella serie con le etichette indicate."""
+        key = _series_key(labels)
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = HistogramSeries(len(self.bounds) + 1)
+            series.buckets[index] += 1
+            series.count += 1
+            series.total += value
+            series.maximum = max(series.maximum, value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Misura la durata del blocco with e la registra, anche se il blocco solleva un'eccezione."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def series(self):
+        with self._lock:
+            return [(key, {
+                "count": series.count,
+                "sum": series.total,
+                "max": series.maximum,
+                "p50": self._quantile(series, 0.50),
+                "p99": self._quantile(series, 0.99),
+            }) for key, series in self._series.items()]
+
+    # Stima del percentile: limite superiore del bucket che contiene l'osservazione di rango q
+    def _quantile(self, series, q):
+        if not series.count:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for index, count in enumerate(series.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.bounds[index], series.maximum) if index < len(self.bounds) else series.maximum
+        return series.maximum
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.bounds + (float("inf"),), series.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series.total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Insieme delle metriche di un processo (o di un'istanza della rete).
+
+    I metodi counter, gauge e histogram restituiscono la metrica con il nome indicato,
+    creandola al primo utilizzo: moduli diversi possono quindi condividere la stessa metrica.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # Dizionario nome -> metrica, nell'ordine di creazione
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text="", function=None):
+        return self._get(Gauge, name, help_text, function)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def _get(self, metric_class, name, help_text, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, help_text, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"La metrica {name} esiste già con un tipo diverso")
+            return metric
+
+    def snapshot(self):
+        """Restituisce un dizionario nome -> lista delle serie ({"labels": ..., ...valori}), serializzabile in JSON."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: [{"labels": dict(key), **values} for key, values in metric.series()]
+                for metric in metrics}
+
+    def render_text(self):
+        """Restituisce tutte le metriche nel formato testuale di Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.help_text:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsReporter:
+    """Scrive periodicamente le metriche in un file JSON, leggibile da altri programmi mentre il client è attivo.
+
+    Il file viene sostituito in modo atomico, così chi lo legge non trova mai un contenuto parziale.
+
+    Parametri:
+        - registry: Metriche da scrivere (MetricsRegistry).
+        - path: Percorso del file JSON.
+        - interval: Secondi tra due scritture.
+    """
+
+    def __init__(self, registry, path, interval=10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        """Ferma le scritture periodiche dopo un'ultima scrittura con i valori finali."""
+        self._stop_event.set()
+        self.write()
+
+    def write(self):
+        document = {"time": time.time(), "pid": os.getpid(), "metrics": self.registry.snapshot()}
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, "w") as stats_file:
+                json.dump(document, stats_file)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            print(f"Impossibile scrivere le metriche in {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
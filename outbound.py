@@ -0,0 +1,91 @@
+import queue
+import threading
+import zlib
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class OutboundJob:
+    """Operazione di invio eseguita da un worker: cifratura, salvataggio e trasmissione di un messaggio.
+
+    Parametri:
+        - key: Chiave di instradamento (di solito il destinatario); i job con la stessa chiave
+          sono eseguiti in ordine dallo stesso worker.
+        - work: Funzione senza argomenti eseguita nel worker; il valore restituito è il risultato del job.
+        - on_done: Funzione chiamata nel thread dell'interfaccia con il risultato, se il job riesce.
+        - on_error: Funzione chiamata nel thread dell'interfaccia con il messaggio di errore, se il job fallisce.
+    """
+
+    __slots__ = ("key", "work", "on_done", "on_error")
+
+    def __init__(self, key, work, on_done=None, on_error=None):
+        self.key = key
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+
+
+class OutboundPipeline(QObject):
+    """Pipeline di invio che esegue le operazioni bloccanti (rete, HTTP, cifratura) fuori dal thread dell'interfaccia.
+
+    Ogni worker ha una propria coda limitata e i job sono assegnati in base alla chiave, così i
+    messaggi verso lo stesso destinatario mantengono l'ordine mentre destinatari diversi vengono
+    serviti in parallelo. Esito ed errori tornano alle finestre tramite i segnali Qt, che vengono
+    consegnati nel thread dell'interfaccia.
+
+    Parametri:
+        - workers: Numero di thread di invio.
+        - queue_size: Numero massimo di job in attesa per ogni worker.
+    """
+
+    job_completed = pyqtSignal(object, object)  # Segnale emesso quando un job termina: (job, risultato)
+    job_failed = pyqtSignal(object, str)  # Segnale emesso quando un job fallisce: (job, messaggio di errore)
+
+    def __init__(self, workers=4, queue_size=256, parent=None):
+        super().__init__(parent)
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        for job_queue in self._queues:
+            thread = threading.Thread(target=self._run, args=(job_queue,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # I segnali emessi dai worker vengono consegnati a questi slot nel thread dell'interfaccia
+        self.job_completed.connect(self._dispatch_completed)
+        self.job_failed.connect(self._dispatch_failed)
+
+    def submit(self, key, work, on_done=None, on_error=None):
+        """Accoda un job senza bloccare. Restituisce False se la coda del worker è piena."""
+        job = OutboundJob(key, work, on_done, on_error)
+        # crc32 invece di hash(): l'assegnazione di una chiave al worker resta stabile tra un avvio e l'altro
+        job_queue = self._queues[zlib.crc32(str(key).encode('utf-8')) % len(self._queues)]
+        try:
+            job_queue.put_nowait(job)
+        except queue.Full:
+            return False
+        return True
+
+    def stop(self):
+        """Ferma i worker dopo che hanno completato i job già accodati."""
+        for job_queue in self._queues:
+            job_queue.put(None)
+
+    # Ciclo di un worker: esegue i job della propria coda uno alla volta
+    def _run(self, job_queue):
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            try:
+                result = job.work()
+            except Exception as e:
+                self.job_failed.emit(job, str(e) or repr(e))
+            else:
+                self.job_completed.emit(job, result)
+
+    def _dispatch_completed(self, job, result):
+        if job.on_done is not None:
+            job.on_done(result)
+
+    def _dispatch_failed(self, job, error):
+        print(f"Invio non riuscito verso {job.key}: {error}")
+        if job.on_error is not None:
+            job.on_error(error)
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MESSAGE_ID_SIZE = 16  # Byte casuali dell'identificativo di un messaggio conservato
+
+
+class PeerOutbox:
+    """Casella in uscita persistente (SQLite) dei frame destinati ai peer non connessi.
+
+    I frame sono conservati per destinatario, nell'ordine di invio, ognuno con un identificativo
+    casuale. Quando il peer torna visibile la rete li invia tutti insieme in frame MSG_BATCH sulla
+    stessa connessione e li rimuove solo dopo l'invio; il destinatario scarta gli identificativi
+    già ricevuti (RecentIds), così un nuovo tentativo dopo un errore non mostra due volte lo
+    stesso messaggio. Il file sopravvive ai riavvii del client.
+
+    Parametri:
+        - path: Percorso del file SQLite.
+        - max_per_peer: Numero massimo di frame conservati per un destinatario; oltre vengono scartati i più vecchi.
+        - max_age: Secondi dopo i quali un frame non consegnato viene scartato.
+    """
+
+    def __init__(self, path, max_per_peer=1000, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_per_peer = max_per_peer
+        self.max_age = max_age
+        # La casella è usata dai worker della pipeline, dal fan-out e dai thread che la svuotano
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    peer TEXT NOT NULL,
+                    message_id BLOB NOT NULL,
+                    frame BLOB NOT NULL,
+                    created REAL NOT NULL,
+                    UNIQUE (peer, message_id)
+                )
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_peer ON outbox (peer, seq)")
+            self._conn.execute("DELETE FROM outbox WHERE created < ?", (time.time() - max_age,))
+            self._conn.commit()
+            # Destinatari con frame in attesa, in memoria: has_pending() è chiamata a ogni invio
+            self._pending_peers = {row[0] for row in self._conn.execute("SELECT DISTINCT peer FROM outbox")}
+
+    def put(self, peer, frames, message_ids=None):
+        """Conserva i frame per peer, in ordine; un identificativo già presente per lo stesso peer viene ignorato.
+
+        Restituisce la lista degli identificativi dei frame (generati se message_ids è None).
+        """
+        if message_ids is None:
+            message_ids = [os.urandom(MESSAGE_ID_SIZE) for _ in frames]
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (peer, message_id, frame, created) VALUES (?, ?, ?, ?)",
+                [(peer, message_id, frame, now) for message_id, frame in zip(message_ids, frames)])
+            # Oltre il limite vengono scartati i frame più vecchi del destinatario
+            self._conn.execute('''
+                DELETE FROM outbox WHERE peer = ? AND seq <= (
+                    SELECT seq FROM outbox WHERE peer = ? ORDER BY seq DESC LIMIT 1 OFFSET ?
+                )
+            ''', (peer, peer, self.max_per_peer))
+            self._conn.commit()
+            self._pending_peers.add(peer)
+        return list(message_ids)
+
+    def has_pending(self, peer):
+        """Restituisce True se ci sono frame in attesa per peer."""
+        with self._lock:
+            return peer in self._pending_peers
+
+    def pending(self, peer, max_bytes=1024 * 1024):
+        """Restituisce i frame più vecchi in attesa per peer, come coppie (identificativo, frame), fino a circa max_bytes."""
+        entries, size = [], 0
+        with self._lock:
+            for message_id, frame in self._conn.execute(
+                    "SELECT message_id, frame FROM outbox WHERE peer = ? ORDER BY seq", (peer,)):
+                if entries and size + len(frame) > max_bytes:
+                    break
+                entries.append((message_id, frame))
+                size += len(frame)
+        return entries
+
+    def remove(self, peer, message_ids):
+        """Rimuove i frame consegnati a peer."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE peer = ? AND message_id = ?",
+                                   [(peer, message_id) for message_id in message_ids])
+            self._conn.commit()
+            if self._conn.execute("SELECT 1 FROM outbox WHERE peer = ? LIMIT 1", (peer,)).fetchone() is None:
+                self._pending_peers.discard(peer)
+
+    def peers(self):
+        """Restituisce i destinatari con frame in attesa."""
+        with self._lock:
+            return set(self._pending_peers)
+
+    def count(self, peer=None):
+        """Restituisce il numero di frame in attesa per peer, o per tutti i destinatari se peer è None."""
+        with self._lock:
+            if peer is None:
+                return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE peer = ?", (peer,)).fetchone()[0]
+
+
+class RecentIds:
+    """Identificativi dei messaggi ricevuti più di recente, usati per scartare i duplicati.
+
+    Parametri:
+        - max_size: Numero di identificativi ricordati; oltre vengono dimenticati i più vecchi.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()  # I frame possono arrivare da più connessioni in parallelo
+
+    def add(self, message_id):
+        """Registra un identificativo. Restituisce False se era già stato visto."""
+        with self._lock:
+            if message_id in self._ids:
+                return False
+            self._ids[message_id] = None
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+            return True
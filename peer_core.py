@@ -0,0 +1,528 @@
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from connection_pool import ConnectionPool
+from peer_registry import PeerRegistry
+from discovery import DiscoveryCore, DEFAULT_MULTICAST_GROUP, open_discovery_socket
+from codec import PayloadCodec, CAP_ZLIB
+from fanout import FanoutSender
+from public_channel import PublicChannel
+from metrics import MetricsRegistry, MetricsReporter
+from local_store import data_path
+from outbox import PeerOutbox, RecentIds
+from protocol import (FrameDecoder, ProtocolError, decode_frame, encode_frame, frame_type_name, MESSAGE_TYPE_NAMES,
+                      MSG_BATCH, MSG_CHAT_CLOSED, MSG_DISCONNECT, MSG_PUBLIC, MSG_RELAY)
+
+# Tipi di evento inseriti nelle code restituite da PeerCore.event_queue()
+EVENT_MESSAGE = "message"  # ("message", frame): frame ricevuto da un peer (protocol.Frame)
+EVENT_PEER_JOINED = "joined"  # ("joined", ip, username): un peer si è connesso
+EVENT_PEER_LEFT = "left"  # ("left", ip, username): un peer si è disconnesso
+
+OUTBOX_RETRY_DELAY = 1.0  # Secondi prima di ritentare lo svuotamento della casella in uscita dopo un errore
+OUTBOX_RETRY_MAX_DELAY = 60.0  # Attesa massima tra due tentativi (l'attesa raddoppia a ogni errore)
+
+
+# La classe PeerCore rappresenta una rete di peer in un sistema di comunicazione
+# Peer (ovvero i nodi della rete) si connettono tra loro per inviare e ricevere messaggi.
+# Non dipende da PyQt5: gli eventi (messaggi ricevuti, peer che entrano o escono) sono
+# notificati con funzioni registrate tramite subscribe() o con una coda (event_queue()),
+# nel thread di rete che li ha prodotti. L'interfaccia grafica usa l'adattatore Qt
+# di peernetwork.py, che trasforma gli stessi eventi in segnali.
+class PeerCore:
+    # Inizializzazione della classe PeerCore
+    def __init__(self, broadcast_ip="172.20.10.15", port=5000, buffer_size=1024, peer_timeout=10,
+                 multicast_group=DEFAULT_MULTICAST_GROUP, bind_ip="", discovery_targets=None, dispatch=None,
+                 stats_interval=10.0, peer_port=5001, store_and_forward=True):
+        self.BROADCAST_IP = broadcast_ip  # Indirizzo IP di broadcast, usato se multicast_group è None
+        self.MULTICAST_GROUP = multicast_group  # Gruppo multicast su cui i peer si annunciano
+        self.PORT = port  # Porta su cui il peer ascolterà
+        self.BIND_IP = bind_ip  # Indirizzo locale dei socket in ascolto (vuoto: tutte le interfacce)
+        self.DISCOVERY_TARGETS = discovery_targets  # Indirizzi IP a cui inviare gli annunci in unicast, al posto del gruppo
+        self.BUFFER_SIZE = buffer_size  # Dimensione massima del buffer per ricevere i dati
+        self.PEER_TIMEOUT = peer_timeout  # Tempo di inattività dopo il quale un peer viene considerato disconnesso
+        self.PEER_PORT = peer_port  # Porta TCP su cui gli altri peer ricevono i frame
+        self.STORE_AND_FORWARD = store_and_forward  # Conserva i frame per i peer non connessi (casella in uscita)
+        self.outbox = None  # Casella in uscita persistente (outbox.PeerOutbox), aperta all'avvio
+        self._delivered_ids = RecentIds()  # Identificativi dei frame già ricevuti dalle caselle in uscita dei peer
+        self._flush_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="outbox")  # Svuota le caselle senza bloccare la scoperta
+        self._flush_locks = {}  # Dizionario nome utente -> Lock, un solo svuotamento alla volta per peer
+        self._flush_locks_lock = threading.Lock()  # Protegge anche i due dizionari seguenti
+        self._flush_failures = {}  # Dizionario nome utente -> svuotamenti falliti di seguito, per l'attesa crescente
+        self._flush_retry_at = {}  # Dizionario nome utente -> istante (time.monotonic) del prossimo tentativo
+        self._server_sockets = {}  # Dizionario porta -> socket del server TCP già aperto
+        # Registro dei peer connessi: indici ip <-> nome utente, scadenze e notifiche di ingresso e uscita
+        self.peers = PeerRegistry(peer_timeout)
+        self.peers.subscribe(self.on_peer_joined, self.on_peer_left)
+        self.running = True  # Flag per mantenere attiva la rete peer-to-peer
+        self.discovery = None  # Protocollo di scoperta (discovery.DiscoveryCore), creato all'avvio
+        self.discovery_socket = None  # Socket UDP condiviso per inviare e ricevere gli annunci
+        self._stop_event = threading.Event()  # Interrompe l'attesa tra due annunci all'arresto della rete
+        self.metrics = MetricsRegistry()  # Contatori e istogrammi della rete, esposti nel file delle statistiche
+        self.STATS_INTERVAL = stats_interval  # Secondi tra due scritture del file delle statistiche (None per non scriverlo)
+        self._stats_reporter = None  # Scrittura periodica delle metriche (metrics.MetricsReporter), creata all'avvio
+        self._sent = self.metrics.counter("p2p_messages_sent_total", "Frame inviati ai peer, per tipo e trasporto")
+        self._received = self.metrics.counter("p2p_messages_received_total", "Frame ricevuti dai peer, per tipo e trasporto")
+        self._send_failures = self.metrics.counter("p2p_send_failures_total", "Invii TCP non riusciti, per tipo")
+        self._send_latency = self.metrics.histogram("p2p_send_seconds", "Durata di un invio TCP a un peer, connessione compresa")
+        self._connect_latency = self.metrics.histogram("p2p_connect_seconds", "Durata dell'apertura di una connessione TCP verso un peer")
+        self._inbound_connections = self.metrics.gauge("p2p_inbound_connections", "Connessioni TCP in ingresso aperte")
+        self.metrics.gauge("p2p_active_peers", "Peer connessi", function=lambda: len(self.peers))
+        self.metrics.gauge("p2p_threads", "Thread attivi nel processo", function=threading.active_count)
+        self.metrics.gauge("p2p_compression_bytes_in", "Byte dei frame inviati prima della compressione",
+                           function=lambda: self.codec.stats.bytes_in)
+        self.metrics.gauge("p2p_compression_bytes_out", "Byte dei frame effettivamente inviati",
+                           function=lambda: self.codec.stats.bytes_out)
+        self._outbox_stored = self.metrics.counter("p2p_outbox_stored_total", "Frame conservati per peer non connessi")
+        self._outbox_delivered = self.metrics.counter("p2p_outbox_delivered_total", "Frame della casella in uscita consegnati")
+        self._duplicates = self.metrics.counter("p2p_duplicate_messages_total", "Frame ricevuti più volte e scartati")
+        self.metrics.gauge("p2p_outbox_pending", "Frame in attesa nella casella in uscita",
+                           function=lambda: self.outbox.count() if self.outbox is not None else 0)
+        # Connessioni TCP persistenti verso i peer, riutilizzate tra i messaggi
+        self.connection_pool = ConnectionPool(connect_latency=self._connect_latency)
+        self.fanout = FanoutSender(self, port=peer_port, dispatch=dispatch)  # Invio parallelo (o ad albero) dello stesso frame a molti peer
+        self.public_channel = None  # Canale multicast della chat pubblica, creato all'avvio se il multicast è attivo
+        self.codec = PayloadCodec()  # Compressione dei frame verso i peer che la supportano, con statistiche
+        self._on_message = []  # Funzioni chiamate con il frame per ogni messaggio ricevuto
+        self._on_peer_joined = []  # Funzioni chiamate con (ip, username) quando un peer si connette
+        self._on_peer_left = []  # Funzioni chiamate con (ip, username) quando un peer si disconnette
+
+    def subscribe(self, on_message=None, on_peer_joined=None, on_peer_left=None):
+        """Registra le funzioni da chiamare per i messaggi ricevuti e per i peer che entrano o escono.
+
+        Le funzioni vengono chiamate nel thread di rete che ha prodotto l'evento e non devono bloccarlo a lungo.
+        """
+        if on_message is not None:
+            self._on_message.append(on_message)
+        if on_peer_joined is not None:
+            self._on_peer_joined.append(on_peer_joined)
+        if on_peer_left is not None:
+            self._on_peer_left.append(on_peer_left)
+
+    def event_queue(self, maxsize=0):
+        """Restituisce una coda che riceve tutti gli eventi della rete come tuple (EVENT_*, ...).
+
+        Pensata per i programmi senza interfaccia: un thread legge la coda invece di registrare funzioni.
+        """
+        events = queue.Queue(maxsize)
+        self.subscribe(on_message=lambda frame: events.put((EVENT_MESSAGE, frame)),
+                       on_peer_joined=lambda ip, username: events.put((EVENT_PEER_JOINED, ip, username)),
+                       on_peer_left=lambda ip, username: events.put((EVENT_PEER_LEFT, ip, username)))
+        return events
+
+    # Notifica un evento a tutte le funzioni registrate
+    @staticmethod
+    def _notify(callbacks, *args):
+        for callback in callbacks:
+            callback(*args)
+
+    # Crea il protocollo di scoperta per l'utente indicato
+    def create_discovery(self, username):
+        if self.DISCOVERY_TARGETS:
+            group_addresses = [(ip, self.PORT) for ip in self.DISCOVERY_TARGETS]
+        else:
+            group_addresses = [(self.MULTICAST_GROUP or self.BROADCAST_IP, self.PORT)]
+        return DiscoveryCore(username, self.peers, group_addresses)
+
+    # Funzione per annunciare la propria presenza sulla rete: un HELLO all'avvio, poi annunci sempre più radi
+    def broadcast_presence(self, username):
+        datagram, addresses = self.discovery.hello()
+        self.send_discovery(datagram, *addresses)
+        while self.running:
+            if self._stop_event.wait(self.discovery.next_beacon_delay()):
+                break  # Rete arrestata durante l'attesa
+            datagram, addresses = self.discovery.beacon()
+            if not self.send_discovery(datagram, *addresses):
+                break  # Se si verifica un errore, interrompe il ciclo
+
+    # Invia un datagramma di scoperta a uno o più indirizzi; restituisce False in caso di errore
+    def send_discovery(self, datagram, *addresses):
+        try:
+            for address in addresses:
+                self.discovery_socket.sendto(datagram, address)
+        except Exception as e:
+            print(f"Errore durante il broadcast: {e}")
+            return False
+        return True
+
+    # Funzione per ascoltare gli annunci ricevuti da altri peer sulla rete
+    def listen_for_peers(self):
+        print(f"Ascoltando sulla porta {self.PORT}...")
+
+        while self.running:
+            try:
+                data, addr = self.discovery_socket.recvfrom(self.BUFFER_SIZE)  # Riceve un datagramma da un peer
+            except socket.timeout:
+                continue
+            except (OSError, AttributeError) as e:
+                if self.running:
+                    print(f"Errore durante la ricezione: {e}")
+                break  # Interrompe in caso di errore o alla chiusura del socket
+            # Aggiorna il registro dei peer e invia le eventuali risposte (ad esempio a un nuovo peer)
+            for reply, address in self.discovery.datagram_received(data, addr):
+                self.send_discovery(reply, address)
+
+    # Funzione per monitorare lo stato dei peer e rimuovere quelli inattivi
+    def update_peer_list(self):
+        # L'intervallo di controllo delle connessioni inutilizzate non dipende dal numero di peer
+        idle_check_interval = self.connection_pool.idle_timeout / 4
+        next_idle_check = time.monotonic() + idle_check_interval
+        while self.running:
+            # Il thread dorme fino alla prossima scadenza di un peer (o al prossimo tentativo di svuotare
+            # una casella in uscita), senza scorrere l'elenco ogni secondo
+            with self._flush_locks_lock:
+                next_wake = min([next_idle_check, *self._flush_retry_at.values()])
+            self.peers.wait_and_expire(max(next_wake - time.monotonic(), 0))
+            self.retry_due_outboxes()
+            if time.monotonic() >= next_idle_check:
+                self.connection_pool.close_idle()  # Chiude le connessioni rimaste inutilizzate troppo a lungo
+                next_idle_check = time.monotonic() + idle_check_interval
+
+    # Funzione chiamata dal registro quando un peer si connette
+    def on_peer_joined(self, peer_ip, username):
+        print(f"{username} si è connesso da {peer_ip}. Peers connessi: {len(self.peers)}")
+        if self.outbox is not None and self.outbox.has_pending(username):
+            self._flush_executor.submit(self.flush_outbox, username)  # Consegna i frame conservati mentre era assente
+        self._notify(self._on_peer_joined, peer_ip, username)
+
+    # Funzione chiamata dal registro quando un peer scade o si disconnette
+    def on_peer_left(self, peer_ip, username):
+        self.connection_pool.evict(peer_ip)  # Chiude le connessioni verso il peer scaduto
+        print(f"Peer {peer_ip} disconnesso. Peers connessi: {len(self.peers)}")
+        self._notify(self._on_peer_left, peer_ip, username)
+
+    # Avvia la scrittura periodica delle metriche nel file metrics-<username>.json della cartella dei dati locali
+    def start_stats_reporter(self, username):
+        if self.STATS_INTERVAL and self._stats_reporter is None:
+            self._stats_reporter = MetricsReporter(self.metrics, data_path(f"metrics-{username}.json"), self.STATS_INTERVAL)
+            self._stats_reporter.start()
+
+    def stop_stats_reporter(self):
+        if self._stats_reporter is not None:
+            self._stats_reporter.stop()
+            self._stats_reporter = None
+
+    # Ritenta lo svuotamento delle caselle in uscita il cui tentativo è scaduto
+    def retry_due_outboxes(self):
+        now = time.monotonic()
+        with self._flush_locks_lock:
+            due = [username for username, retry_at in self._flush_retry_at.items() if retry_at <= now]
+            for username in due:
+                del self._flush_retry_at[username]
+        for username in due:
+            self.retry_outbox(username)
+
+    # Programma un nuovo tentativo di svuotare la casella in uscita dell'utente tra delay secondi
+    def schedule_outbox_retry(self, username, delay):
+        with self._flush_locks_lock:
+            self._flush_retry_at[username] = time.monotonic() + delay
+        self.peers.wake()  # Il thread di controllo dei peer ricalcola la propria attesa
+
+    # Svuota la casella in uscita dell'utente se ha ancora frame in attesa e il peer è ancora connesso
+    def retry_outbox(self, username):
+        if self.running and self.outbox.has_pending(username) and self.get_ip_by_username(username) is not None:
+            self._flush_executor.submit(self.flush_outbox, username)
+
+    # Apre la casella in uscita dell'utente (outbox/<username>.db nella cartella dei dati locali)
+    def open_outbox(self, username):
+        if self.STORE_AND_FORWARD and self.outbox is None:
+            self.outbox = PeerOutbox(data_path("outbox", f"{username}.db"))
+
+    # Funzione per avviare la rete peer-to-peer
+    def start(self, username):
+        self.running = True
+        self._stop_event.clear()
+        self.start_stats_reporter(username)
+        self.open_outbox(username)
+        self.discovery = self.create_discovery(username)
+        self.discovery_socket = open_discovery_socket(self.PORT, self.MULTICAST_GROUP, self.BIND_IP)
+        self.discovery_socket.settimeout(1.0)  # La ricezione controlla periodicamente se la rete è stata arrestata
+        self.start_public_channel()
+        # Thread per il broadcast della propria presenza sulla rete
+        broadcast_thread = threading.Thread(target=self.broadcast_presence, args=(username,))
+        broadcast_thread.daemon = True  # Imposta il thread come "demone" per terminare automaticamente alla chiusura del programma
+        broadcast_thread.start()
+
+        # Thread per ascoltare i peer sulla rete
+        listen_thread = threading.Thread(target=self.listen_for_peers)
+        listen_thread.daemon = True
+        listen_thread.start()
+
+        # Thread per monitorare lo stato dei peer
+        peer_monitor_thread = threading.Thread(target=self.update_peer_list)
+        peer_monitor_thread.daemon = True
+        peer_monitor_thread.start()
+
+    # Funzione per fermare la rete peer-to-peer
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        self.peers.wake()  # Sveglia il thread di controllo dei peer, che termina
+        if self.discovery_socket is not None:
+            datagram, addresses = self.discovery.leave()
+            self.send_discovery(datagram, *addresses)  # Gli altri peer ci rimuovono subito, senza attendere la scadenza
+            self.discovery_socket.close()
+            self.discovery_socket = None
+        self.stop_public_channel()
+        self.connection_pool.close_all()  # Chiude tutte le connessioni persistenti
+        self.stop_stats_reporter()
+        print("Arresto della rete P2P...")
+
+    # Avvia il canale multicast della chat pubblica; senza multicast i messaggi pubblici usano il fan-out TCP
+    def start_public_channel(self):
+        if self.MULTICAST_GROUP and self.public_channel is None:
+            self.public_channel = PublicChannel(self.handle_public_datagram, self.MULTICAST_GROUP)
+            self.public_channel.start()
+
+    def stop_public_channel(self):
+        if self.public_channel is not None:
+            self.public_channel.stop()
+            self.public_channel = None
+
+    # Funzione per inviare un messaggio pubblico a tutti i peer connessi
+    def send_public(self, data):
+        """Invia il frame di un messaggio pubblico con un solo datagramma multicast.
+
+        Se il canale multicast non è attivo o il messaggio è troppo grande, il frame viene inviato
+        a ogni peer connesso tramite il fan-out TCP.
+        """
+        # Il datagramma raggiunge tutti i peer: viene compresso solo se tutti sanno decomprimerlo
+        capabilities = CAP_ZLIB
+        for ip in self.peers.snapshot():
+            capabilities &= self.peers.capabilities_for(ip)
+        if self.public_channel is not None and self.public_channel.send(self.codec.encode_for(data, capabilities)):
+            self._sent.inc(type=MESSAGE_TYPE_NAMES[MSG_PUBLIC], transport="multicast")
+        else:
+            self.fanout.send(self.peers.snapshot().values(), data)
+
+    # Funzione chiamata dal canale pubblico per ogni messaggio consegnato
+    def handle_public_datagram(self, data):
+        frame = decode_frame(data)
+        if frame.msg_type != MSG_PUBLIC:
+            return  # Sul canale multicast sono ammessi solo i messaggi pubblici
+        self._received.inc(type=MESSAGE_TYPE_NAMES[MSG_PUBLIC], transport="multicast")
+        self._notify(self._on_message, frame)
+
+    # Funzione per ottenere l'IP di un peer a partire dal suo nome utente
+    def get_ip_by_username(self, username):
+        """Restituisce l'indirizzo IP associato al nome utente."""
+        return self.peers.ip_for(username)  # Ricerca nell'indice, None se l'utente non è trovato
+
+    # Funzione per ottenere l'elenco degli IP connessi
+    def get_connected_ips(self):
+        return self.peers.snapshot()  # Restituisce il dizionario degli IP connessi e dei rispettivi nomi utente
+
+    # Apre il server TCP senza accettare connessioni: quelle in arrivo attendono in coda finché
+    # start_peer_server non le accetta. Va chiamata prima di start(), così i peer che rispondono
+    # all'annuncio (ad esempio svuotando la propria casella in uscita) trovano la porta già aperta
+    def open_peer_server(self, port):
+        server_socket = self._server_sockets.get(port)
+        if server_socket is None:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # La porta resta utilizzabile subito dopo un riavvio
+            server_socket.bind((self.BIND_IP or "0.0.0.0", port))  # Senza BIND_IP ascolta su tutte le interfacce di rete
+            server_socket.listen(5)  # Imposta il numero massimo di connessioni in coda
+            self._server_sockets[port] = server_socket
+        return server_socket
+
+    # Funzione che avvia un server TCP per ricevere messaggi da un altro peer
+    def start_peer_server(self, port):
+        server_socket = self.open_peer_server(port)
+        print(f"Ascoltando sulla porta {port}...")
+
+        while True:
+            client_socket, addr = server_socket.accept()  # Accetta una connessione in ingresso
+            print(f"Connessione stabilita con {addr}")
+            threading.Thread(target=self.handle_client, args=(client_socket,)).start()  # Avvia un thread per gestire la connessione
+
+    # Funzione per gestire un client che invia frame su una connessione persistente
+    def handle_client(self, client_socket):
+        decoder = FrameDecoder()  # Ricostruisce i frame dal flusso TCP, anche se spezzati o accodati in una lettura
+        self._inbound_connections.inc()
+        try:
+            while True:
+                data = client_socket.recv(self.BUFFER_SIZE)  # Riceve i dati
+                if not data:  # Se non arrivano dati, il peer ha chiuso la connessione
+                    break
+                for frame in decoder.feed(data):
+                    self.handle_frame(frame)
+        except ProtocolError as e:
+            print(f"Frame non valido, connessione chiusa: {e}")
+        except Exception as e:
+            print(f"Errore durante la ricezione del messaggio: {e}")
+        finally:
+            self._inbound_connections.dec()
+            client_socket.close()  # Chiude la connessione
+
+    # Funzione per gestire un singolo frame ricevuto
+    def handle_frame(self, frame):
+        self._received.inc(type=MESSAGE_TYPE_NAMES.get(frame.msg_type, str(frame.msg_type)), transport="tcp")
+        if frame.msg_type == MSG_BATCH:  # Frame conservati dalla casella in uscita di un peer
+            self.handle_batch(frame)
+            return
+        if frame.msg_type == MSG_RELAY:  # Frame da consegnare all'interfaccia e da inoltrare ad altri destinatari
+            try:
+                inner_frame = decode_frame(frame.fields[0])
+            except (ProtocolError, IndexError) as e:
+                print(f"Frame da inoltrare non valido: {e}")
+                return
+            own_username = self.discovery.username if self.discovery is not None else None
+            if not self.fanout.relay(frame, inner_frame, own_username):
+                print(f"Frame da inoltrare rifiutato: {frame_type_name(frame.fields[0])}, "
+                      f"{len(frame.fields) - 1} destinatari")
+                return
+            frame = inner_frame
+
+        if frame.msg_type == MSG_CHAT_CLOSED:  # Se il messaggio riguarda la chiusura di una chat
+            print(f"La chat {frame.text(0)} è stata chiusa e sarà contrassegnata come inattiva.")
+        elif frame.msg_type == MSG_DISCONNECT:  # Se il messaggio riguarda la disconnessione di un peer
+            print(f"La chat {frame.text(0)} è stata chiusa dal peer.")
+
+        # Notifica il nuovo messaggio (all'interfaccia utente, tramite l'adattatore Qt, o al programma che usa la rete)
+        self._notify(self._on_message, frame)
+
+    # Gestisce i frame di un MSG_BATCH nell'ordine di invio, scartando quelli già ricevuti in un invio precedente
+    def handle_batch(self, frame):
+        for message_id, data in zip(frame.fields[0::2], frame.fields[1::2]):
+            if not self._delivered_ids.add(message_id):
+                self._duplicates.inc()
+                continue
+            try:
+                inner_frame = decode_frame(data)
+            except ProtocolError as e:
+                print(f"Frame conservato non valido: {e}")
+                continue
+            self.handle_frame(inner_frame)
+
+    # Funzione per inviare dei frame a un utente, o conservarli se non è connesso. Attende l'invio:
+    # pensata per i thread della pipeline di invio
+    def send_or_store(self, username, *frames):
+        """Invia i frame all'utente, oppure li conserva nella casella in uscita se non è connesso.
+
+        Se per l'utente ci sono già frame in attesa, anche i nuovi vengono accodati, così l'ordine
+        dei messaggi resta quello di invio.
+
+        Restituisce:
+            - True se i frame sono stati inviati, False se sono stati conservati.
+
+        Solleva ConnectionError se l'utente non è connesso e la casella in uscita non è attiva, e le
+        eccezioni di deliver_frame se l'invio non riesce.
+        """
+        ip = self.get_ip_by_username(username)
+        if self.outbox is not None and (ip is None or self.outbox.has_pending(username)):
+            self.store_for_later(username, *frames)
+            return False
+        if ip is None:
+            raise ConnectionError(f"{username} non è connesso")
+        for data in frames:
+            self.deliver_frame(ip, self.PEER_PORT, data)
+        return True
+
+    # Funzione per inviare lo stesso frame a più utenti senza bloccare
+    def send_to_users(self, usernames, data, on_error=None):
+        """Invia un frame agli utenti connessi tramite il fan-out e lo conserva per gli altri.
+
+        Parametri:
+            - usernames: Nomi utente dei destinatari.
+            - data: Frame già codificato.
+            - on_error: Funzione chiamata con (username, errore) per ogni invio fallito (vedi FanoutSender.send).
+
+        Restituisce:
+            - La lista degli utenti per cui il frame è stato conservato nella casella in uscita.
+        """
+        if self.outbox is None:
+            self.fanout.send(usernames, data, on_error)
+            return []
+        stored, connected = [], []
+        for username in dict.fromkeys(usernames):
+            if self.get_ip_by_username(username) is None or self.outbox.has_pending(username):
+                stored.append(username)
+            else:
+                connected.append(username)
+        for username in stored:
+            self.store_for_later(username, data)
+        self.fanout.send(connected, data, on_error)
+        return stored
+
+    # Conserva dei frame per un utente; se l'utente è connesso (e ha altri frame in attesa) la casella viene svuotata subito
+    def store_for_later(self, username, *frames):
+        self.outbox.put(username, frames)
+        self._outbox_stored.inc(len(frames))
+        if self.get_ip_by_username(username) is not None:
+            self._flush_executor.submit(self.flush_outbox, username)
+
+    # Eseguita da un thread del pool: invia all'utente i frame conservati, in blocchi MSG_BATCH sulla stessa connessione
+    def flush_outbox(self, username):
+        with self._flush_locks_lock:
+            lock = self._flush_locks.setdefault(username, threading.Lock())
+        with lock:
+            while True:
+                ip = self.get_ip_by_username(username)
+                entries = self.outbox.pending(username)
+                if ip is None or not entries:
+                    # Casella vuota, oppure peer disconnesso: verrà svuotata quando si riconnetterà
+                    with self._flush_locks_lock:
+                        self._flush_failures.pop(username, None)
+                    return
+                batch = encode_frame(MSG_BATCH, *[field for entry in entries for field in entry])
+                try:
+                    self.deliver_frame(ip, self.PEER_PORT, batch)
+                except Exception as e:
+                    # I frame restano nella casella: nuovo tentativo con attesa crescente finché il peer resta connesso
+                    with self._flush_locks_lock:
+                        failures = self._flush_failures[username] = self._flush_failures.get(username, 0) + 1
+                    delay = min(OUTBOX_RETRY_DELAY * 2 ** (failures - 1), OUTBOX_RETRY_MAX_DELAY)
+                    print(f"Consegna dei messaggi conservati per {username} non riuscita, nuovo tentativo tra {delay:g} s: {e!r}")
+                    self.schedule_outbox_retry(username, delay)
+                    return
+                self.outbox.remove(username, [message_id for message_id, _ in entries])
+                self._outbox_delivered.inc(len(entries))
+                print(f"Consegnati a {username} {len(entries)} messaggi conservati")
+
+    # Funzione per inviare un frame già codificato a un altro peer tramite TCP, riutilizzando la connessione del pool.
+    # Attende l'invio e solleva un'eccezione in caso di errore: pensata per i thread della pipeline di invio
+    def deliver_frame(self, peer_ip, peer_port, data):
+        started = time.perf_counter()
+        try:
+            self.connection_pool.send(peer_ip, peer_port, self.encode_for_peer(peer_ip, data))
+        except Exception:
+            self._record_send(data, started, failed=True)
+            raise
+        self._record_send(data, started)
+
+    # Aggiorna le metriche di un invio TCP iniziato all'istante started (time.perf_counter)
+    def _record_send(self, data, started, failed=False):
+        msg_type = frame_type_name(data)
+        if failed:
+            self._send_failures.inc(type=msg_type)
+            return
+        self._send_latency.observe(time.perf_counter() - started, type=msg_type)
+        self._sent.inc(type=msg_type, transport="tcp")
+
+    # Funzione per preparare un frame per un peer: lo comprime se il peer lo supporta e se conviene
+    def encode_for_peer(self, peer_ip, data):
+        return self.codec.encode_for(data, self.peers.capabilities_for(peer_ip))
+
+    # Funzione per inviare un frame già codificato ignorando gli errori (vengono solo stampati)
+    def send_frame(self, peer_ip, peer_port, data):
+        try:
+            self.deliver_frame(peer_ip, peer_port, data)
+        except Exception as e:
+            print(f"Errore durante l'invio del messaggio: {e}")
+
+    # Funzione per inviare un messaggio a un altro peer: codifica il tipo e i campi in un frame e lo invia
+    def send_message(self, peer_ip, peer_port, msg_type, *fields):
+        self.send_frame(peer_ip, peer_port, encode_frame(msg_type, *fields))
+
+    # Funzione per inviare una notifica che una chat è stata chiusa
+    def send_chat_closed_notification(self, chat_id):
+        """Invia una notifica indicando che una chat specifica è stata chiusa."""
+        data = encode_frame(MSG_CHAT_CLOSED, chat_id)  # Il frame è codificato una sola volta per tutti i peer
+        self.fanout.send(self.peers.snapshot().values(), data)  # Invia il messaggio a tutti i peer connessi, in parallelo
+
+    # Funzione per inviare una notifica che una connessione è stata chiusa
+    def send_disconnection_notification(self, chat_id):
+        """Invia un messaggio per indicare che una finestra di chat è stata chiusa."""
+        data = encode_frame(MSG_DISCONNECT, chat_id)
+        self.fanout.send(self.peers.snapshot().values(), data)  # Invia il messaggio a tutti i peer connessi, in parallelo
@@ -0,0 +1,56 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+
+class ConnectedUsersModel(QAbstractListModel):
+    """Modello Qt della lista degli utenti connessi, aggiornato dalle notifiche di ingresso e uscita dei peer.
+
+    Ogni notifica inserisce o rimuove una sola riga, quindi la vista ridisegna solo le righe che
+    cambiano e un client senza variazioni nella rete non esegue alcun lavoro sull'interfaccia.
+
+    Parametri:
+        - peers: Dizionario iniziale ip -> nome utente (ad esempio PeerNetwork.get_connected_ips()).
+    """
+
+    def __init__(self, peers=None, parent=None):
+        super().__init__(parent)
+        self._rows = list((peers or {}).items())  # Righe (ip, username) in ordine di connessione
+        self._index = {ip: row for row, (ip, _) in enumerate(self._rows)}  # Dizionario ip -> numero di riga
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        ip, username = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{ip}: {username}"
+        if role == Qt.UserRole:
+            return username  # Nome utente, ad esempio per aprire una chat dalla lista
+        return None
+
+    def peer_joined(self, ip, username):
+        """Aggiunge un peer in fondo alla lista, o aggiorna la sua riga se è già presente."""
+        row = self._index.get(ip)
+        if row is not None:
+            if self._rows[row][1] != username:
+                self._rows[row] = (ip, username)
+                self.dataChanged.emit(self.index(row), self.index(row))
+            return
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.append((ip, username))
+        self._index[ip] = row
+        self.endInsertRows()
+
+    def peer_left(self, ip, username=None):
+        """Rimuove la riga di un peer disconnesso, se presente."""
+        row = self._index.get(ip)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._rows[row]
+        del self._index[ip]
+        for following_row in range(row, len(self._rows)):  # Le righe successive salgono di una posizione
+            self._index[self._rows[following_row][0]] = following_row
+        self.endRemoveRows()
@@ -0,0 +1,190 @@
+import heapq
+import threading
+import time
+
+
+# Stato di un peer conosciuto: indirizzo, nome utente e scadenza dell'ultimo annuncio
+class PeerInfo:
+    __slots__ = ("ip", "username", "capabilities", "last_seen", "deadline", "scheduled")
+
+    def __init__(self, ip, username, last_seen, deadline, capabilities=0):
+        self.ip = ip  # Indirizzo IP del peer
+        self.username = username  # Nome utente annunciato dal peer
+        self.capabilities = capabilities  # Funzionalità annunciate dal peer (codec.CAP_*)
+        self.last_seen = last_seen  # Istante (time.monotonic) dell'ultimo annuncio ricevuto
+        self.deadline = deadline  # Istante dopo il quale il peer è considerato disconnesso
+        self.scheduled = deadline  # Scadenza della voce del peer nello heap (può precedere deadline)
+
+
+class PeerRegistry:
+    """Elenco dei peer connessi, condiviso tra i thread di scoperta, di invio e l'interfaccia.
+
+    Mantiene due indici (ip -> peer e nome utente -> ip) per ricerche in tempo costante e uno
+    heap delle scadenze con una sola voce per peer: un nuovo annuncio aggiorna solo la scadenza
+    del peer e la voce viene riposizionata quando arriva in cima allo heap, quindi il controllo
+    dei peer inattivi non deve scorrere l'intero elenco. Le letture usano una copia immutabile
+    (ip -> nome utente) sostituita solo quando un peer entra o esce.
+
+    Parametri:
+        - timeout: Secondi senza annunci dopo i quali un peer viene considerato disconnesso.
+    """
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._by_ip = {}  # Dizionario ip -> PeerInfo
+        self._by_username = {}  # Dizionario nome utente -> ip
+        self._heap = []  # Voci (scadenza, ip) ordinate per scadenza
+        self._snapshot = {}  # Copia ip -> nome utente restituita ai lettori, mai modificata dopo la pubblicazione
+        self._condition = threading.Condition()  # Protegge il registro e sveglia chi attende una scadenza
+        self._on_joined = []  # Funzioni chiamate con (ip, username) quando un peer si connette
+        self._on_left = []  # Funzioni chiamate con (ip, username) quando un peer si disconnette
+
+    def subscribe(self, on_joined=None, on_left=None):
+        """Registra le funzioni da chiamare quando un peer entra o esce dal registro.
+
+        Le funzioni vengono chiamate nel thread che ha provocato la modifica, senza il lock del registro.
+        """
+        if on_joined is not None:
+            self._on_joined.append(on_joined)
+        if on_left is not None:
+            self._on_left.append(on_left)
+
+    def seen(self, ip, username, ttl=None, capabilities=0):
+        """Registra l'annuncio di un peer. Restituisce True se il peer non era già connesso.
+
+        Parametri:
+            - ip: Indirizzo IP del peer.
+            - username: Nome utente annunciato.
+            - ttl: Validità dell'annuncio in secondi (predefinito il timeout del registro).
+            - capabilities: Funzionalità annunciate dal peer (codec.CAP_*).
+        """
+        now = time.monotonic()
+        deadline = now + (ttl if ttl is not None else self.timeout)
+        joined, left = [], []
+        with self._condition:
+            peer = self._by_ip.get(ip)
+            if peer is not None and peer.username != username:
+                left.append(self._remove(peer))  # Sullo stesso indirizzo si è collegato un altro utente
+                peer = None
+            if peer is None:
+                old_ip = self._by_username.get(username)
+                if old_ip is not None:
+                    left.append(self._remove(self._by_ip[old_ip]))  # L'utente ha cambiato indirizzo
+                peer = PeerInfo(ip, username, now, deadline, capabilities)
+                self._by_ip[ip] = peer
+                self._by_username[username] = ip
+                self._schedule(peer)
+                self._publish()
+                joined.append((ip, username))
+            else:
+                peer.last_seen = now
+                peer.capabilities = capabilities
+                peer.deadline = deadline
+                if deadline < peer.scheduled:  # Validità più breve della precedente: serve una voce anticipata
+                    self._schedule(peer)
+        self._notify(left, joined)
+        return bool(joined)
+
+    def remove(self, ip):
+        """Rimuove un peer (ad esempio dopo un annuncio di uscita). Restituisce True se era connesso."""
+        with self._condition:
+            peer = self._by_ip.get(ip)
+            left = [self._remove(peer)] if peer is not None else []
+        self._notify(left, [])
+        return bool(left)
+
+    def expire(self):
+        """Rimuove i peer scaduti e restituisce la lista delle coppie (ip, username) rimosse."""
+        with self._condition:
+            left = self._pop_expired(time.monotonic())
+        self._notify(left, [])
+        return left
+
+    def wait_and_expire(self, max_wait):
+        """Attende la prossima scadenza (al massimo max_wait secondi), poi rimuove i peer scaduti.
+
+        Pensata per un thread di controllo: a differenza di un controllo periodico, il thread si
+        sveglia solo quando un peer può effettivamente essere scaduto.
+        """
+        with self._condition:
+            delay = self.next_expiry_delay()
+            if delay is None or delay > 0:
+                self._condition.wait(max_wait if delay is None else min(delay, max_wait))
+            left = self._pop_expired(time.monotonic())
+        self._notify(left, [])
+        return left
+
+    def next_expiry_delay(self):
+        """Restituisce i secondi mancanti alla prossima voce dello heap, o None se il registro è vuoto."""
+        with self._condition:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - time.monotonic(), 0.0)
+
+    def wake(self):
+        """Sveglia i thread in attesa in wait_and_expire (ad esempio per l'arresto della rete)."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def ip_for(self, username):
+        """Restituisce l'indirizzo IP del peer con il nome utente indicato, o None."""
+        return self._by_username.get(username)
+
+    def capabilities_for(self, ip):
+        """Restituisce le funzionalità annunciate dal peer con l'indirizzo indicato (0 se sconosciuto)."""
+        peer = self._by_ip.get(ip)
+        return peer.capabilities if peer is not None else 0
+
+    def username_for(self, ip):
+        """Restituisce il nome utente del peer con l'indirizzo indicato, o None."""
+        return self._snapshot.get(ip)
+
+    def snapshot(self):
+        """Restituisce il dizionario ip -> nome utente dei peer connessi; non va modificato."""
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __contains__(self, ip):
+        return ip in self._snapshot
+
+    # Le funzioni seguenti vanno chiamate con il lock del registro
+
+    def _schedule(self, peer):
+        peer.scheduled = peer.deadline
+        first = not self._heap or peer.deadline < self._heap[0][0]
+        heapq.heappush(self._heap, (peer.deadline, peer.ip))
+        if first:
+            self._condition.notify_all()  # La prossima scadenza è anticipata: il thread di controllo ricalcola l'attesa
+
+    def _pop_expired(self, now):
+        left = []
+        while self._heap and self._heap[0][0] <= now:
+            scheduled, ip = heapq.heappop(self._heap)
+            peer = self._by_ip.get(ip)
+            if peer is None or peer.scheduled != scheduled:
+                continue  # Voce superata da una più recente o peer già rimosso
+            if peer.deadline <= now:
+                left.append(self._remove(peer))
+            else:
+                self._schedule(peer)  # Il peer si è annunciato di nuovo: la voce torna nello heap con la nuova scadenza
+        return left
+
+    def _remove(self, peer):
+        del self._by_ip[peer.ip]
+        if self._by_username.get(peer.username) == peer.ip:
+            del self._by_username[peer.username]
+        self._publish()
+        return peer.ip, peer.username
+
+    def _publish(self):
+        self._snapshot = {ip: peer.username for ip, peer in self._by_ip.items()}
+
+    def _notify(self, left, joined):
+        for ip, username in left:
+            for callback in self._on_left:
+                callback(ip, username)
+        for ip, username in joined:
+            for callback in self._on_joined:
+                callback(ip, username)
@@ -0,0 +1,178 @@
+import struct
+import zlib
+
+# Protocollo a frame usato sul canale TCP tra i peer.
+#
+# Ogni frame è composto da un'intestazione di 5 byte (lunghezza del corpo su 4 byte
+# in big-endian e tipo del messaggio su 1 byte) seguita dal corpo binario.
+# Il corpo è una sequenza di campi, ognuno preceduto dalla propria lunghezza su 4 byte:
+# in questo modo testo, nomi utente e testo cifrato viaggiano senza separatori
+# e senza codifiche testuali intermedie. Se il bit FLAG_COMPRESSED del tipo è impostato,
+# il corpo è compresso con zlib (vedi codec.py per la scelta dei frame da comprimere).
+
+HEADER = struct.Struct("!IB")  # Lunghezza del corpo, tipo del messaggio
+FIELD_HEADER = struct.Struct("!I")  # Lunghezza di un singolo campo
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Dimensione massima accettata per il corpo di un frame
+FLAG_COMPRESSED = 0x80  # Bit del tipo che indica un corpo compresso con zlib
+
+# Tipi di messaggio scambiati tra i peer
+MSG_PUBLIC = 1  # Campi: mittente, testo
+MSG_PRIVATE_CHAT_REQUEST = 2  # Campi: mittente
+MSG_GROUP_CHAT_REQUEST = 3  # Campi: mittente, membri del gruppo...
+MSG_GROUP_MESSAGE = 4  # Campi: mittente, testo
+MSG_PRIVATE_MESSAGE = 5  # Campi: mittente, identificativo della chiave di sessione, nonce + testo cifrato
+MSG_CHAT_CLOSED = 6  # Campi: identificativo della chat
+MSG_DISCONNECT = 7  # Campi: identificativo della chat
+MSG_SESSION_KEY = 8  # Campi: mittente, identificativo della chiave di sessione, chiave cifrata con RSA
+MSG_REKEY_REQUEST = 9  # Campi: mittente che non riesce a decifrare e chiede una nuova chiave di sessione
+MSG_RELAY = 10  # Campi: frame da consegnare, nomi utente dei destinatari a cui inoltrarlo
+MSG_BATCH = 11  # Campi: coppie (identificativo del messaggio, frame) consegnate dalla casella in uscita (outbox.py)
+
+# Nomi dei tipi di messaggio, usati come etichette delle metriche
+MESSAGE_TYPE_NAMES = {
+    MSG_PUBLIC: "public",
+    MSG_PRIVATE_CHAT_REQUEST: "private_chat_request",
+    MSG_GROUP_CHAT_REQUEST: "group_chat_request",
+    MSG_GROUP_MESSAGE: "group_message",
+    MSG_PRIVATE_MESSAGE: "private_message",
+    MSG_CHAT_CLOSED: "chat_closed",
+    MSG_DISCONNECT: "disconnect",
+    MSG_SESSION_KEY: "session_key",
+    MSG_REKEY_REQUEST: "rekey_request",
+    MSG_RELAY: "relay",
+    MSG_BATCH: "batch",
+}
+
+
+class ProtocolError(Exception):
+    """Errore sollevato quando i dati ricevuti non rispettano il formato dei frame."""
+
+
+class Frame:
+    """Messaggio decodificato: tipo e lista dei campi binari."""
+
+    __slots__ = ("msg_type", "fields")
+
+    def __init__(self, msg_type, fields):
+        self.msg_type = msg_type  # Uno dei tipi MSG_*
+        self.fields = fields  # Lista dei campi del corpo, come bytes
+
+    def text(self, index):
+        """Restituisce il campo in posizione index decodificato come testo UTF-8."""
+        return self.fields[index].decode('utf-8')
+
+    def texts(self, start=0):
+        """Restituisce i campi a partire da start decodificati come testo UTF-8."""
+        return [field.decode('utf-8') for field in self.fields[start:]]
+
+    def __repr__(self):
+        return f"Frame({self.msg_type}, {self.fields!r})"
+
+
+def encode_frame(msg_type, *fields):
+    """Codifica un messaggio in un frame pronto per l'invio.
+
+    Parametri:
+        - msg_type: Tipo del messaggio (una delle costanti MSG_*).
+        - fields: Campi del messaggio, come str (codificate in UTF-8) o bytes.
+
+    Restituisce:
+        - I byte del frame, intestazione compresa.
+    """
+    parts = []
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode('utf-8')
+        parts.append(FIELD_HEADER.pack(len(field)))
+        parts.append(field)
+    body = b"".join(parts)
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame troppo grande: {len(body)} byte")
+    return HEADER.pack(len(body), msg_type) + body
+
+
+def compress_frame(data, level=6):
+    """Restituisce il frame con il corpo compresso con zlib, oppure None se la compressione non lo riduce."""
+    length, msg_type = HEADER.unpack_from(data)
+    compressed = zlib.compress(memoryview(data)[HEADER.size:], level)
+    if len(compressed) >= length:
+        return None
+    return HEADER.pack(len(compressed), msg_type | FLAG_COMPRESSED) + compressed
+
+
+def decompress_body(body, max_size=MAX_FRAME_SIZE):
+    """Decomprime il corpo di un frame compresso, senza superare max_size byte."""
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(body, max_size)
+    except zlib.error as e:
+        raise ProtocolError(f"Corpo compresso non valido: {e}")
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ProtocolError("Corpo compresso troncato o troppo grande")
+    return body
+
+
+def decode_body(msg_type, body):
+    """Scompone il corpo di un frame nei suoi campi e restituisce il Frame corrispondente."""
+    if msg_type & FLAG_COMPRESSED:
+        msg_type &= ~FLAG_COMPRESSED
+        body = decompress_body(body)
+    fields = []
+    offset = 0
+    body = memoryview(body)
+    while offset < len(body):
+        if offset + FIELD_HEADER.size > len(body):
+            raise ProtocolError("Intestazione di campo troncata")
+        (length,) = FIELD_HEADER.unpack_from(body, offset)
+        offset += FIELD_HEADER.size
+        if offset + length > len(body):
+            raise ProtocolError("Campo troncato")
+        fields.append(bytes(body[offset:offset + length]))
+        offset += length
+    return Frame(msg_type, fields)
+
+
+def frame_type_name(data):
+    """Restituisce il nome del tipo di un frame codificato (compresso o no), letto dalla sua intestazione."""
+    msg_type = HEADER.unpack_from(data)[1] & ~FLAG_COMPRESSED
+    return MESSAGE_TYPE_NAMES.get(msg_type, str(msg_type))
+
+
+def decode_frame(data):
+    """Decodifica un singolo frame completo (ad esempio quello contenuto in un frame MSG_RELAY)."""
+    if len(data) < HEADER.size:
+        raise ProtocolError("Intestazione del frame troncata")
+    length, msg_type = HEADER.unpack_from(data)
+    if length != len(data) - HEADER.size:
+        raise ProtocolError("Lunghezza del frame non valida")
+    return decode_body(msg_type, memoryview(data)[HEADER.size:])
+
+
+class FrameDecoder:
+    """Decoder incrementale: accumula i byte letti dal socket ed estrae tutti i frame completi.
+
+    Una singola lettura può contenere più frame, oppure solo una parte di un frame:
+    i byte rimanenti restano nel buffer fino alla lettura successiva.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size  # Dimensione massima del corpo accettata
+        self._buffer = bytearray()  # Byte ricevuti e non ancora consumati
+
+    def feed(self, data):
+        """Aggiunge i byte ricevuti e restituisce la lista dei frame completati."""
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self._buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame troppo grande: {length} byte")
+            end = offset + HEADER.size + length
+            if end > len(self._buffer):
+                break  # Il frame non è ancora arrivato per intero
+            frames.append(decode_body(msg_type, self._buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self._buffer[:offset]  # Scarta i byte già consumati in un'unica operazione
+        return frames
@@ -0,0 +1,224 @@
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from discovery import open_discovery_socket
+
+# Canale multicast della chat pubblica.
+#
+# Ogni messaggio pubblico è un unico datagramma inviato al gruppo multicast, qualunque sia il
+# numero di peer in ascolto. Ogni datagramma ha un'intestazione di 13 byte (identificativo del
+# protocollo, tipo, epoca del mittente e numero di sequenza) seguita dal frame del messaggio.
+# L'epoca è scelta a caso all'avvio, così un mittente che si riavvia inizia un nuovo flusso.
+#
+# I destinatari consegnano i messaggi di ogni mittente in ordine: se un numero di sequenza
+# manca, i messaggi successivi vengono trattenuti e al mittente viene inviato in unicast un
+# NACK con i numeri mancanti, che vengono ritrasmessi dallo storico recente. Un mittente che
+# ha appena inviato dei messaggi annuncia periodicamente l'ultimo numero di sequenza
+# (HEARTBEAT), così anche la perdita dell'ultimo messaggio viene rilevata.
+
+CHANNEL_HEADER = struct.Struct("!4sBII")  # Identificativo del protocollo, tipo, epoca, numero di sequenza
+CHANNEL_MAGIC = b"CP2M"
+SEQUENCE = struct.Struct("!I")
+
+# Tipi di datagramma del canale pubblico
+CHANNEL_DATA = 1  # Messaggio: il corpo è il frame da consegnare
+CHANNEL_HEARTBEAT = 2  # Ultimo numero di sequenza inviato, per rilevare la perdita dei messaggi finali
+CHANNEL_NACK = 3  # Richiesta di ritrasmissione: il corpo è la lista dei numeri di sequenza mancanti
+
+MAX_PAYLOAD_SIZE = 8192  # I messaggi più grandi non vengono inviati sul canale multicast
+MAX_NACK_SEQUENCES = 256  # Numeri di sequenza richiesti al massimo in un NACK
+
+
+# Stato di ricezione del flusso di un mittente
+class ReceiverStream:
+    __slots__ = ("next_seq", "holdback", "missing", "nack_sent", "nack_retries")
+
+    def __init__(self, next_seq):
+        self.next_seq = next_seq  # Prossimo numero di sequenza da consegnare
+        self.holdback = {}  # Messaggi arrivati in anticipo: numero di sequenza -> frame
+        self.missing = set()  # Numeri di sequenza mancanti, già richiesti con un NACK
+        self.nack_sent = 0.0  # Istante dell'ultimo NACK inviato
+        self.nack_retries = 0  # NACK inviati senza che la lacuna sia stata colmata
+
+
+class PublicChannel:
+    """Trasporto multicast con numeri di sequenza e ritrasmissione su richiesta per la chat pubblica.
+
+    Parametri:
+        - on_message: Funzione chiamata con i byte del frame per ogni messaggio consegnato (nel thread del canale).
+        - group: Gruppo multicast del canale.
+        - port: Porta UDP del canale.
+        - history_size: Numero di messaggi inviati conservati per le ritrasmissioni.
+        - nack_interval: Secondi dopo i quali un NACK senza risposta viene ripetuto.
+        - nack_retries: Numero di NACK dopo i quali una lacuna viene saltata.
+        - heartbeat_interval: Secondi tra due HEARTBEAT dopo l'invio di un messaggio.
+        - heartbeat_count: Numero di HEARTBEAT inviati dopo l'ultimo messaggio.
+    """
+
+    def __init__(self, on_message, group, port=5002, history_size=1024, nack_interval=0.2, nack_retries=5,
+                 heartbeat_interval=1.0, heartbeat_count=3):
+        self.on_message = on_message
+        self.group = group
+        self.port = port
+        self.history_size = history_size
+        self.nack_interval = nack_interval
+        self.nack_retries = nack_retries
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_count = heartbeat_count
+        self.epoch = struct.unpack("!I", os.urandom(4))[0]  # Identifica questo flusso di invio
+        self.sock = None  # Socket UDP usato per inviare e ricevere
+        self.running = False
+        self._seq = 0  # Ultimo numero di sequenza inviato
+        self._history = {}  # Numero di sequenza -> datagramma, per le ritrasmissioni
+        self._history_order = deque()  # Numeri di sequenza nello storico, dal più vecchio
+        self._heartbeats_left = 0  # HEARTBEAT ancora da inviare dopo l'ultimo messaggio
+        self._next_heartbeat = 0.0  # Istante del prossimo HEARTBEAT
+        self._streams = {}  # Dizionario (ip, porta) -> (epoca, ReceiverStream)
+        self._lock = threading.Lock()  # Protegge numerazione e storico, usati dal thread dell'interfaccia e dal canale
+
+    def start(self):
+        """Apre il socket del canale e avvia il thread di ricezione."""
+        self.sock = open_discovery_socket(self.port, self.group)
+        self.sock.settimeout(self.nack_interval)  # La ricezione si interrompe per gestire NACK e HEARTBEAT
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        """Chiude il canale."""
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send(self, frame):
+        """Invia un frame a tutti i peer in ascolto con un solo datagramma.
+
+        Restituisce False se il canale non è attivo o il frame è troppo grande per un datagramma.
+        """
+        if self.sock is None or len(frame) > MAX_PAYLOAD_SIZE:
+            return False
+        with self._lock:
+            self._seq += 1
+            datagram = CHANNEL_HEADER.pack(CHANNEL_MAGIC, CHANNEL_DATA, self.epoch, self._seq) + frame
+            self._history[self._seq] = datagram
+            self._history_order.append(self._seq)
+            if len(self._history_order) > self.history_size:
+                del self._history[self._history_order.popleft()]
+            self._heartbeats_left = self.heartbeat_count
+            self._next_heartbeat = time.monotonic() + self.heartbeat_interval
+        return self._sendto(datagram, (self.group, self.port))
+
+    def _sendto(self, datagram, address):
+        try:
+            self.sock.sendto(datagram, address)
+        except (OSError, AttributeError) as e:
+            print(f"Errore durante l'invio sul canale pubblico: {e}")
+            return False
+        return True
+
+    # Ciclo del thread di ricezione: gestisce i datagrammi e, a ogni intervallo, NACK e HEARTBEAT
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except socket.timeout:
+                data = None
+            except (OSError, AttributeError):
+                break  # Socket chiuso da stop()
+            if data is not None:
+                self._datagram_received(data, addr)
+            self._tick(time.monotonic())
+
+    def _datagram_received(self, data, addr):
+        if len(data) < CHANNEL_HEADER.size or data[:len(CHANNEL_MAGIC)] != CHANNEL_MAGIC:
+            return
+        _, kind, epoch, seq = CHANNEL_HEADER.unpack_from(data)
+        body = data[CHANNEL_HEADER.size:]
+        if kind == CHANNEL_NACK:
+            if epoch == self.epoch:
+                self._retransmit(body, addr)
+            return
+        if kind not in (CHANNEL_DATA, CHANNEL_HEARTBEAT):
+            return
+
+        entry = self._streams.get(addr)
+        if entry is None or entry[0] != epoch:
+            # Nuovo mittente (o mittente riavviato): si parte dal messaggio corrente, senza recuperare i precedenti
+            stream = ReceiverStream(seq if kind == CHANNEL_DATA else seq + 1)
+            self._streams[addr] = (epoch, stream)
+        else:
+            stream = entry[1]
+
+        if kind == CHANNEL_DATA:
+            if seq < stream.next_seq or seq in stream.holdback:
+                return  # Duplicato o ritrasmissione già ricevuta
+            stream.holdback[seq] = body
+            stream.missing.discard(seq)
+        end = seq if kind == CHANNEL_DATA else seq + 1  # Un HEARTBEAT annuncia un messaggio già inviato
+        if end - stream.next_seq > self.history_size:
+            stream.next_seq = end - self.history_size  # I messaggi più vecchi non sono più nello storico del mittente
+        # I numeri tra il prossimo atteso e l'ultimo ricevuto non ancora arrivati sono lacune da richiedere
+        new_missing = [missing_seq for missing_seq in range(stream.next_seq, end)
+                       if missing_seq not in stream.holdback and missing_seq not in stream.missing]
+        if new_missing:
+            stream.missing.update(new_missing)
+            self._send_nack(addr, epoch, stream, time.monotonic())
+        self._deliver_ready(stream)
+
+    # Consegna in ordine i messaggi disponibili a partire dal prossimo numero di sequenza atteso
+    def _deliver_ready(self, stream):
+        while stream.next_seq in stream.holdback:
+            self._deliver(stream.holdback.pop(stream.next_seq))
+            stream.next_seq += 1
+        if not stream.missing:
+            stream.nack_retries = 0
+
+    def _deliver(self, frame):
+        try:
+            self.on_message(frame)
+        except Exception as e:
+            print(f"Messaggio pubblico non valido: {e!r}")
+
+    def _send_nack(self, addr, epoch, stream, now):
+        sequences = sorted(stream.missing)[:MAX_NACK_SEQUENCES]
+        body = b"".join(SEQUENCE.pack(missing_seq) for missing_seq in sequences)
+        self._sendto(CHANNEL_HEADER.pack(CHANNEL_MAGIC, CHANNEL_NACK, epoch, 0) + body, addr)  # NACK in unicast al mittente
+        stream.nack_sent = now
+        stream.nack_retries += 1
+
+    # Ritrasmette in unicast a chi l'ha richiesto i messaggi ancora presenti nello storico
+    def _retransmit(self, body, addr):
+        for offset in range(0, len(body) - SEQUENCE.size + 1, SEQUENCE.size):
+            (seq,) = SEQUENCE.unpack_from(body, offset)
+            with self._lock:
+                datagram = self._history.get(seq)
+            if datagram is not None:
+                self._sendto(datagram, addr)
+
+    # Ripete i NACK senza risposta, salta le lacune non recuperabili e invia gli HEARTBEAT
+    def _tick(self, now):
+        for addr, (epoch, stream) in list(self._streams.items()):
+            if not stream.missing or now - stream.nack_sent < self.nack_interval:
+                continue
+            if stream.nack_retries < self.nack_retries:
+                self._send_nack(addr, epoch, stream, now)
+            else:
+                # Messaggi non più disponibili presso il mittente: si consegnano quelli successivi
+                print(f"Messaggi pubblici persi da {addr[0]}: {len(stream.missing)}")
+                stream.next_seq = max(list(stream.holdback) + list(stream.missing)) + 1
+                stream.missing.clear()
+                for seq in sorted(stream.holdback):
+                    self._deliver(stream.holdback.pop(seq))
+                stream.nack_retries = 0
+
+        with self._lock:
+            heartbeat = self._heartbeats_left > 0 and now >= self._next_heartbeat
+            if heartbeat:
+                self._heartbeats_left -= 1
+                self._next_heartbeat = now + self.heartbeat_interval
+                datagram = CHANNEL_HEADER.pack(CHANNEL_MAGIC, CHANNEL_HEARTBEAT, self.epoch, self._seq)
+        if heartbeat:
+            self._sendto(datagram, (self.group, self.port))
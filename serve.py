@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import API
+
+# Avvio del server API in produzione, su più processi e quindi su più core.
+#
+# Modello di concorrenza:
+# - gunicorn avvia `workers` processi di lavoro (predefinito uno per core), ognuno con `threads`
+#   thread che servono le richieste. Il lavoro che occupa la CPU (hash delle password, generazione
+#   RSA, serializzazione JSON) procede in parallelo su core diversi invece di accodarsi dietro un
+#   solo processo, come accadeva con il server di sviluppo all'inizio di un turno.
+# - L'applicazione viene caricata una sola volta nel processo principale (preload_app), dove
+#   init_db() applica le migrazioni prima che i processi di lavoro vengano creati: nessun processo
+#   di lavoro modifica lo schema.
+# - Ogni richiesta prende una connessione SQLite dalla riserva del proprio processo (API.get_db) e la
+#   restituisce alla fine; le connessioni del processo principale non passano ai figli
+#   (API.reset_connections_after_fork). In modalità WAL le letture di tutti i processi procedono in
+#   parallelo, mentre le scritture sono serializzate da SQLite e attendono il proprio turno fino a 30 secondi.
+# - Ogni processo di lavoro ha la propria riserva di chiavi RSA con key_workers processi di
+#   generazione: la riserva del padre non viene ereditata, così due processi non consegnano mai la
+#   stessa coppia di chiavi.
+# - Le metriche di /metrics sono per processo: ogni risposta riporta i valori del processo che l'ha servita.
+#
+# Uso: `python3 serve.py` oppure `gunicorn -c serve.py API:app`. La configurazione si modifica con le
+# variabili d'ambiente CHAT_P2P_API_BIND, CHAT_P2P_API_WORKERS e CHAT_P2P_API_THREADS. Senza gunicorn
+# (ad esempio su Windows) `python3 serve.py` usa il server di Werkzeug, in un solo processo con più thread.
+
+# Impostazioni lette da gunicorn quando questo file è indicato con -c
+bind = os.environ.get("CHAT_P2P_API_BIND", "0.0.0.0:5003")  # Indirizzo e porta del server
+workers = int(os.environ.get("CHAT_P2P_API_WORKERS", multiprocessing.cpu_count()))  # Processi di lavoro
+threads = int(os.environ.get("CHAT_P2P_API_THREADS", 8))  # Thread per processo: le richieste attendono soprattutto SQLite
+worker_class = "gthread"
+preload_app = True
+timeout = 60  # Secondi dopo i quali un processo di lavoro bloccato viene sostituito
+
+key_workers = max(multiprocessing.cpu_count() // workers, 1)  # Processi di generazione RSA per processo di lavoro
+
+
+# Eseguita una volta nel processo principale, prima di creare i processi di lavoro
+def on_starting(server):
+    API.init_db()
+
+
+# Eseguita in ogni processo di lavoro appena creato, prima che inizi a servire richieste
+def post_fork(server, worker):
+    API.key_pool.workers = key_workers
+    API.key_pool.start()
+
+
+def worker_exit(server, worker):
+    API.key_pool.stop()
+
+
+def main():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn non è installato: il server usa un solo processo (pip install gunicorn per usarne più di uno)")
+        API.init_db()
+        API.key_pool.start()
+        host, port = bind.rsplit(":", 1)
+        API.app.run(host=host, port=int(port), threaded=True)
+        return
+
+    # Applicazione gunicorn configurata con le impostazioni di questo file, senza riga di comando
+    class APIServer(BaseApplication):
+        def load_config(self):
+            settings = {"bind": bind, "workers": workers, "threads": threads, "worker_class": worker_class,
+                        "preload_app": preload_app, "timeout": timeout, "on_starting": on_starting,
+                        "post_fork": post_fork, "worker_exit": worker_exit}
+            for name, value in settings.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return API.app
+
+    APIServer().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Cifratura ibrida dei messaggi privati.
+#
+# Per ogni conversazione il mittente genera una chiave di sessione AES-256-GCM, la cifra
+# una sola volta con la chiave pubblica RSA del destinatario (RSA-OAEP) e la invia in un
+# frame MSG_SESSION_KEY. I messaggi successivi sono cifrati solo con AES-GCM, senza
+# operazioni asimmetriche e senza limiti di lunghezza. La chiave viene ruotata dopo un
+# certo numero di messaggi o dopo un certo tempo.
+
+KEY_ID_SIZE = 8  # Lunghezza in byte dell'identificativo della chiave di sessione
+NONCE_SIZE = 12  # Lunghezza in byte del nonce AES-GCM
+ROTATE_AFTER_MESSAGES = 1000  # Numero di messaggi dopo il quale la chiave di sessione viene ruotata
+ROTATE_AFTER_SECONDS = 3600  # Durata massima in secondi di una chiave di sessione
+
+OAEP_PADDING = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+class SessionKeyError(Exception):
+    """Errore sollevato quando un messaggio usa una chiave di sessione sconosciuta o non valida."""
+
+
+class OutgoingSession:
+    """Chiave di sessione usata per cifrare i messaggi verso un destinatario."""
+
+    def __init__(self):
+        self.key = AESGCM.generate_key(bit_length=256)  # Chiave simmetrica della sessione
+        self.key_id = os.urandom(KEY_ID_SIZE)  # Identificativo casuale, incluso in ogni messaggio
+        self.aesgcm = AESGCM(self.key)
+        self.created = time.monotonic()  # Istante di creazione, per la rotazione a tempo
+        self.messages = 0  # Numero di messaggi cifrati con questa chiave
+
+    def expired(self):
+        return (self.messages >= ROTATE_AFTER_MESSAGES
+                or time.monotonic() - self.created >= ROTATE_AFTER_SECONDS)
+
+
+def associated_data(sender, recipient, key_id):
+    """Dati autenticati (non cifrati) che legano il testo cifrato a mittente, destinatario e chiave."""
+    return sender.encode('utf-8') + b"\0" + recipient.encode('utf-8') + b"\0" + key_id
+
+
+class SessionKeyManager:
+    """Gestisce le chiavi di sessione in uscita e in ingresso dell'utente corrente.
+
+    Parametri:
+        - username: Nome dell'utente corrente.
+        - public_key_provider: Funzione che, dato un nome utente, restituisce la sua chiave pubblica RSA (o None).
+        - private_key_provider: Funzione che, dato un nome utente, restituisce la sua chiave privata RSA (o None).
+    """
+
+    def __init__(self, username, public_key_provider, private_key_provider):
+        self.username = username
+        self.public_key_provider = public_key_provider
+        self.private_key_provider = private_key_provider
+        self._outgoing = {}  # Dizionario destinatario -> OutgoingSession
+        self._incoming = {}  # Dizionario (mittente, key_id) -> AESGCM
+        self._lock = threading.Lock()  # Le sessioni possono essere usate da più thread
+
+    def encrypt(self, recipient, plaintext):
+        """Cifra un messaggio per il destinatario, creando o ruotando la chiave di sessione se necessario.
+
+        Restituisce:
+            - wrapped_key: Chiave di sessione cifrata con RSA da inviare prima del messaggio,
+              oppure None se il destinatario conosce già la chiave in uso.
+            - key_id: Identificativo della chiave di sessione usata.
+            - payload: Nonce seguito dal testo cifrato AES-GCM.
+            Restituisce None se la chiave pubblica del destinatario non è disponibile.
+        """
+        wrapped_key = None
+        with self._lock:
+            session = self._outgoing.get(recipient)
+            if session is not None and not session.expired():
+                session.messages += 1
+            else:
+                session = None
+        if session is None:
+            # Chiave pubblica (che può richiedere una chiamata all'API) e cifratura RSA fuori dal lock:
+            # decrypt(), chiamata dal thread dell'interfaccia, non deve attenderle
+            public_key = self.public_key_provider(recipient)
+            if public_key is None:
+                return None
+            new_session = OutgoingSession()
+            new_wrapped_key = public_key.encrypt(new_session.key, OAEP_PADDING)  # Unica operazione RSA della sessione
+            with self._lock:
+                session = self._outgoing.get(recipient)
+                if session is None or session.expired():
+                    session, wrapped_key = new_session, new_wrapped_key
+                    self._outgoing[recipient] = session
+                # Altrimenti un altro thread ha creato la sessione nel frattempo: si usa la sua e si scarta questa
+                session.messages += 1
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = session.aesgcm.encrypt(nonce, plaintext.encode('utf-8'),
+                                            associated_data(self.username, recipient, session.key_id))
+        return wrapped_key, session.key_id, nonce + ciphertext
+
+    def accept_session_key(self, sender, key_id, wrapped_key):
+        """Decifra con la chiave privata una chiave di sessione ricevuta e la memorizza."""
+        private_key = self.private_key_provider(self.username)
+        if private_key is None:
+            raise SessionKeyError("Chiave privata non disponibile")
+        key = private_key.decrypt(wrapped_key, OAEP_PADDING)
+        with self._lock:
+            # Le chiavi precedenti dello stesso mittente non servono più dopo la rotazione
+            for old in [entry for entry in self._incoming if entry[0] == sender]:
+                del self._incoming[old]
+            self._incoming[(sender, key_id)] = AESGCM(key)
+
+    def decrypt(self, sender, key_id, payload):
+        """Decifra un messaggio ricevuto con la chiave di sessione indicata da key_id."""
+        with self._lock:
+            aesgcm = self._incoming.get((sender, key_id))
+        if aesgcm is None:
+            raise SessionKeyError(f"Chiave di sessione sconosciuta per {sender}")
+        nonce, ciphertext = payload[:NONCE_SIZE], payload[NONCE_SIZE:]
+        try:
+            return aesgcm.decrypt(nonce, ciphertext, associated_data(sender, self.username, key_id)).decode('utf-8')
+        except Exception as e:
+            raise SessionKeyError(f"Messaggio non valido: {e!r}") from e
+
+    def reset(self, recipient):
+        """Scarta la sessione in uscita verso il destinatario: il prossimo messaggio ne creerà una nuova."""
+        with self._lock:
+            self._outgoing.pop(recipient, None)
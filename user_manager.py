@@ -39,3 +39,17 @@ class UserManager:
             return True, response.json()["message"]  # Restituisce True e il messaggio di successo
         return False, response.json()["message"]  # Se il login fallisce, restituisce False e il messaggio di errore
 
+    def fetch_private_key_pem(self, username):
+        """
+        Questo metodo recupera dall'API la chiave privata di un utente, in formato PEM.
+        Viene chiamato solo quando la chiave non è già presente nel keystore locale (vedi keystore.PrivateKeyHolder).
+
+        :param username: Il nome utente di cui recuperare la chiave privata.
+
+        :return: La chiave privata in formato PEM, oppure None se non è disponibile.
+        """
+        response = requests.get(f"{self.BASE_URL}/get_private_key/{username}", timeout=5)
+        if response.status_code == 200:
+            return response.json().get("private_key")
+        return None
+